@@ -55,7 +55,10 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
         self.dbCombo.activated.connect(self.updateComplexClass)
         self.complexCombo.activated.connect(self.loadAssociatedFeatures)
         self.iface.newProjectCreated.connect(self.clearDock)
+        self.treeWidget.itemExpanded.connect(self.populateComplexItem)
 
+        #associated features of complex items not yet expanded: {complex uuid: {aggregated class: [ids]}}
+        self.pendingComplexDict = dict()
         self.abstractDb = None
         self.databases = None
         self.abstractDbFactory = DbFactory()
@@ -79,6 +82,7 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
         Clears the complex dock widget
         """
         self.treeWidget.clear()
+        self.pendingComplexDict = dict()
         self.dbCombo.clear()
         self.complexCombo.clear()
 
@@ -221,6 +225,7 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
         item = self.treeWidget.selectedItems()[0]
         #checking if the item is a complex (it should have depth = 2)
         if self.depth(item) == 2:
+            self.populateComplexItem(item)
             bbox = QgsRectangle()
             for i in range(item.childCount()):
                 aggregated_item = item.child(i)
@@ -262,6 +267,7 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
             if len(items) == 0:
                 return
             complexItem = items[0]
+            self.populateComplexItem(complexItem)
             count = complexItem.childCount()
             for i in range(count):
                 self.disassociateAggregatedClass(complexItem.child(i))
@@ -384,6 +390,7 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
         Loads all features associated to a complex
         """
         self.treeWidget.clear()
+        self.pendingComplexDict = dict()
 
         if self.complexCombo.currentIndex() == 0:
             return
@@ -396,13 +403,44 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
         except Exception as e:
             QMessageBox.critical(self.iface.mainWindow(), self.tr('Critical'), self.tr('A problem occurred! Check log for details.'))
             QgsMessageLog.logMessage(':'.join(e.args), 'DSG Tools Plugin', QgsMessageLog.CRITICAL)
-            
+
+        if len(associatedDict.keys()) == 0:
+            return
+        #only the complex items are created now, their associated features are added when they are expanded
+        classNameItem = self.createTreeItem(self.treeWidget.invisibleRootItem(), complex)
+        complexItemList = []
         for name in associatedDict.keys():
             for complex_uuid in associatedDict[name].keys():
-                self.addAssociatedFeature(complex, name, complex_uuid, None, None)
-                for aggregated_class in associatedDict[name][complex_uuid]:
-                    for ogc_fid in associatedDict[name][complex_uuid][aggregated_class]:
-                        self.addAssociatedFeature(complex, name, complex_uuid, aggregated_class, ogc_fid)
+                complexNameItem = QTreeWidgetItem()
+                complexNameItem.setText(0, name)
+                complexNameItem.setText(1, str(complex_uuid))
+                aggregatedDict = {aggregated_class : ids for aggregated_class, ids in associatedDict[name][complex_uuid].iteritems() if len(ids) > 0}
+                if len(aggregatedDict.keys()) > 0:
+                    complexNameItem.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+                    self.pendingComplexDict[str(complex_uuid)] = aggregatedDict
+                complexItemList.append(complexNameItem)
+        classNameItem.addChildren(complexItemList)
+
+    def populateComplexItem(self, item):
+        """
+        Adds the associated classes and feature ids to a complex item, if they were not added yet
+        item: complex item (depth = 2)
+        """
+        if self.depth(item) != 2:
+            return
+        aggregatedDict = self.pendingComplexDict.pop(item.text(1), None)
+        if aggregatedDict is None:
+            return
+        for aggregated_class in aggregatedDict.keys():
+            associatedClassItem = QTreeWidgetItem(item)
+            associatedClassItem.setText(0, aggregated_class)
+            idItemList = []
+            for associatedId in aggregatedDict[aggregated_class]:
+                idItem = QTreeWidgetItem()
+                idItem.setText(0, str(associatedId))
+                idItemList.append(idItem)
+            associatedClassItem.addChildren(idItemList)
+        item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
 
     def depth(self, item):
         """
@@ -510,25 +548,6 @@ class ComplexWindow(QtGui.QDockWidget, FORM_CLASS):
                     item = child
         return item
 
-    def addAssociatedFeature(self, className, complexName, complexId, associatedClass, associatedId):
-        """
-        Adds a feature to a complex
-        className: class name
-        complexName: complex name
-        complexId: complex uuid
-        associatedClass: associated class
-        associatedId: associated id
-        """
-        #get the corresponding top level item
-        classNameItem = self.createTreeItem(self.treeWidget.invisibleRootItem(), className)
-        #get the corresponding complex item
-        complexNameItem = self.createTreeItem(classNameItem, complexName, complexId)
-        if associatedClass and associatedId:
-            #get the corresponding class item
-            associatedClassItem = self.createTreeItem(complexNameItem, associatedClass)
-            #creates the corresponding associated item
-            self.createTreeItem(associatedClassItem, str(associatedId))
-
     def __test(self, x):
         if (x.parent() == None) :
             return True
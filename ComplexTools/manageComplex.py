@@ -46,6 +46,35 @@ class CustomTableModel(QSqlTableModel):
         QSqlTableModel.__init__(self, parent=parent, db=db)
         self.dict = domainDict
         self.db = db
+        # column name: (code to code name dict, code name to code dict)
+        self.domainCache = dict()
+        # column index: column name, or None when the column has no domain
+        self.columnDomainDict = dict()
+
+    def setTable(self, tableName):
+        """
+        Sets the table and drops the column index cache
+        """
+        self.columnDomainDict = dict()
+        QSqlTableModel.setTable(self, tableName)
+
+    def setDomainDict(self, domainDict):
+        """
+        Replaces the domain dictionary and invalidates the cached domain values
+        """
+        self.dict = domainDict
+        self.invalidateDomainCache()
+
+    def invalidateDomainCache(self, column = None):
+        """
+        Drops the cached values of a column domain (or of all domains when column is None).
+        Must be called when a domain table changes.
+        """
+        if column is None:
+            self.domainCache = dict()
+        else:
+            self.domainCache.pop(column, None)
+        self.columnDomainDict = dict()
 
     def makeValueRelationDict(self, table, codes):
         """
@@ -67,6 +96,31 @@ class CustomTableModel(QSqlTableModel):
 
         return ret
 
+    def getDomainMaps(self, column):
+        """
+        Gets the domain of a column as a (code to code name, code name to code) pair of dicts.
+        Value relation tables are queried only once.
+        """
+        if column not in self.domainCache:
+            if isinstance(self.dict[column], dict):
+                nameToCode = self.dict[column]
+            else:
+                tupla = self.dict[column]
+                nameToCode = self.makeValueRelationDict(tupla[0], tupla[1])
+            codeToName = {str(code) : code_name for code_name, code in nameToCode.iteritems()}
+            self.domainCache[column] = (codeToName, nameToCode)
+        return self.domainCache[column]
+
+    def getDomainColumn(self, index):
+        """
+        Gets the name of the column of index if it has a domain, otherwise None
+        """
+        columnIndex = index.column()
+        if columnIndex not in self.columnDomainDict:
+            column = self.headerData(columnIndex, Qt.Horizontal)
+            self.columnDomainDict[columnIndex] = column if self.dict.has_key(column) else None
+        return self.columnDomainDict[columnIndex]
+
     def flags(self, index):
         """
         Gets index flags
@@ -83,25 +137,20 @@ class CustomTableModel(QSqlTableModel):
         role: role used to get the data
         """
         dbdata = QSqlTableModel.data(self, index, role)
-        column = self.headerData(index.column(), Qt.Horizontal)
-        if self.dict.has_key(column):
-            if isinstance(self.dict[column], dict):
-                valueMap = self.dict[column]
-                if str(dbdata) in valueMap.values():
-                    id = valueMap.values().index(str(dbdata))
-                    return valueMap.keys()[id]
-            elif isinstance(self.dict[column], tuple):
-                tupla = self.dict[column]
-                valueMap = self.makeValueRelationDict(tupla[0], tupla[1])
-                codes = str(dbdata)[1:-1].split(',')
-                code_names = list()
-                for c in codes:
-                    if str(c) in valueMap.values():
-                        id = valueMap.values().index(str(c))
-                        code_name = valueMap.keys()[id]
-                        code_names.append(code_name)
-                if len(code_names) > 0:
-                    return '{%s}' % ','.join(code_names)
+        if role not in (Qt.DisplayRole, Qt.EditRole):
+            return dbdata
+        column = self.getDomainColumn(index)
+        if column is None:
+            return dbdata
+        codeToName, nameToCode = self.getDomainMaps(column)
+        if isinstance(self.dict[column], dict):
+            if str(dbdata) in codeToName:
+                return codeToName[str(dbdata)]
+        elif isinstance(self.dict[column], tuple):
+            codes = str(dbdata)[1:-1].split(',')
+            code_names = [codeToName[c] for c in codes if c in codeToName]
+            if len(code_names) > 0:
+                return '{%s}' % ','.join(code_names)
         return dbdata
 
     def setData(self, index, value, role=Qt.EditRole):
@@ -112,19 +161,17 @@ class CustomTableModel(QSqlTableModel):
         value: value to be set
         role: role used
         """
-        column = self.headerData(index.column(), Qt.Horizontal)
         newValue = value
-        if self.dict.has_key(column):
+        column = self.getDomainColumn(index)
+        if column is not None:
+            codeToName, nameToCode = self.getDomainMaps(column)
             if isinstance(self.dict[column], dict):
-                valueMap = self.dict[column]
-                newValue = int(valueMap[value])
+                newValue = int(nameToCode[value])
             elif isinstance(self.dict[column], tuple):
-                tupla = self.dict[column]
-                valueMap = self.makeValueRelationDict(tupla[0], tupla[1])
                 code_names = value[1:-1].split(',')
                 codes = []
                 for code_name in code_names:
-                    code = valueMap[code_name]
+                    code = nameToCode[code_name]
                     codes.append(code)
                 if len(codes) > 0:
                     newValue = '{%s}' % ','.join(map(str, codes))
@@ -306,33 +353,12 @@ class ManageComplexDialog(QDialog, FORM_CLASS):
         """
         Generates a lit widget delegate
         """
-        #making a dict in the same way used for the Combobox delegate
-        valueRelation = self.makeValueRelationDict(tupla[0], tupla[1])
+        #making a dict in the same way used for the Combobox delegate (reusing the values cached by the model)
+        codeToName, valueRelation = self.projectModel.getDomainMaps(column)
         #creating the delagate
         list = ListWidgetDelegate(self, valueRelation, self.projectModel.fieldIndex(column))
         self.tableView.setItemDelegateForColumn(self.projectModel.fieldIndex(column), list)
 
-    def makeValueRelationDict(self, table, codes):
-        """
-        Makes the value relation dictionary
-        """
-        #query to obtain the dict with code names and related codes
-        ret = dict()
-
-        in_clause = '(%s)' % ",".join(map(str, codes))
-        if self.db.driverName() == 'QPSQL':
-            sql = 'select code, code_name from dominios.%s where code in %s' % (table, in_clause)
-        elif self.db.driverName() == 'QSQLITE':
-            sql = 'select code, code_name from dominios_%s where code in %s' % (table, in_clause)
-
-        query = QSqlQuery(sql, self.db)
-        while query.next():
-            code = query.value(0)
-            code_name = query.value(1)
-            ret[code_name] = code
-
-        return ret
-
     def updateTableView(self):
         """
         Updates the table view
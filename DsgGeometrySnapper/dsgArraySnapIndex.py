@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2017-03-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2017 by Luiz Andrade - Cartographic Engineer @ Brazilian Army
+        email                : luiz.claudio@dsg.eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import numpy
+
+from qgis.core import QgsVertexId, QgsPointV2, QgsCircularStringV2, QgsMultiPolygonV2, QgsPolygonV2
+
+from DsgTools.DsgGeometrySnapper.raytracer import Raytracer
+
+class DsgArraySnapIndex:
+    """
+    Read-only counterpart of DsgSnapIndex.
+    Nodes and segments are stored in contiguous coordinate arrays and the grid cells
+    are stored CSR-style: a sorted array of cell keys plus offsets into the item arrays.
+    Geometries are added first and the cells are built on the first query.
+    """
+    SnapPoint, SnapSegment = range(2)
+
+    def __init__(self, origin, cellSize):
+        """
+        Constructor
+        :param origin: QgsPointV2
+        :param cellSize: double
+        """
+        self.origin = origin
+        self.cellSize = cellSize
+        self.nodeList = []
+        self.segmentList = []
+        self.isBuilt = False
+
+    def addGeometry(self, geom):
+        """
+        Add geometry into the index. Vertices and segments are the same ones indexed by DsgSnapIndex.addGeometry
+        :param geom:QgsAbstractGeometryV2
+        :return:
+        """
+        for iPart in xrange(geom.partCount()):
+            for iRing in xrange(geom.ringCount(iPart)):
+                nVerts = geom.vertexCount(iPart, iRing)
+                if isinstance(geom, QgsMultiPolygonV2):
+                    nVerts -= 1
+                elif isinstance(geom, QgsPolygonV2):
+                    nVerts -= 1
+                elif isinstance(geom, QgsCircularStringV2):
+                    nVerts -= 1
+                points = []
+                for iVert in xrange(min(nVerts + 1, geom.vertexCount(iPart, iRing))):
+                    p = geom.vertexAt(QgsVertexId(iPart, iRing, iVert, QgsVertexId.SegmentVertex))
+                    points.append((p.x(), p.y()))
+                for iVert in xrange(nVerts):
+                    self.nodeList.append(points[iVert])
+                    if iVert < nVerts - 1:
+                        self.segmentList.append(points[iVert] + points[iVert + 1])
+        self.isBuilt = False
+
+    def buildCells(self):
+        """
+        Builds the coordinate arrays and the CSR cell -> item structure
+        :return:
+        """
+        ox, oy = self.origin.x(), self.origin.y()
+        self.nodes = numpy.array(self.nodeList, dtype=numpy.float64).reshape(-1, 2)
+        self.segments = numpy.array(self.segmentList, dtype=numpy.float64).reshape(-1, 4)
+        nodeCols = numpy.floor((self.nodes[:, 0] - ox) / self.cellSize).astype(numpy.int64)
+        nodeRows = numpy.floor((self.nodes[:, 1] - oy) / self.cellSize).astype(numpy.int64)
+        # segments are raytraced along the grid exactly as in DsgSnapIndex.addSegment
+        segmentIds, segmentCols, segmentRows = [], [], []
+        for i, (x0, y0, x1, y1) in enumerate(self.segmentList):
+            rt = Raytracer((x0 - ox) / self.cellSize, (y0 - oy) / self.cellSize, (x1 - ox) / self.cellSize, (y1 - oy) / self.cellSize)
+            while rt.isValid():
+                rt.next()
+                segmentIds.append(i)
+                segmentCols.append(rt.curCol())
+                segmentRows.append(rt.curRow())
+        types = numpy.concatenate((numpy.zeros(len(self.nodes), dtype=numpy.int8), numpy.ones(len(segmentIds), dtype=numpy.int8)))
+        ids = numpy.concatenate((numpy.arange(len(self.nodes), dtype=numpy.int64), numpy.array(segmentIds, dtype=numpy.int64)))
+        cols = numpy.concatenate((nodeCols, numpy.array(segmentCols, dtype=numpy.int64)))
+        rows = numpy.concatenate((nodeRows, numpy.array(segmentRows, dtype=numpy.int64)))
+        if len(ids) == 0:
+            self.colMin = self.rowMin = 0
+            self.nCols = self.nRows = 0
+        else:
+            self.colMin, self.rowMin = cols.min(), rows.min()
+            self.nCols = cols.max() - self.colMin + 1
+            self.nRows = rows.max() - self.rowMin + 1
+        keys = (rows - self.rowMin) * self.nCols + (cols - self.colMin)
+        # stable sort keeps the insertion order of the items inside each cell
+        order = numpy.argsort(keys, kind='mergesort')
+        self.itemTypes = types[order]
+        self.itemIds = ids[order]
+        self.cellKeys, starts = numpy.unique(keys[order], return_index=True)
+        self.cellOffsets = numpy.append(starts, len(keys)).astype(numpy.int64)
+        self.isBuilt = True
+
+    def getCellItems(self, ownerIds, cols, rows):
+        """
+        Expands (owner, col, row) cell requests into (owner, item position) pairs
+        :param ownerIds: numpy array of int
+        :param cols: numpy array of int
+        :param rows: numpy array of int
+        :return: (numpy array of owner ids, numpy array of positions into self.itemIds)
+        """
+        inside = (cols >= self.colMin) & (cols < self.colMin + self.nCols) & (rows >= self.rowMin) & (rows < self.rowMin + self.nRows)
+        ownerIds, cols, rows = ownerIds[inside], cols[inside], rows[inside]
+        keys = (rows - self.rowMin) * self.nCols + (cols - self.colMin)
+        pos = numpy.searchsorted(self.cellKeys, keys)
+        found = pos < len(self.cellKeys)
+        found[found] = self.cellKeys[pos[found]] == keys[found]
+        ownerIds, pos = ownerIds[found], pos[found]
+        starts = self.cellOffsets[pos]
+        counts = self.cellOffsets[pos + 1] - starts
+        return numpy.repeat(ownerIds, counts), self.expandRanges(starts, counts)
+
+    def expandRanges(self, starts, counts):
+        """
+        Concatenates the ranges [start, start + count) into a single array
+        :param starts: numpy array of int
+        :param counts: numpy array of int
+        :return: numpy array of int
+        """
+        offsets = numpy.cumsum(counts) - counts
+        return numpy.repeat(starts - offsets, counts) + numpy.arange(counts.sum(), dtype=numpy.int64)
+
+    def getClosestPerOwner(self, ownerIds, itemIds, sqrDists, nOwners):
+        """
+        Picks, for each owner, the first item with the smallest squared distance
+        :return: (item ids with -1 where there is none, positions into the input arrays, squared distances)
+        """
+        bestIds = numpy.full(nOwners, -1, dtype=numpy.int64)
+        bestPos = numpy.full(nOwners, -1, dtype=numpy.int64)
+        bestDists = numpy.full(nOwners, numpy.inf)
+        if len(ownerIds) == 0:
+            return bestIds, bestPos, bestDists
+        # lexsort is stable, so ties keep the cell scan order like DsgSnapIndex.getSnapItem
+        order = numpy.lexsort((sqrDists, ownerIds))
+        sortedOwners = ownerIds[order]
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = sortedOwners[1:] != sortedOwners[:-1]
+        order = order[first]
+        bestIds[ownerIds[order]] = itemIds[order]
+        bestPos[ownerIds[order]] = order
+        bestDists[ownerIds[order]] = sqrDists[order]
+        return bestIds, bestPos, bestDists
+
+    def getSnapItems(self, points, tol):
+        """
+        Batched version of DsgSnapIndex.getSnapItem: finds the closest node and segment for every point at once
+        :param points: numpy array (n, 2) of x, y coordinates
+        :param tol: double
+        :return: two tuples (ids, snapped points, squared distances), for nodes and for segments.
+        Ids are -1 and distances are inf where nothing was found within tolerance.
+        """
+        if not self.isBuilt:
+            self.buildCells()
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        n = len(points)
+        ox, oy = self.origin.x(), self.origin.y()
+        colStart = numpy.floor((points[:, 0] - tol - ox) / self.cellSize).astype(numpy.int64)
+        rowStart = numpy.floor((points[:, 1] - tol - oy) / self.cellSize).astype(numpy.int64)
+        colEnd = numpy.floor((points[:, 0] + tol - ox) / self.cellSize).astype(numpy.int64)
+        rowEnd = numpy.floor((points[:, 1] + tol - oy) / self.cellSize).astype(numpy.int64)
+        nc = colEnd - colStart + 1
+        counts = nc * (rowEnd - rowStart + 1)
+        # candidate cells of each point, row by row
+        owners = numpy.repeat(numpy.arange(n, dtype=numpy.int64), counts)
+        local = self.expandRanges(numpy.zeros(n, dtype=numpy.int64), counts)
+        ncRep = numpy.repeat(nc, counts)
+        cols = numpy.repeat(colStart, counts) + local % ncRep
+        rows = numpy.repeat(rowStart, counts) + local // ncRep
+        owners, itemPos = self.getCellItems(owners, cols, rows)
+        px, py = points[owners, 0], points[owners, 1]
+        isNode = self.itemTypes[itemPos] == DsgArraySnapIndex.SnapPoint
+        tol2 = tol * tol
+
+        # nodes
+        nodeOwners, nodeIds = owners[isNode], self.itemIds[itemPos[isNode]]
+        nodeXY = self.nodes[nodeIds]
+        nodeDists = (nodeXY[:, 0] - px[isNode]) ** 2 + (nodeXY[:, 1] - py[isNode]) ** 2
+        bestNodes, bestPos, bestNodeDists = self.getClosestPerOwner(nodeOwners, nodeIds, nodeDists, n)
+        bestNodes[bestNodeDists >= tol2] = -1
+        bestNodeDists[bestNodes < 0] = numpy.inf
+        nodePoints = numpy.full((n, 2), numpy.nan)
+        nodePoints[bestNodes >= 0] = self.nodes[bestNodes[bestNodes >= 0]]
+
+        # segments, projected as in SegmentSnapItem.getProjection
+        isSegment = ~isNode
+        segOwners, segIds = owners[isSegment], self.itemIds[itemPos[isSegment]]
+        s = self.segments[segIds]
+        x1, y1, x2, y2 = s[:, 0], s[:, 1], s[:, 2], s[:, 3]
+        sx, sy = px[isSegment], py[isSegment]
+        nx = y2 - y1
+        ny = -(x2 - x1)
+        degenerate = (x1 == x2) & (y1 == y2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t = (sx * ny - sy * nx - x1 * ny + y1 * nx) / ((x2 - x1) * ny - (y2 - y1) * nx)
+        t[degenerate] = 0.
+        valid = (t >= 0.) & (t <= 1.)
+        projX = x1 + (x2 - x1) * t
+        projY = y1 + (y2 - y1) * t
+        segDists = (projX - sx) ** 2 + (projY - sy) ** 2
+        validPos = numpy.nonzero(valid)[0]
+        bestSegments, bestPos, bestSegDists = self.getClosestPerOwner(segOwners[valid], segIds[valid], segDists[valid], n)
+        found = (bestSegments >= 0) & (bestSegDists < tol2)
+        bestSegments[~found] = -1
+        bestSegDists[~found] = numpy.inf
+        segmentPoints = numpy.full((n, 2), numpy.nan)
+        segmentPoints[found, 0] = projX[validPos[bestPos[found]]]
+        segmentPoints[found, 1] = projY[validPos[bestPos[found]]]
+        return (bestNodes, nodePoints, bestNodeDists), (bestSegments, segmentPoints, bestSegDists)
+
+    def getClosestSnapToPoint(self, p, q):
+        """
+        Get closest snap point, same as DsgSnapIndex.getClosestSnapToPoint
+        :param p: QgsPointV2
+        :param q: QgsPointV2
+        :return: QgsPointV2
+        """
+        if not self.isBuilt:
+            self.buildCells()
+        # Look for intersections on segment from the target point to the point opposite to the point reference point
+        p2x, p2y = 2 * q.x() - p.x(), 2 * q.y() - p.y()
+        ox, oy = self.origin.x(), self.origin.y()
+        rt = Raytracer((p.x() - ox) / self.cellSize, (p.y() - oy) / self.cellSize, (p2x - ox) / self.cellSize, (p2y - oy) / self.cellSize)
+        cols, rows = [], []
+        while rt.isValid():
+            rt.next()
+            cols.append(rt.curCol())
+            rows.append(rt.curRow())
+        cols = numpy.array(cols, dtype=numpy.int64)
+        owners, itemPos = self.getCellItems(numpy.zeros(len(cols), dtype=numpy.int64), cols, numpy.array(rows, dtype=numpy.int64))
+        itemPos = itemPos[self.itemTypes[itemPos] == DsgArraySnapIndex.SnapSegment]
+        if len(itemPos) == 0:
+            return p
+        # intersections computed as in SegmentSnapItem.getIntersection
+        s = self.segments[self.itemIds[itemPos]]
+        q1x, q1y = s[:, 0], s[:, 1]
+        vx, vy = p2x - p.x(), p2y - p.y()
+        wx, wy = s[:, 2] - q1x, s[:, 3] - q1y
+        vl = numpy.hypot(vx, vy)
+        wl = numpy.hypot(wx, wy)
+        if vl == 0.:
+            return p
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            vx, vy = vx / vl, vy / vl
+            wx, wy = wx / wl, wy / wl
+            d = vy * wx - vx * wy
+            k = ((q1y - p.y()) * wx - (q1x - p.x()) * wy) / d
+        interX = p.x() + vx * k
+        interY = p.y() + vy * k
+        lambdav = (interX - p.x()) * vx + (interY - p.y()) * vy
+        lambdaw = (interX - q1x) * wx + (interY - q1y) * wy
+        valid = (wl != 0.) & (d != 0.) & (lambdav >= 1E-8) & (lambdav <= vl - 1E-8) & (lambdaw >= 1E-8) & (lambdaw < wl - 1E-8)
+        if not valid.any():
+            return p
+        dists = numpy.where(valid, (q.x() - interX) ** 2 + (q.y() - interY) ** 2, numpy.inf)
+        i = numpy.argmin(dists)
+        return QgsPointV2(interX[i], interY[i])
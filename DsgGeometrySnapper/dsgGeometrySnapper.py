@@ -20,33 +20,85 @@
  *                                                                         *
  ***************************************************************************/
 """
-import sys
+import sys, os, math
+import multiprocessing
+from collections import OrderedDict
+
+import numpy
 
 from PyQt4.QtCore import QObject, pyqtSignal
 
 from qgis.core import QGis, QgsFeatureRequest, QgsSpatialIndex, QgsGeometry, QgsPointV2, QgsFeatureRequest, QgsFeatureIterator\
-, QgsFeature, QgsVertexId, QgsCurvePolygonV2, QgsVectorLayer, QgsMultiPolygonV2, QgsPolygonV2, QgsPoint, QgsCircularStringV2, QgsSurfaceV2
+, QgsFeature, QgsRectangle, QgsVertexId, QgsCurvePolygonV2, QgsVectorLayer, QgsMultiPolygonV2, QgsPolygonV2, QgsPoint, QgsCircularStringV2, QgsSurfaceV2
 
 from DsgTools.DsgGeometrySnapper.dsgSnapIndex import DsgSnapIndex
+from DsgTools.DsgGeometrySnapper.dsgArraySnapIndex import DsgArraySnapIndex
 from DsgTools.DsgGeometrySnapper.pointSnapItem import PointSnapItem
 from DsgTools.DsgGeometrySnapper.segmentSnapItem import SegmentSnapItem
 from DsgTools.DsgGeometrySnapper.coordIdx import CoordIdx
 
+def geometryFromWkb(wkb):
+    """
+    Makes a QgsGeometry from its WKB
+    :param wkb: str
+    :return: QgsGeometry
+    """
+    geometry = QgsGeometry()
+    geometry.fromWkb(wkb)
+    return geometry
+
+def snapTileGeometries(args):
+    """
+    Worker function used by DsgGeometrySnapper.parallelSnapFeatures.
+    It must be defined at module level to be picklable by multiprocessing.
+    :param args: tuple (list of (reference feature id, wkb), list of (position, subject wkb), snapTolerance, mode, tileSize)
+    :return: list of (position, snapped wkb)
+    """
+    refWkbs, subjWkbs, snapTolerance, mode, tileSize = args
+    refGeometries = OrderedDict((featureId, geometryFromWkb(wkb)) for featureId, wkb in refWkbs)
+    snapper = DsgGeometrySnapper(None, cacheSize=len(refGeometries), tileSize=tileSize, referenceGeometries=refGeometries)
+    return [(position, snapper.snapGeometry(geometryFromWkb(wkb), snapTolerance, mode).asWkb()) for position, wkb in subjWkbs]
+
 class DsgGeometrySnapper(QObject):
     SnappedToRefNode, SnappedToRefSegment, Unsnapped = range(3)
     PreferNodes, PreferClosest = range(2)
 
     featureSnapped = pyqtSignal()
 
-    def __init__(self, referenceLayer):
+    def __init__(self, referenceLayer, cacheSize=10000, tileSize=None, tileCacheSize=16, referenceGeometries=None):
         """
         Constructor
         :param referenceLayer: QgsVectorLayer
+        :param cacheSize: int, maximum number of reference features kept already broken into segments
+        :param tileSize: float, size of the tiles that share a reference snap index. Defaults to 100 times the snap tolerance
+        :param tileCacheSize: int, maximum number of tile snap indexes kept in memory
+        :param referenceGeometries: dict {feature id: QgsGeometry} used instead of referenceLayer (e.g. in worker processes)
         """
         super(self.__class__,self).__init__()
         self.referenceLayer = referenceLayer
+        self.referenceGeometries = referenceGeometries
         # Build spatial index
-        self.index = QgsSpatialIndex(self.referenceLayer.getFeatures())
+        if referenceGeometries is not None:
+            self.index = QgsSpatialIndex()
+            for featureId, refGeometry in referenceGeometries.iteritems():
+                refFeature = QgsFeature(featureId)
+                refFeature.setGeometry(refGeometry)
+                self.index.insertFeature(refFeature)
+        else:
+            self.index = QgsSpatialIndex(self.referenceLayer.getFeatures())
+        # LRU caches shared by all features snapped with this snapper
+        self.cacheSize = cacheSize
+        self.tileSize = tileSize
+        self.tileCacheSize = tileCacheSize
+        self.clearCache()
+
+    def clearCache(self):
+        """
+        Clears the reference segment and tile caches. Must be called if the reference layer changes
+        :return:
+        """
+        self.segmentCache = OrderedDict()
+        self.tileCache = OrderedDict()
         
     def polyLineSize(self, geom, iPart, iRing):
         """
@@ -77,6 +129,92 @@ class DsgGeometrySnapper(QObject):
             self.featureSnapped.emit()
         return features
 
+    def parallelSnapFeatures(self, features, snapTolerance, mode=PreferNodes, nWorkers=None, partitionSize=None, frameLayer=None):
+        """
+        Snap features from a layer using a pool of worker processes.
+        Features are partitioned by a grid (or by frameLayer) and each partition is snapped against the
+        reference features that intersect it plus a tolerance halo. The output is the same of snapFeatures.
+        :param features: list of QgsFeatures
+        :param snapTolerance: float
+        :param mode: DsgGeometrySnapper.PreferNodes or DsgGeometrySnapper.PreferClosest
+        :param nWorkers: int, number of worker processes. Defaults to the number of CPUs
+        :param partitionSize: float, size of the partition grid cells. Defaults to 10 times the tile size
+        :param frameLayer: QgsVectorLayer with polygons (e.g. moldura) used to partition the features
+        :return:
+        """
+        features = list(features)
+        tileSize = self.tileSize if self.tileSize else 100*snapTolerance
+        partitionSize = partitionSize if partitionSize else 10*tileSize
+        partitions = self.partitionFeatures(features, snapTolerance, tileSize, partitionSize, frameLayer)
+        tasks = []
+        for positions, haloBounds in partitions.values():
+            refIds = sorted(self.index.intersects(haloBounds))
+            refWkbs = [(featureId, refGeometry.asWkb()) for featureId, refGeometry in self.getReferenceGeometries(refIds) if refGeometry]
+            subjWkbs = [(position, features[position].geometry().asWkb()) for position in positions]
+            tasks.append((refWkbs, subjWkbs, snapTolerance, mode, self.tileSize))
+        # features without geometry are not snapped at all
+        for feature in features:
+            if not feature.geometry():
+                self.featureSnapped.emit()
+        if os.name == 'nt':
+            # inside QGIS sys.executable is the QGIS binary, workers must be started with the python interpreter
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+        pool = multiprocessing.Pool(nWorkers if nWorkers else multiprocessing.cpu_count())
+        try:
+            for results in pool.imap_unordered(snapTileGeometries, tasks):
+                for position, wkb in results:
+                    features[position].setGeometry(geometryFromWkb(wkb))
+                    self.featureSnapped.emit()
+        finally:
+            pool.close()
+            pool.join()
+        return features
+
+    def partitionFeatures(self, features, snapTolerance, tileSize, partitionSize, frameLayer=None):
+        """
+        Groups features by partition and computes the bounds each partition needs from the reference layer
+        :param features: list of QgsFeatures
+        :param snapTolerance: float
+        :param tileSize: float, size of the snapper tiles (see getTileSnapIndex)
+        :param partitionSize: float
+        :param frameLayer: QgsVectorLayer or None
+        :return: OrderedDict {partition key: (list of feature positions, QgsRectangle)}
+        """
+        if frameLayer:
+            frameIndex = QgsSpatialIndex(frameLayer.getFeatures())
+            frameGeometries = dict((frame.id(), QgsGeometry(frame.geometry())) for frame in frameLayer.getFeatures())
+        partitions = OrderedDict()
+        for position, feature in enumerate(features):
+            geometry = feature.geometry()
+            if not geometry:
+                continue
+            searchBounds = geometry.boundingBox()
+            searchBounds.grow(snapTolerance)
+            center = searchBounds.center()
+            key = None
+            if frameLayer:
+                centerGeometry = QgsGeometry.fromPoint(center)
+                for frameId in sorted(frameIndex.intersects(centerGeometry.boundingBox())):
+                    if frameGeometries[frameId].intersects(centerGeometry):
+                        key = ('frame', frameId)
+                        break
+            if key is None:
+                key = ('grid', int(math.floor(center.x() / partitionSize)), int(math.floor(center.y() / partitionSize)))
+            # the halo must cover everything snapGeometry reads: the search bounds and, when used, the tile bounds
+            haloBounds = QgsRectangle(searchBounds)
+            col = int(math.floor(searchBounds.xMinimum() / tileSize))
+            row = int(math.floor(searchBounds.yMinimum() / tileSize))
+            if searchBounds.xMaximum() <= (col + 1) * tileSize and searchBounds.yMaximum() <= (row + 1) * tileSize:
+                tileBounds = QgsRectangle(col * tileSize, row * tileSize, (col + 1) * tileSize, (row + 1) * tileSize)
+                tileBounds.grow(snapTolerance)
+                haloBounds.combineExtentWith(tileBounds)
+            if key not in partitions:
+                partitions[key] = ([], haloBounds)
+            else:
+                partitions[key][1].combineExtentWith(haloBounds)
+            partitions[key][0].append(position)
+        return partitions
+
     def processFeature(self, feature, snapTolerance, mode):
         """
         Process QgsFeature
@@ -108,15 +246,71 @@ class DsgGeometrySnapper(QObject):
         else:
             return QgsPointV2( s1.x() + ( s2.x() - s1.x() ) * t, s1.y() + ( s2.y() - s1.y() ) * t )
 
-    def buildReferenceIndex(self, segments):
-        refDict = {}
-        index = QgsSpatialIndex()
-        for i, segment in enumerate(segments):
-            refDict[i] = segment
-            feature = QgsFeature(i)
-            feature.setGeometry(segment)
-            index.insertFeature(feature)
-        return refDict, index
+    def getReferenceGeometries(self, featureIds):
+        """
+        Iterates over the reference geometries with the given ids
+        :param featureIds: list of feature ids
+        :return: generator of (feature id, QgsGeometry)
+        """
+        if self.referenceGeometries is not None:
+            for featureId in featureIds:
+                if featureId in self.referenceGeometries:
+                    yield featureId, self.referenceGeometries[featureId]
+        else:
+            refFeatureRequest = QgsFeatureRequest().setFilterFids(featureIds)
+            for refFeature in self.referenceLayer.getFeatures(refFeatureRequest):
+                yield refFeature.id(), refFeature.geometry()
+
+    def getReferenceSegments(self, featureIds):
+        """
+        Gets the reference features broken into segments. Features already broken are taken from a LRU cache,
+        the missing ones are requested from the reference layer at once.
+        :param featureIds: list of feature ids
+        :return: list of QgsGeometry
+        """
+        missingIds = [featureId for featureId in featureIds if featureId not in self.segmentCache]
+        if len(missingIds) > 0:
+            for featureId, refGeometry in self.getReferenceGeometries(missingIds):
+                self.segmentCache[featureId] = self.breakQgsGeometryIntoSegments(refGeometry) if refGeometry else []
+        segments = []
+        for featureId in featureIds:
+            if featureId not in self.segmentCache:
+                continue
+            # moving the feature to the end of the cache, i.e., most recently used
+            featureSegments = self.segmentCache.pop(featureId)
+            self.segmentCache[featureId] = featureSegments
+            segments += featureSegments
+        while len(self.segmentCache) > self.cacheSize:
+            self.segmentCache.popitem(last=False)
+        return segments
+
+    def getTileSnapIndex(self, searchBounds, snapTolerance):
+        """
+        Gets the reference snap index of the tile that contains searchBounds.
+        Returns None when searchBounds crosses the tile borders.
+        :param searchBounds: QgsRectangle
+        :param snapTolerance: float
+        :return: DsgArraySnapIndex or None
+        """
+        tileSize = self.tileSize if self.tileSize else 100*snapTolerance
+        col = int(math.floor(searchBounds.xMinimum() / tileSize))
+        row = int(math.floor(searchBounds.yMinimum() / tileSize))
+        if searchBounds.xMaximum() > (col + 1) * tileSize or searchBounds.yMaximum() > (row + 1) * tileSize:
+            return None
+        key = (snapTolerance, tileSize, col, row)
+        if key in self.tileCache:
+            tileIndex = self.tileCache.pop(key)
+        else:
+            tileBounds = QgsRectangle(col * tileSize, row * tileSize, (col + 1) * tileSize, (row + 1) * tileSize)
+            tileBounds.grow(snapTolerance)
+            tileIndex = DsgArraySnapIndex(QgsPointV2(tileBounds.center()), 10*snapTolerance)
+            for segment in self.getReferenceSegments(sorted(self.index.intersects(tileBounds))):
+                if segment.intersects(tileBounds):
+                    tileIndex.addGeometry(segment.geometry())
+        self.tileCache[key] = tileIndex
+        while len(self.tileCache) > self.tileCacheSize:
+            self.tileCache.popitem(last=False)
+        return tileIndex
 
     def segmentFromPoints(self, start, end):
         """
@@ -177,81 +371,68 @@ class DsgGeometrySnapper(QObject):
         center = QgsPointV2(geometry.boundingBox().center())
 
         # Get potential reference features and construct snap index
-        refGeometries = []
         searchBounds = geometry.boundingBox()
         searchBounds.grow(snapTolerance)
         # filter by bounding box to get candidates
-        refFeatureIds = self.index.intersects(searchBounds)
+        # sorted so that the result does not depend on how the spatial index was built
+        refFeatureIds = sorted(self.index.intersects(searchBounds))
 
         # End here in case we don't find candidates
         if len(refFeatureIds) == 0:
             return geometry
 
         # speeding up the process to consider only intersecting geometries
-        refFeatureRequest = QgsFeatureRequest().setFilterFids(refFeatureIds)
-        for refFeature in self.referenceLayer.getFeatures(refFeatureRequest):
-            refGeometry = refFeature.geometry()
-            segments = self.breakQgsGeometryIntoSegments(refGeometry)
-            # testing intersection
-            for segment in segments:
-                if segment.intersects(searchBounds):
-                    refGeometries.append(segment)
+        refGeometries = [segment for segment in self.getReferenceSegments(refFeatureIds) if segment.intersects(searchBounds)]
 
         # End here in case we don't find geometries
         if len(refGeometries) == 0:
             return geometry
 
-        # building geometry index
-        refDict, index = self.buildReferenceIndex(refGeometries)
-        refSnapIndex = DsgSnapIndex(center, 10*snapTolerance)
-        for geom in refGeometries:
-            refSnapIndex.addGeometry(geom.geometry())
+        # building geometry index, reusing the tile index when the search bounds fit in a single tile
+        refSnapIndex = self.getTileSnapIndex(searchBounds, snapTolerance)
+        if not refSnapIndex:
+            refSnapIndex = DsgArraySnapIndex(center, 10*snapTolerance)
+            for geom in refGeometries:
+                refSnapIndex.addGeometry(geom.geometry())
 
         # Snap geometries
         subjGeom = geometry.geometry().clone()
         subjPointFlags = []
 
         # Pass 1: snap vertices of subject geometry to reference vertices
+        # all subject vertices are resolved against the reference index in a single batched query
+        vertexIds = []
+        coords = []
         for iPart in xrange(subjGeom.partCount()):
             subjPointFlags.append([])
             for iRing in xrange(subjGeom.ringCount(iPart)):
                 subjPointFlags[iPart].append([])
                 for iVert in xrange(self.polyLineSize(subjGeom, iPart, iRing)):
                     vidx = QgsVertexId(iPart, iRing, iVert, QgsVertexId.SegmentVertex)
-                    p = QgsPointV2(subjGeom.vertexAt(vidx))
-                    pF = QgsPoint(p.toQPointF())
-                    snapPoint, snapSegment = refSnapIndex.getSnapItem(p, snapTolerance)
-                    success = snapPoint or snapSegment
-                    if not success:
-                        subjPointFlags[iPart][iRing].append(DsgGeometrySnapper.Unsnapped )
-                    else:
-                        if mode == DsgGeometrySnapper.PreferNodes:
-                            # Prefer snapping to point
-                            if snapPoint:
-                                subjGeom.moveVertex(vidx, snapPoint.getSnapPoint(p))
-                                subjPointFlags[iPart][iRing].append(DsgGeometrySnapper.SnappedToRefNode)
-                            elif snapSegment:
-                                subjGeom.moveVertex( vidx, snapSegment.getSnapPoint(p))
-                                subjPointFlags[iPart][iRing].append(DsgGeometrySnapper.SnappedToRefSegment)
-                        elif mode == DsgGeometrySnapper.PreferClosest:
-                            nodeSnap = None
-                            segmentSnap = None
-                            distanceNode = sys.float_info.max
-                            distanceSegment = sys.float_info.max
-                            if snapPoint:
-                                nodeSnap = snapPoint.getSnapPoint(p)
-                                nodeSnapF = QgsPoint(nodeSnap.toQPointF())
-                                distanceNode = nodeSnapF.sqrDist(pF)
-                            if snapSegment:
-                                segmentSnap = snapSegment.getSnapPoint(p)
-                                segmentSnapF = QgsPoint(segmentSnap.toQPointF())
-                                distanceSegment = segmentSnapF.sqrDist(pF)
-                            if snapPoint and (distanceNode < distanceSegment):
-                                subjGeom.moveVertex( vidx, nodeSnap )
-                                subjPointFlags[iPart][iRing].append(DsgGeometrySnapper.SnappedToRefNode)
-                            elif snapSegment:
-                                subjGeom.moveVertex(vidx, segmentSnap)
-                                subjPointFlags[iPart][iRing].append(DsgGeometrySnapper.SnappedToRefSegment)
+                    p = subjGeom.vertexAt(vidx)
+                    vertexIds.append(vidx)
+                    coords.append((p.x(), p.y()))
+        nodeSnap, segmentSnap = refSnapIndex.getSnapItems(numpy.array(coords, dtype=numpy.float64), snapTolerance)
+        nodeIds, nodePoints, nodeDists = nodeSnap
+        segmentIds, segmentPoints, segmentDists = segmentSnap
+        for i, vidx in enumerate(vertexIds):
+            flags = subjPointFlags[vidx.part][vidx.ring]
+            snapPoint = nodeIds[i] >= 0
+            snapSegment = segmentIds[i] >= 0
+            if not snapPoint and not snapSegment:
+                flags.append(DsgGeometrySnapper.Unsnapped)
+                continue
+            if mode == DsgGeometrySnapper.PreferNodes:
+                # Prefer snapping to point
+                toNode = snapPoint
+            elif mode == DsgGeometrySnapper.PreferClosest:
+                toNode = snapPoint and (nodeDists[i] < segmentDists[i])
+            if toNode:
+                subjGeom.moveVertex(vidx, QgsPointV2(nodePoints[i, 0], nodePoints[i, 1]))
+                flags.append(DsgGeometrySnapper.SnappedToRefNode)
+            else:
+                subjGeom.moveVertex(vidx, QgsPointV2(segmentPoints[i, 0], segmentPoints[i, 1]))
+                flags.append(DsgGeometrySnapper.SnappedToRefSegment)
 
         #nothing more to do for points
         if isinstance(subjGeom, QgsPointV2):
@@ -290,11 +471,9 @@ class DsgGeometrySnapper(QObject):
                                 # If we are too far away from the original geometry, do nothing
                                 if not origSubjSnapIndex.getSnapItem(point, snapTolerance):
                                     continue
-                                idx = snapSegment.idxFrom
-                                subjGeom.insertVertex(QgsVertexId(idx.vidx.part, idx.vidx.ring, idx.vidx.vertex + 1, QgsVertexId.SegmentVertex), point)
-                                subjPointFlags[idx.vidx.part][idx.vidx.ring].insert(idx.vidx.vertex + 1, DsgGeometrySnapper.SnappedToRefNode )
-                                subjSnapIndex = DsgSnapIndex(center, 10*snapTolerance)
-                                subjSnapIndex.addGeometry(subjGeom)
+                                # inserting the vertex updates only the index cells touched by the split segment
+                                idx = subjSnapIndex.insertVertex(snapSegment, point)
+                                subjPointFlags[idx.vidx.part][idx.vidx.ring].insert(idx.vidx.vertex, DsgGeometrySnapper.SnappedToRefNode )
 
         # Pass 3: remove superfluous vertices: all vertices which are snapped to a segment and not preceded or succeeded by an unsnapped vertex
         for iPart in xrange(subjGeom.partCount()):
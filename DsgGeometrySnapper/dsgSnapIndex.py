@@ -44,6 +44,7 @@ class DsgSnapIndex:
         self.cellSize = cellSize
         self.rowsStartIdx = 0
         self.coordIdxs = []
+        self.ringCoordIdxs = dict()
         self.gridRows = []
 
     def __del__(self):
@@ -85,23 +86,22 @@ class DsgSnapIndex:
         else:
             return self.gridRows[row - self.rowsStartIdx].getCreateCell(col)
 
-    def addPoint(self, idx):
+    def getCellCoords(self, p):
         """
-        Adds a point into the index
-        :param idx: CoordIdx
-        :return:
+        Gets the grid column and row that contain a point
+        :param p: QgsPointV2
+        :return: (int, int)
         """
-        p = idx.point()
         col = int(math.floor((p.x() - self.origin.x()) / self.cellSize))
         row = int(math.floor((p.y() - self.origin.y()) / self.cellSize))
-        self.getCreateCell(col, row).append(PointSnapItem(idx))
+        return col, row
 
-    def addSegment(self, idxFrom, idxTo):
+    def getSegmentCells(self, idxFrom, idxTo):
         """
-        Adds a segmento into the index
+        Gets the grid cells (col, row) touched by a segment
         :param idxFrom: CoordIdx
         :param idxTo: CoordIdx
-        :return:
+        :return: list of (int, int)
         """
         pFrom = idxFrom.point()
         pTo = idxTo.point()
@@ -111,10 +111,50 @@ class DsgSnapIndex:
         x1 = (pTo.x() - self.origin.x()) / self.cellSize
         y1 = (pTo.y() - self.origin.y()) / self.cellSize
 
+        cells = []
         rt = Raytracer(x0, y0, x1, y1)
         while rt.isValid():
             rt.next()
-            self.getCreateCell(rt.curCol(), rt.curRow()).append(SegmentSnapItem(idxFrom, idxTo))
+            cells.append((rt.curCol(), rt.curRow()))
+        return cells
+
+    def addPoint(self, idx):
+        """
+        Adds a point into the index
+        :param idx: CoordIdx
+        :return:
+        """
+        col, row = self.getCellCoords(idx.point())
+        self.getCreateCell(col, row).append(PointSnapItem(idx))
+
+    def addSegment(self, idxFrom, idxTo):
+        """
+        Adds a segmento into the index
+        :param idxFrom: CoordIdx
+        :param idxTo: CoordIdx
+        :return: SegmentSnapItem
+        """
+        # the same item is shared by all touched cells, so it can be removed later
+        item = SegmentSnapItem(idxFrom, idxTo)
+        for col, row in self.getSegmentCells(idxFrom, idxTo):
+            self.getCreateCell(col, row).append(item)
+        return item
+
+    def removeSegment(self, item):
+        """
+        Removes a segment item from the cells it was indexed in
+        :param item: SegmentSnapItem
+        :return:
+        """
+        for col, row in self.getSegmentCells(item.idxFrom, item.idxTo):
+            cell = self.getCell(col, row)
+            if not cell:
+                continue
+            # removing by identity, cells may hold other items for the same coordinates
+            for i in xrange(len(cell)):
+                if cell[i] is item:
+                    del cell[i]
+                    break
 
     def addGeometry(self, geom):
         """
@@ -131,14 +171,41 @@ class DsgSnapIndex:
                     nVerts -= 1
                 elif isinstance(geom, QgsCircularStringV2):
                     nVerts -= 1
+                # one CoordIdx per vertex, shared by the point and segment items that use it
+                ringIdxs = [CoordIdx(geom, QgsVertexId(iPart, iRing, iVert, QgsVertexId.SegmentVertex)) for iVert in xrange(nVerts + 1)]
+                self.ringCoordIdxs[(geom, iPart, iRing)] = ringIdxs
+                self.coordIdxs.extend(ringIdxs)
                 for iVert in xrange(nVerts):
-                    idx = CoordIdx( geom, QgsVertexId(iPart, iRing, iVert, QgsVertexId.SegmentVertex))
-                    idx1 = CoordIdx( geom, QgsVertexId(iPart, iRing, iVert + 1, QgsVertexId.SegmentVertex))
-                    self.coordIdxs.append(idx)
-                    self.coordIdxs.append(idx1)
-                    self.addPoint(idx)
+                    self.addPoint(ringIdxs[iVert])
                     if iVert < nVerts - 1:
-                        self.addSegment(idx, idx1)
+                        self.addSegment(ringIdxs[iVert], ringIdxs[iVert + 1])
+
+    def insertVertex(self, segment, point):
+        """
+        Inserts a vertex into the indexed geometry, splitting the segment item it lies on.
+        Only the cells touched by the split segment are re-indexed.
+        :param segment: SegmentSnapItem
+        :param point: QgsPointV2
+        :return: CoordIdx of the inserted vertex
+        """
+        idxFrom = segment.idxFrom
+        geom = idxFrom.geom
+        part, ring, vertex = idxFrom.vidx.part, idxFrom.vidx.ring, idxFrom.vidx.vertex + 1
+        vidx = QgsVertexId(part, ring, vertex, QgsVertexId.SegmentVertex)
+        # the segment must be removed while its end points still resolve to the original coordinates
+        self.removeSegment(segment)
+        geom.insertVertex(vidx, point)
+        # shifting the vertex ids that come after the inserted vertex
+        ringIdxs = self.ringCoordIdxs[(geom, part, ring)]
+        for idx in ringIdxs[vertex:]:
+            idx.vidx = QgsVertexId(part, ring, idx.vidx.vertex + 1, QgsVertexId.SegmentVertex)
+        newIdx = CoordIdx(geom, vidx)
+        ringIdxs.insert(vertex, newIdx)
+        self.coordIdxs.append(newIdx)
+        self.addPoint(newIdx)
+        self.addSegment(idxFrom, newIdx)
+        self.addSegment(newIdx, segment.idxTo)
+        return newIdx
 
     def getClosestSnapToPoint(self, p, q):
         """
@@ -95,10 +95,10 @@ class AbstractDb(QObject):
             if layer.split('_')[-1] in ['p','l','a'] or schema == 'complexos':
                 sql = self.gen.getElementCountFromLayer(layer)
                 query = QSqlQuery(sql,self.db)
+                if not query.isActive():
+                    raise Exception(self.tr("Problem counting elements: ")+query.lastError().text())
                 query.next()
                 number = query.value(0)
-                if not query.exec_(sql):
-                    raise Exception(self.tr("Problem counting elements: ")+query.lastError().text())
                 listaQuantidades.append([layer, number])
         return listaQuantidades
     
@@ -114,24 +114,54 @@ class AbstractDb(QObject):
                 lyrWithElemList.appen(lyr)
         return lyrWithElemList
 
-    def getLayersWithElementsV2(self, layerList, useInheritance = False):
+    def getLayerSchemaAndTable(self, layer):
+        '''
+        Gets (schema, table) of a layer given as a dict (keys tableSchema and tableName), as 'schema.table' or as the table name
+        '''
+        if isinstance(layer, dict):
+            return layer['tableSchema'], layer['tableName']
+        if '.' in layer:
+            schema, lyr = layer.replace('"','').split('.')
+            return schema, lyr
+        return self.getTableSchemaFromDb(layer), layer
+
+    def getLayersElementCount(self, layerList, useInheritance = False, mode = 'exists'):
+        '''
+        Gets the number of elements of all layers in layerList using a single query
+        layerList: list of layers (dicts with keys tableSchema and tableName, 'schema.table' strings or table names)
+        useInheritance: counts the elements of child tables as well
+        mode: 'exists' gives 1 for layers with elements and 0 otherwise, 'estimate' gives the row estimate kept by the
+              database catalog (exact count when there is none) and 'exact' gives the exact count
+        returns a dict {(schema, table): count}
+        '''
         self.checkAndOpenDb()
-        lyrWithElemList = []
+        tableList = []
         for layer in layerList:
-            if isinstance(layer, dict):
-                schema = layer['tableSchema']
-                lyr = layer['tableName']
-            else:
-                if '.' in layer:
-                    schema, lyr = layer.replace('"','').split('.')
-                else:
-                    lyr = layer
-                    schema = self.getTableSchemaFromDb(lyr)
-            sql = self.gen.getElementCountFromLayerV2(schema, lyr, useInheritance)
-            query = QSqlQuery(sql,self.db)
-            query.next()
-            if query.value(0) > 0:
-                lyrWithElemList.append(lyr)
+            schemaAndTable = self.getLayerSchemaAndTable(layer)
+            if schemaAndTable not in tableList:
+                tableList.append(schemaAndTable)
+        if len(tableList) == 0:
+            return dict()
+        sql = self.gen.getLayersElementCount(tableList, useInheritance, mode)
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr("Problem counting elements: ")+query.lastError().text())
+        countDict = dict()
+        while query.next():
+            countDict[(query.value(0), query.value(1))] = query.value(2)
+        return countDict
+
+    def getLayersWithElementsV2(self, layerList, useInheritance = False, mode = 'exists'):
+        '''
+        Gets the names of the tables in layerList that have elements, using a single query (see getLayersElementCount)
+        '''
+        self.checkAndOpenDb()
+        tableList = [self.getLayerSchemaAndTable(layer) for layer in layerList]
+        countDict = self.getLayersElementCount([{'tableSchema':schema, 'tableName':lyr} for schema, lyr in tableList], useInheritance = useInheritance, mode = mode)
+        lyrWithElemList = []
+        for schemaAndTable in tableList:
+            if countDict.get(schemaAndTable, 0) > 0:
+                lyrWithElemList.append(schemaAndTable[1])
         return lyrWithElemList
     
     def findEPSG(self, parameters=dict()):
@@ -665,6 +695,29 @@ class AbstractDb(QObject):
             code_name = query.value(1)
             ret[code_name] = code
         return ret
+
+    def getAssociatedDictFromLinks(self, linkList):
+        '''
+        Loads the features associated to the complexes of all links with a single query
+        linkList: list of (complex_schema, complex, aggregated_schema, aggregated_class, column_name)
+        returns: {complex name: {complex uuid: {aggregated class: [aggregated ids]}}}
+        '''
+        associatedDict = dict()
+        if len(linkList) == 0:
+            return associatedDict
+        sql = self.gen.getAssociatedFeaturesFromLinks(linkList)
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr("Problem loading associated features: ")+query.lastError().text())
+        while query.next():
+            complex_uuid = query.value(0)
+            name = query.value(1)
+            if not (complex_uuid and name):
+                continue
+            aggregatedList = associatedDict.setdefault(name, dict()).setdefault(complex_uuid, dict()).setdefault(query.value(2), [])
+            if not query.isNull(3):
+                aggregatedList.append(query.value(3))
+        return associatedDict
     
     def createFrameFromInom(self, inom):
         frame = self.utmGrid.getQgsPolygonFrame(inom)
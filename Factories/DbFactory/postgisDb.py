@@ -22,16 +22,56 @@
 """
 from DsgTools.Factories.DbFactory.abstractDb import AbstractDb
 from PyQt4.QtSql import QSqlQuery, QSqlDatabase
-from PyQt4.QtCore import QSettings
+from PyQt4.QtCore import QSettings, QDate, QDateTime, QTime, Qt
 from DsgTools.Factories.SqlFactory.sqlGeneratorFactory import SqlGeneratorFactory
 from qgis.core import QgsCredentials, QgsMessageLog, QgsDataSourceURI, QgsFeature, QgsVectorLayer, QgsField, QgsGeometry
 from osgeo import ogr
 from uuid import uuid4
-import codecs, os, json, binascii, re
-import psycopg2
+import codecs, os, json, binascii, re, io
+from datetime import datetime
+import time
+import psycopg2, psycopg2.extensions
+from multiprocessing.pool import ThreadPool
 from DsgTools.CustomWidgets.progressWidget import ProgressWidget
+from DsgTools.Factories.DbFactory.postgisMetadataCache import PostgisMetadataCache
+
+def probeEDGVVersion(args):
+    """
+    Reads the EDGV version of a database through its own psycopg2 connection.
+    Runs on the getEDGVDbsFromServer worker threads, so it must not touch Qt objects.
+    :param args: (host, port, user, password, database, geometryTablesCountSql, edgvVersionSql, connectTimeout)
+    :return: (database, version, errorMessage). version is None for databases without geometry tables.
+    """
+    host, port, user, password, database, countSql, versionSql, connectTimeout = args
+    try:
+        conn = psycopg2.connect(host=host, port=port, dbname=database, user=user, password=password, connect_timeout=connectTimeout)
+    except Exception as e:
+        return database, None, ':'.join(map(unicode, e.args))
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, cursor)
+        try:
+            cursor.execute(countSql)
+        except psycopg2.Error:
+            return database, None, None
+        if cursor.fetchone()[0] <= 0:
+            return database, None, None
+        try:
+            cursor.execute(versionSql)
+        except psycopg2.Error:
+            return database, 'Non_EDGV', None
+        row = cursor.fetchone()
+        if row is None:
+            return database, None, None
+        return database, row[0] if row[0] else 'Non_EDGV', None
+    finally:
+        conn.close()
 
 class PostgisDb(AbstractDb):
+    # EDGV versions found by getEDGVDbsFromServer: {(host, port, user): {database: (timestamp, version)}}
+    edgvDbsCache = dict()
+
     def __init__(self):
         """
         Constructor
@@ -440,47 +480,18 @@ class PostgisDb(AbstractDb):
         complex: complex class name
         """
         self.checkAndOpenDb()
-        associatedDict = dict()
         complex = complex.replace('complexos.', '')
         #query to get the possible links to the selected complex in the combobox
         sql = self.gen.getComplexLinks(complex)
         query = QSqlQuery(sql, self.db)
         if not query.isActive():
             raise Exception(self.tr("Problem loading associated features: ")+query.lastError().text())
-
+        linkList = []
         while query.next():
-            #setting the variables
-            complex_schema = query.value(0)
-            complex = query.value(1)
-            aggregated_schema = query.value(2)
-            aggregated_class = query.value(3)
-            column_name = query.value(4)
-
-            #query to obtain the created complexes
-            sql = self.gen.getComplexData(complex_schema, complex)
-            complexQuery = QSqlQuery(sql, self.db)
-            if not complexQuery.isActive():
-                raise Exception(self.tr("Problem loading associated features: ")+complexQuery.lastError().text())
-
-            while complexQuery.next():
-                complex_uuid = complexQuery.value(0)
-                name = complexQuery.value(1)
-
-                if not (complex_uuid and name):
-                    continue
-                
-                associatedDict = self.utils.buildNestedDict(associatedDict, [name, complex_uuid, aggregated_class], [])
-                
-                #query to obtain the id of the associated feature
-                sql = self.gen.getAssociatedFeaturesData(aggregated_schema, aggregated_class, column_name, complex_uuid)
-                associatedQuery = QSqlQuery(sql, self.db)
-                if not associatedQuery.isActive():
-                    raise Exception(self.tr("Problem loading associated features: ")+associatedQuery.lastError().text())
-
-                while associatedQuery.next():
-                    ogc_fid = associatedQuery.value(0)
-                    associatedDict = self.utils.buildNestedDict(associatedDict, [name, complex_uuid, aggregated_class], [ogc_fid])
-        return associatedDict
+            #(complex_schema, complex, aggregated_schema, aggregated_class, column_name)
+            linkList.append(tuple(query.value(i) for i in range(5)))
+        #complexes and associated features of all links are obtained at once
+        return self.getAssociatedDictFromLinks(linkList)
     
     def isComplexClass(self, className):
         """
@@ -763,9 +774,17 @@ class PostgisDb(AbstractDb):
         """
         return 'public.aux_moldura_a'
     
-    def getEDGVDbsFromServer(self, parentWidget = None):
+    def getEDGVDbsFromServer(self, parentWidget = None, maxWorkers = 8, cacheTtl = 300, progressCallback = None, connectTimeout = 10):
         """
-        Gets edgv databases from 'this' server
+        Gets edgv databases from 'this' server.
+        Databases are probed concurrently by a pool of at most maxWorkers threads, each one with its own connection.
+        Versions are cached per server for cacheTtl seconds (0 disables the cache); the database list itself is always read.
+        :param parentWidget: (QWidget) parent of the progress bar. If None, no progress bar is shown.
+        :param maxWorkers: (int) maximum number of simultaneous connections.
+        :param cacheTtl: (int) time, in seconds, a database version is reused without probing it again.
+        :param progressCallback: callable receiving (database, version) as soon as each EDGV database is found.
+        :param connectTimeout: (int) connection timeout, in seconds, of each probe.
+        :return: (list-of-tuple) [(database, version)], in the same order of the server database list.
         """
         #Can only be used in postgres database.
         self.checkAndOpenDb()
@@ -778,38 +797,47 @@ class PostgisDb(AbstractDb):
         while query.next():
             dbList.append(query.value(0))
         
-        edvgDbList = []
+        (host, port, user, password) = self.getDatabaseParameters()
+        cacheKey = (host, port, user)
+        if cacheKey not in PostgisDb.edgvDbsCache:
+            PostgisDb.edgvDbsCache[cacheKey] = dict()
+        serverCache = PostgisDb.edgvDbsCache[cacheKey]
+        now = time.time()
         if parentWidget:
             progress = ProgressWidget(1,len(dbList),self.tr('Reading selected databases... '), parent = parentWidget)
             progress.initBar()
+        versionDict = dict()
+        probeList = []
         for database in dbList:
-            db = None
-            db = QSqlDatabase("QPSQL")
-            db.setDatabaseName(database)
-            db.setHostName(self.db.hostName())
-            db.setPort(self.db.port())
-            db.setUserName(self.db.userName())
-            db.setPassword(self.db.password())
-            if not db.open():
-                raise Exception(self.tr("Problem opening databases: ")+db.lastError().databaseText())
-
-            query2 = QSqlQuery(db)
-            if query2.exec_(self.gen.getGeometryTablesCount()):
-                while query2.next():
-                    count = query2.value(0)
-                    if count > 0:
-                        query3 = QSqlQuery(db)
-                        if query3.exec_(self.gen.getEDGVVersion()):
-                            while query3.next():
-                                version = query3.value(0)
-                                if version:
-                                    edvgDbList.append((database,version))
-                                else:
-                                    edvgDbList.append((database,'Non_EDGV'))
-                        else:
-                            edvgDbList.append((database,'Non_EDGV'))
-            if parentWidget:
-                progress.step()
+            if cacheTtl > 0 and database in serverCache and now - serverCache[database][0] < cacheTtl:
+                versionDict[database] = serverCache[database][1]
+                if versionDict[database] and progressCallback:
+                    progressCallback(database, versionDict[database])
+                if parentWidget:
+                    progress.step()
+            else:
+                probeList.append((host, port, user, password, database, self.gen.getGeometryTablesCount(), self.gen.getEDGVVersion(), connectTimeout))
+        errorList = []
+        if probeList:
+            pool = ThreadPool(max(1, min(maxWorkers, len(probeList))))
+            try:
+                # results are consumed on this thread as they arrive
+                for database, version, error in pool.imap_unordered(probeEDGVVersion, probeList):
+                    if error:
+                        errorList.append(database+': '+error)
+                    else:
+                        versionDict[database] = version
+                        serverCache[database] = (time.time(), version)
+                        if version and progressCallback:
+                            progressCallback(database, version)
+                    if parentWidget:
+                        progress.step()
+            finally:
+                pool.close()
+                pool.join()
+        if errorList:
+            raise Exception(self.tr("Problem opening databases: ")+'\n'.join(errorList))
+        edvgDbList = [(database, versionDict[database]) for database in dbList if versionDict.get(database)]
         return edvgDbList
     
     def getDbsFromServer(self):
@@ -944,41 +972,110 @@ class PostgisDb(AbstractDb):
             invalidRecordsList.append( (featId, reason, geom) )
         return invalidRecordsList
     
-    def insertFlags(self, flagTupleList, processName, useTransaction = True):
+    def insertFlags(self, flagTupleList, processName, useTransaction = True, useCopy = False, chunkSize = 1000):
         """
         Inserts flags into database
         flagTupleList: flag tuple list
         processName: process name
+        useCopy: streams the flags through COPY on a separate psycopg2 connection. It always commits its own transaction.
+        chunkSize: number of flags sent in each multi-row INSERT
         """
         self.checkAndOpenDb()
-        if len(flagTupleList) > 0:
-            if useTransaction:
-                self.db.transaction()
-            query = QSqlQuery(self.db)
-            for record in flagTupleList:
-                try:
-                    dimension = self.getDimension(record[3]) # getting geometry dimension
-                except Exception as e:
-                    raise e
-                # specific EPSG search
-                flagSRID = self.findEPSG(parameters={'tableSchema':'validation', 'tableName':'aux_flags_validacao_p', 'geometryColumn':'geom'})
+        if len(flagTupleList) == 0:
+            return 0
+        flagSRID, flagValueList = self.getFlagValueList(flagTupleList)
+        partitioned = self.isFlagPartitioningEnabled()
+        if useCopy:
+            return self.insertFlagsWithCopy(flagValueList, processName, flagSRID, partitioned)
+        # the partitions of the process are created in the same transaction as its flags
+        sqlList = self.gen.createFlagPartitions(processName).split('#') if partitioned else []
+        for i in xrange(0, len(flagValueList), chunkSize):
+            sqlList.append(self.gen.insertFlagsIntoDb(flagValueList[i:i + chunkSize], processName, flagSRID, partitioned))
+        if useTransaction:
+            self.db.transaction()
+        query = QSqlQuery(self.db)
+        for sql in sqlList:
+            if not query.exec_(sql):
+                if useTransaction:
+                    self.db.rollback()
+                raise Exception(self.tr('Problem inserting flags: ') + query.lastError().text())
+        if useTransaction:
+            self.db.commit()
+        return len(flagTupleList)
+
+    def getFlagValueList(self, flagTupleList):
+        """
+        Resolves the SRIDs of the flags, querying each (schema, table, geometry column) only once
+        flagTupleList: flag tuple list
+        returns: flag SRID and a list of tuples (layer, feat_id, reason, geom, srid, geometryColumn)
+        """
+        # specific EPSG search
+        flagSRID = self.findEPSG(parameters={'tableSchema':'validation', 'tableName':'aux_flags_validacao_p', 'geometryColumn':'geom'})
+        sridDict = dict()
+        flagValueList = []
+        for record in flagTupleList:
+            key = (record[0], record[4])
+            if key not in sridDict:
                 try:
                     tableSchema, tableName = record[0].split('.')
                     parameters = {'tableSchema':tableSchema, 'tableName':tableName, 'geometryColumn':record[4]}
-                    srid = self.findEPSG(parameters=parameters)
+                    sridDict[key] = self.findEPSG(parameters=parameters)
                 except:
-                    srid = flagSRID
-                #actual flag insertion
-                sql = self.gen.insertFlagIntoDb(record[0], record[1], record[2], record[3], srid, processName, dimension, record[4], flagSRID)
-                if not query.exec_(sql):
-                    if useTransaction:
-                        self.db.rollback()
-                    raise Exception(self.tr('Problem inserting flags: ') + query.lastError().text())
-            if useTransaction:
-                self.db.commit()
-            return len(flagTupleList)
-        else:
-            return 0
+                    sridDict[key] = flagSRID
+            flagValueList.append((record[0], record[1], record[2], record[3], sridDict[key], record[4]))
+        return flagSRID, flagValueList
+
+    def insertFlagsWithCopy(self, flagValueList, processName, flagSRID, partitioned = False):
+        """
+        Streams flags into a staging table with COPY and moves them to the flag tables with one statement
+        flagValueList: list of tuples (layer, feat_id, reason, geom, srid, geometryColumn)
+        processName: process name
+        flagSRID: flag tables' SRID
+        partitioned: flags are inserted into the partitions of processName
+        """
+        stagingTable = 'flag_staging_{0}'.format(str(uuid4()).replace('-', '_'))
+        lines = []
+        for record in flagValueList:
+            lines.append(u'\t'.join([self.escapeCopyValue(value) for value in record]) + u'\n')
+        copyBuffer = io.BytesIO(u''.join(lines).encode('utf-8'))
+        conn = self.getPsycopg2Connection()
+        try:
+            cursor = conn.cursor()
+            if partitioned:
+                for sql in self.gen.createFlagPartitions(processName).split('#'):
+                    cursor.execute(sql)
+            cursor.execute(self.gen.createFlagStagingTable(stagingTable))
+            cursor.copy_expert("COPY pg_temp.{0} (layer, feat_id, reason, geom, srid, geometry_column) FROM STDIN".format(stagingTable), copyBuffer)
+            cursor.execute(self.gen.insertFlagsFromStagingTable(stagingTable, processName, flagSRID, partitioned))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(self.tr('Problem inserting flags: ') + ':'.join(map(unicode, e.args)))
+        finally:
+            conn.close()
+        return len(flagValueList)
+
+    def getPsycopg2Connection(self):
+        """
+        Opens a psycopg2 connection to the same database, used by the COPY based bulk loaders
+        """
+        (host, port, user, password) = self.getDatabaseParameters()
+        return psycopg2.connect(host=host, port=port, dbname=self.getDatabaseName(), user=user, password=password)
+
+    def escapeCopyValue(self, value):
+        """
+        Escapes a value to the COPY text format
+        """
+        if value is None or (hasattr(value, 'isNull') and value.isNull()):
+            return u'\\N'
+        if isinstance(value, bool):
+            return u't' if value else u'f'
+        if isinstance(value, (QDate, QDateTime, QTime)):
+            value = value.toString(Qt.ISODate)
+        if isinstance(value, float):
+            # unicode() keeps only 12 significant digits of a float
+            value = repr(value)
+        return unicode(value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(u'\n', u'\\n').replace(u'\r', u'\\r')
     
     def deleteProcessFlags(self, processName=None, className=None, flagId=None):
         """
@@ -991,7 +1088,11 @@ class PostgisDb(AbstractDb):
             processName = ''
         if className == self.dictNoClassNoProcess['No Layer']:
             className = ''
-        sql = self.gen.deleteFlags(processName=processName, className=className, flagId=flagId)
+        if processName and not className and not flagId and self.isFlagPartitioningEnabled():
+            # all flags of the process: its partitions are truncated instead of deleting row by row
+            sql = '#'.join([self.gen.createFlagPartitions(processName), self.gen.truncateFlagPartitions(processName)])
+        else:
+            sql = self.gen.deleteFlags(processName=processName, className=className, flagId=flagId)
         sqlList = sql.split('#')
         query = QSqlQuery(self.db)
         self.db.transaction()
@@ -1000,6 +1101,17 @@ class PostgisDb(AbstractDb):
                 self.db.rollback()
                 raise Exception(self.tr('Problem deleting flags: ') + query.lastError().text())
         self.db.commit()
+
+    def isFlagPartitioningEnabled(self):
+        """
+        Checks if flags are stored in one partition of the flag tables per process (see PostGISSqlGenerator.createFlagPartitions).
+        Partitions inherit the flag tables, so databases may hold flags stored in both ways.
+        """
+        settings = QSettings()
+        settings.beginGroup('PythonPlugins/DsgTools/Options')
+        flagPartitioning = settings.value('flagPartitioning')
+        settings.endGroup()
+        return flagPartitioning in (True, 'true', '1')
             
     def checkAndCreateValidationStructure(self, useTransaction = True):
         """
@@ -1027,6 +1139,37 @@ class PostgisDb(AbstractDb):
                     raise Exception(self.tr('Problem creating structure: ') + query.lastError().text())
             if useTransaction:
                 self.db.commit()
+        else:
+            self.upgradeValidationStructure(useTransaction)
+
+    def upgradeValidationStructure(self, useTransaction = True):
+        """
+        Migrates validation structures created without the flag indexes or without the process metrics.
+        Indexing a large flag table takes a while, but it is done only once.
+        """
+        upgradeList = [(self.gen.checkFlagIndexes(), self.gen.createFlagIndexes(), self.tr('Creating indexes on the flag tables of {0}.')),
+                       (self.gen.checkProcessMetricsColumns(), self.gen.createProcessMetricsColumns(), self.tr('Adding process metrics to the process history of {0}.'))]
+        for checkSql, upgradeSql, msg in upgradeList:
+            query = QSqlQuery(checkSql, self.db)
+            if not query.isActive():
+                raise Exception(self.tr('Problem upgrading structure: ')+query.lastError().text())
+            upgraded = False
+            while query.next():
+                if query.value(0) > 0:
+                    upgraded = True
+            if upgraded:
+                continue
+            QgsMessageLog.logMessage(msg.format(self.db.databaseName()), "DSG Tools Plugin", QgsMessageLog.INFO)
+            query = QSqlQuery(self.db)
+            if useTransaction:
+                self.db.transaction()
+            for sql in upgradeSql.split('#'):
+                if not query.exec_(sql):
+                    if useTransaction:
+                        self.db.rollback()
+                    raise Exception(self.tr('Problem upgrading structure: ') + query.lastError().text())
+            if useTransaction:
+                self.db.commit()
                 
     def getValidationStatus(self, processName):
         """
@@ -1058,13 +1201,15 @@ class PostgisDb(AbstractDb):
             ret = query.value(0)
         return ret
 
-    def setValidationProcessStatus(self, processName, log, status):
+    def setValidationProcessStatus(self, processName, log, status, metrics = None):
         """
         Sets the validation status for a specific process
         processName: process name
+        metrics: dict with the metrics of the run (featuresScanned, flagsRaised, elapsedTime in seconds and
+        layerMetrics as a json string). They are recorded along with the status.
         """
         self.checkAndOpenDb()
-        sql = self.gen.setValidationStatusQuery(processName, log, status)
+        sql = self.gen.setValidationStatusQuery(processName, log, status, metrics)
         query = QSqlQuery(self.db)
         if not query.exec_(sql):
             raise Exception(self.tr('Problem setting status: ') + query.lastError().text())
@@ -1117,21 +1262,6 @@ class PostgisDb(AbstractDb):
             ret.append((flagClass, feat_id, reason, geom, aGeomColumn))
         return ret
 
-    def getDimension(self, geom):
-        """
-        Gets geometry's dimension
-        geom: geometry tested
-        """
-        self.checkAndOpenDb()
-        sql = self.gen.getDimension(geom)
-        query = QSqlQuery(sql, self.db)
-        if not query.isActive():
-            raise Exception(self.tr('Problem getting dimension: ') + query.lastError().text()) 
-        dimension = 0
-        while query.next():
-            dimension = query.value(0)
-        return dimension
-    
     def getExplodeCandidates(self, cl):
         """
         Gets multi geometries (i.e number of parts > 1) that will be deaggregated later
@@ -1749,68 +1879,85 @@ class PostgisDb(AbstractDb):
             self.db.commit()
         return result
 
-    def createAndPopulateTempTableFromMap(self, tableName, featureMap, geomColumnName, keyColumn, srid, useTransaction=True):
-        self.checkAndOpenDb()
-        if useTransaction:
-            self.db.transaction()
-        query = QSqlQuery(self.db)
-        sql = self.gen.createTempTable(tableName)
-        sqls = sql.split('#')
-        for s in sqls:
-            if not query.exec_(s):
-                if useTransaction:
-                    self.db.rollback()
-                raise Exception(self.tr('Problem creating temp table {}: '.format(tableName)) + query.lastError().text())
-        attributes = None
-        auxAttributes = None
-        for feat in featureMap.values():
-            if not attributes:
-                # getting only provider fields (we ignore expression fields - type = 6)
-                attributes = [field.name() for field in feat.fields() if field.type() != 6]
-            # getting keyColumn idx
-            keyIdx = feat.fieldNameIndex(keyColumn)
-            # getting only the needed attribute values
-            values = []
-            for field in attributes:
-                if field == keyColumn:
-                    values.append(feat.id())
-                else:
-                    values.append(feat.attribute(field))
+    def createAndPopulateTempTableFromIterator(self, tableName, featureIterator, geomColumnName, keyColumn, srid, chunkSize = 10000):
+        """
+        Creates and populates the temp table of a layer. Features are consumed from featureIterator
+        and sent with COPY in chunks through a psycopg2 connection. The spatial index is created after the load.
+        It always commits its own transaction.
+        tableName: table name with schema (the temp table is tableName + '_temp')
+        featureIterator: QgsFeatureIterator or any iterable of QgsFeature
+        returns: (number of rows loaded, rows per second)
+        """
+        startTime = datetime.now()
+        conn = self.getPsycopg2Connection()
+        try:
+            cursor = conn.cursor()
+            for sql in self.gen.createTempTable(tableName).split('#'):
+                cursor.execute(sql)
+            rowCount = self.copyFeaturesIntoTable(cursor, tableName + '_temp', featureIterator, geomColumnName, keyColumn, srid, chunkSize)
+            cursor.execute(self.gen.createSpatialIndex(tableName, geomColumnName))
+            cursor.execute(self.gen.analyzeTable(tableName + '_temp'))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(self.tr('Problem creating temp table {}: '.format(tableName)) + ':'.join(map(unicode, e.args)))
+        finally:
+            conn.close()
+        return rowCount, self.getRowsPerSecond(rowCount, startTime)
+
+    def copyFeaturesIntoTable(self, cursor, tableName, featureIterator, geomColumnName, keyColumn, srid, chunkSize, attributes = None):
+        """
+        Streams features into tableName. The rows are sent with COPY into a staging table, with the geometry
+        as hex WKB, and moved into tableName with a single INSERT that sets SRID and multi type.
+        cursor: psycopg2 cursor
+        attributes: list of attribute names to be loaded. Defaults to the provider fields of the first feature
+        returns: number of rows
+        """
+        stagingTable = 'copy_staging_{0}'.format(str(uuid4()).replace('-', '_'))
+        rowCount = 0
+        lines = []
+        columns = None
+        for feat in featureIterator:
+            if columns is None:
+                if attributes is None:
+                    # getting only provider fields (we ignore expression fields - type = 6)
+                    attributes = [field.name() for field in feat.fields() if field.type() != 6]
+                columns = attributes + [geomColumnName]
+                cursor.execute(self.gen.createCopyStagingTable(stagingTable, tableName, attributes, geomColumnName))
             if not feat.geometry():
                 continue
-            geometry = binascii.hexlify(feat.geometry().asWkb())
-            # adding the geometry column to attributes
-            if not auxAttributes:
-                auxAttributes = attributes[:] #this is done not to mess up original attributes list
-                auxAttributes.append(geomColumnName)
-            # adding the geometry value to values
-            values.append(geometry)
-            # preparing 
-            prepareValues = []
-            for attr in auxAttributes:
-                if attr == geomColumnName:
-                    prepareValues.append("""ST_SetSRID(ST_Multi(:{0}),{1})""".format(attr,str(srid)))
-                else:
-                    prepareValues.append(':'+attr)
-            #getting sql
-            insertSql = self.gen.populateTempTable(tableName, auxAttributes, prepareValues)
-            query.prepare(insertSql)
-            # binding my values to avoid injections
-            for i in range(len(auxAttributes)):
-                query.bindValue(prepareValues[i], values[i])
-            # actual query execution
-            if not query.exec_():
-                if useTransaction:
-                    self.db.rollback()
-                raise Exception(self.tr('Problem creating temp table {}: '.format(tableName)) + query.lastError().text())
-        indexSql = self.gen.createSpatialIndex(tableName, geomColumnName)
-        if not query.exec_(indexSql):
-            if useTransaction:
-                self.db.rollback()
-            raise Exception(self.tr('Problem creating spatial index on temp table {}: '.format(tableName)) + query.lastError().text())
-        if useTransaction:
-            self.db.commit()        
-        
+            values = [feat.id() if field == keyColumn else feat.attribute(field) for field in attributes]
+            values.append(binascii.hexlify(feat.geometry().asWkb()))
+            lines.append(u'\t'.join([self.escapeCopyValue(value) for value in values]) + u'\n')
+            if len(lines) == chunkSize:
+                rowCount += self.copyLines(cursor, stagingTable, columns, lines)
+                lines = []
+        if columns is None:
+            # empty iterator, nothing to load
+            return 0
+        rowCount += self.copyLines(cursor, stagingTable, columns, lines)
+        cursor.execute(self.gen.insertFromCopyStagingTable(stagingTable, tableName, attributes, geomColumnName, srid))
+        return rowCount
+
+    def copyLines(self, cursor, tableName, columns, lines):
+        """
+        Sends lines already in the COPY text format
+        returns: number of lines
+        """
+        if len(lines) > 0:
+            copyBuffer = io.BytesIO(u''.join(lines).encode('utf-8'))
+            columnString = ','.join(['"{0}"'.format(column) for column in columns])
+            cursor.copy_expert(u'COPY pg_temp.{0} ({1}) FROM STDIN'.format(tableName, columnString), copyBuffer)
+        return len(lines)
+
+    def getRowsPerSecond(self, rowCount, startTime):
+        """
+        Computes the load rate since startTime
+        """
+        elapsed = datetime.now() - startTime
+        seconds = elapsed.days * 86400 + elapsed.seconds + elapsed.microseconds / 1e6
+        return rowCount / seconds if seconds > 0 else float(rowCount)
+
     def dropTempTable(self, tableName, useTransaction = True):
         self.checkAndOpenDb()
         if useTransaction:
@@ -2118,9 +2265,13 @@ class PostgisDb(AbstractDb):
         if not query.isActive():
             raise Exception(self.tr("Problem getting geom schemas from db: ")+query.lastError().text())
         geomDict = dict()
+        fkList = []
         while query.next():
             #parse done in parseFkQuery to make code cleaner.
-            tableName, fkAttribute, domainTable, domainReferencedAttribute = self.parseFkQuery(query.value(0),query.value(1))
+            fkList.append(self.parseFkQuery(query.value(0),query.value(1)))
+        #values of all referenced domains are read at once
+        layerColumnDict = self.getLayerColumnDictV2(list(set([(domainReferencedAttribute, domainTable) for tableName, fkAttribute, domainTable, domainReferencedAttribute in fkList])))
+        for tableName, fkAttribute, domainTable, domainReferencedAttribute in fkList:
             if tableName not in geomDict.keys():
                 geomDict[tableName] = dict()
             if 'columns' not in geomDict[tableName].keys():
@@ -2129,7 +2280,7 @@ class PostgisDb(AbstractDb):
                 geomDict[tableName]['columns'][fkAttribute] = dict()
             geomDict[tableName]['columns'][fkAttribute]['references'] = domainTable
             geomDict[tableName]['columns'][fkAttribute]['refPk'] = domainReferencedAttribute
-            values, otherKey = self.getLayerColumnDict(domainReferencedAttribute, domainTable)
+            values, otherKey = layerColumnDict[(domainReferencedAttribute, domainTable)]
             geomDict[tableName]['columns'][fkAttribute]['values'] = values
             geomDict[tableName]['columns'][fkAttribute]['otherKey'] = otherKey
             geomDict[tableName]['columns'][fkAttribute]['constraintList'] = []
@@ -2450,6 +2601,34 @@ class PostgisDb(AbstractDb):
             domainDict[aux[refPk]] = aux[otherKey]
         return domainDict, otherKey
     
+    def getLayerColumnDictV2(self, refPkDomainList):
+        """
+        Reads the values of several domain tables with a single query.
+        :param refPkDomainList: list of (refPk, domainTable)
+        :return: dict {(refPk, domainTable): (domainDict, otherKey)}, as in getLayerColumnDict
+        """
+        self.checkAndOpenDb()
+        layerColumnDict = {refPkDomain : (dict(), None) for refPkDomain in refPkDomainList}
+        if len(refPkDomainList) == 0:
+            return layerColumnDict
+        domainTableList = list(set([domainTable for refPk, domainTable in refPkDomainList]))
+        sql = self.gen.getDomainCodeDictList(domainTableList)
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr("Problem getting layer column dict from tables ")+', '.join(domainTableList)+':'+query.lastError().text())
+        rowDict = {domainTable : [] for domainTable in domainTableList}
+        while query.next():
+            rowDict[domainTableList[query.value(0)]].append(json.loads(query.value(1)))
+        for refPk, domainTable in refPkDomainList:
+            domainDict = dict()
+            otherKey = None
+            for aux in rowDict[domainTable]:
+                if not otherKey:
+                    otherKey = [key for key in aux.keys() if key <> refPk][0]
+                domainDict[aux[refPk]] = aux[otherKey]
+            layerColumnDict[(refPk, domainTable)] = (domainDict, otherKey)
+        return layerColumnDict
+
     def getGeomStructDict(self):
         """
         Returns dict in the following format:
@@ -3386,6 +3565,52 @@ class PostgisDb(AbstractDb):
         while query.next():
             return query.value(0)
     
+    def getPrimaryKeyDict(self):
+        """
+        Gets the primary key column of all tables with a single query
+        :return: dict {(tableSchema, tableName): primaryKeyColumn}
+        """
+        self.checkAndOpenDb()
+        sql = self.gen.getPrimaryKeyDict()
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr("Problem getting primary key columns: ")+query.lastError().text())
+        primaryKeyDict = dict()
+        while query.next():
+            key = (query.value(0), query.value(1))
+            if key not in primaryKeyDict:
+                primaryKeyDict[key] = query.value(2)
+        return primaryKeyDict
+
+    def getSchemaFingerprint(self):
+        """
+        Gets the database OID and a hash of the catalog rows that define the schema (columns and constraints)
+        and of the modifications made to domain tables. Used to invalidate cached metadata.
+        :return: (databaseOid, fingerprint)
+        """
+        self.checkAndOpenDb()
+        sql = self.gen.getSchemaFingerprint()
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr("Problem getting schema fingerprint: ")+query.lastError().text())
+        while query.next():
+            return query.value(0), query.value(1)
+
+    def getMetadataCache(self, validate = True, cacheDir = None):
+        """
+        Gets the metadata cache of this database, shared by layer loaders and tools
+        :param validate: (bool) checks the schema fingerprint before returning the cache
+        :param cacheDir: (str) if given, the cache is also stored on this directory
+        :return: (PostgisMetadataCache)
+        """
+        if getattr(self, 'metadataCache', None) is None:
+            self.metadataCache = PostgisMetadataCache(self, cacheDir = cacheDir)
+        elif cacheDir:
+            self.metadataCache.cacheDir = cacheDir
+        if validate or not self.metadataCache.isValidated():
+            self.metadataCache.validate()
+        return self.metadataCache
+
     def dropAllConections(self, dbName):
         """
         Terminates all database conections
@@ -3433,95 +3658,65 @@ class PostgisDb(AbstractDb):
             sql_file_path = os.path.join(current_dir, '..', '..', 'ext_dep', 'postgisaddon', 'postgis_addons.sql')
             self.runSqlFromFile(sql_file_path, useTransaction)
 
-    def createAndPopulateCoverageTempTable(self, coverageLayer, useTransaction = True):
+    def createAndPopulateCoverageTempTable(self, coverageLayer, chunkSize = 10000):
         """
-        Creates and populates a postgis table with features that compose the coverage layer
+        Creates and populates a postgis table with features that compose the coverage layer.
+        Features are streamed with COPY through a psycopg2 connection, which commits its own transaction.
+        returns: (number of rows loaded, rows per second)
         """
-        self.checkAndOpenDb()
-        if useTransaction:
-            self.db.transaction()
-        query = QSqlQuery(self.db)
+        startTime = datetime.now()
         #getting srid from something like 'EPSG:31983'
         srid = coverageLayer.crs().authid().split(':')[-1]
         #complete table name
         tableName = 'validation.coverage'
-        sql = self.gen.createCoverageTempTable(srid)
-        if not query.exec_(sql):
-            if useTransaction:
-                self.db.rollback()
-            raise Exception(self.tr('Problem creating coverage temp table: ') + query.lastError().text())
-        for feat in coverageLayer.getFeatures():
-            # getting only the needed attribute values
-            featid = feat['featid']
-            classname = feat['classname']
-            if not feat.geometry():
-                continue
-            geometry = binascii.hexlify(feat.geometry().asWkb())
-            # values list and attributes list
-            values = [featid, classname, geometry]
-            attributes = ['featid', 'classname', 'geom']
-            # preparing 
-            prepareValues = []
-            for attr in attributes:
-                if attr == 'geom':
-                    prepareValues.append("""ST_SetSRID(ST_Multi(:{0}),{1})""".format(attr,str(srid)))
-                else:
-                    prepareValues.append(':'+attr)
-            #getting sql
-            insertSql = self.gen.populateTempTable(tableName, attributes, prepareValues)
-            query.prepare(insertSql)
-            # binding my values to avoid injections
-            for i in range(len(attributes)):
-                query.bindValue(prepareValues[i], values[i])
-            # actual query execution
-            if not query.exec_():
-                if useTransaction:
-                    self.db.rollback()
-                raise Exception(self.tr('Problem populating coverage temp table: ') + query.lastError().text())
-        indexSql = self.gen.createSpatialIndex(tableName, 'geom')
-        if not query.exec_(indexSql):
-            if useTransaction:
-                self.db.rollback()
-            raise Exception(self.tr('Problem creating spatial index on coverage temp table: ') + query.lastError().text())
-        if useTransaction:
-            self.db.commit()   
+        conn = self.getPsycopg2Connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.gen.createCoverageTempTable(srid))
+            rowCount = self.copyFeaturesIntoTable(cursor, tableName + '_temp', coverageLayer.getFeatures(), 'geom', None, srid, chunkSize, attributes = ['featid', 'classname'])
+            cursor.execute(self.gen.createSpatialIndex(tableName, 'geom'))
+            cursor.execute(self.gen.analyzeTable(tableName + '_temp'))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(self.tr('Problem populating coverage temp table: ') + ':'.join(map(unicode, e.args)))
+        finally:
+            conn.close()
+        return rowCount, self.getRowsPerSecond(rowCount, startTime)
 
     def getGapsAndOverlapsRecords(self, frameTable, geomColumn, useTransaction = True):
         """
         Identify gaps and overlaps in the coverage layer
+        frameTable: frame table name (schema.table)
+        geomColumn: geometry column of the frame table
         """
-        self.checkAndOpenDb()
-        # checking for gaps with frame
-        invalidCoverageRecordsList = []
-        sql = self.gen.checkCoverageForGapsWithFrame(frameTable, geomColumn)
-        query = QSqlQuery(sql, self.db)
-        if not query.isActive():
-            raise Exception(self.tr("Problem getting gaps: ")+query.lastError().text())
-        while query.next():
-            reason = self.tr('Gap between the frame layer and coverage layer')
-            geom = query.value(0)
-            invalidCoverageRecordsList.append( (0, reason, geom) )
-        # checking for overlaps in coverage
-        invalidCoverageRecordsList += self.getOverlapsRecords('validation.coverage_temp','geom','id')
-        # checking for inner gaps in coverage
-        invalidCoverageRecordsList += self.getGapsRecords('validation.coverage_temp','geom','id')
-        return invalidCoverageRecordsList
+        return self.getCoverageRecords('validation.coverage_temp', 'geom', 'id', frameTable=frameTable, frameGeomColumn=geomColumn)
 
     def getOverlapsRecords(self, table, geomColumn, keyColumn, useTransaction = True):
         """
-        Identify gaps and overlaps in the coverage layer
+        Identify overlaps in the coverage layer
+        """
+        return self.getCoverageRecords(table, geomColumn, keyColumn, checkGaps=False)
+
+    def getCoverageRecords(self, table, geomColumn, keyColumn, frameTable = None, frameGeomColumn = 'geom', checkGaps = True, checkOverlaps = True):
+        """
+        Identifies gaps and overlaps of a coverage with a single query (see PostGISSqlGenerator.checkCoverage)
+        table: coverage table name (schema.table)
+        frameTable: frame table name. When given, gaps between the frame and the coverage are also identified
+        returns: list of tuples (0, reason, geom)
         """
         self.checkAndOpenDb()
-        # checking for gaps
-        invalidRecordsList = []
-        # checking for overlaps
-        sql = self.gen.checkCoverageForOverlaps(table, geomColumn, keyColumn)
+        reasonDict = {'overlap' : self.tr('Overlap between the features of the layer'),
+                      'gap' : self.tr('Gap between the features of the layer'),
+                      'frame' : self.tr('Gap between the frame layer and coverage layer')}
+        sql = self.gen.checkCoverage(table, geomColumn, keyColumn, frameTable=frameTable, frameGeomColumn=frameGeomColumn, checkGaps=checkGaps, checkOverlaps=checkOverlaps)
         query = QSqlQuery(sql, self.db)
         if not query.isActive():
-            raise Exception(self.tr("Problem getting overlaps: ")+query.lastError().text())
+            raise Exception(self.tr("Problem checking coverage: ")+query.lastError().text())
+        invalidRecordsList = []
         while query.next():
-            reason = self.tr('Overlap between the features of the layer')
-            geom = query.value(0)
+            reason = reasonDict[query.value(0)]
+            geom = query.value(1)
             invalidRecordsList.append( (0, reason, geom) )
         return invalidRecordsList
     
@@ -3590,36 +3785,61 @@ class PostgisDb(AbstractDb):
 
     def getGapsRecords(self, table, geomColumn, keyColumn, useTransaction = True):
         """
-        Identify gaps and overlaps in the coverage layer
+        Identify gaps in the coverage layer
         """
-        self.checkAndOpenDb()
-        # checking for gaps
-        invalidRecordsList = []
-        # checking for overlaps
-        sql = self.gen.checkCoverageForGaps(table, geomColumn, keyColumn)
-        query = QSqlQuery(sql, self.db)
-        if not query.isActive():
-            raise Exception(self.tr("Problem getting gaps: ")+query.lastError().text())
-        while query.next():
-            reason = self.tr('Gap between the features of the layer')
-            geom = query.value(0)
-            invalidRecordsList.append( (0, reason, geom) )
-        return invalidRecordsList
+        return self.getCoverageRecords(table, geomColumn, keyColumn, checkOverlaps=False)
 
     def getNumberOfFlagsByProcess(self, processName):
         """
         Returns the number of flags raised by a process.
         """
         self.checkAndOpenDb()
-        sql = self.gen.getFlagsByProcess(processName)
+        sql = self.gen.getFlagCountByProcess(processName)
         query = QSqlQuery(sql, self.db)
         if not query.isActive():
             raise Exception(self.tr('Problem while retrieving flags dict: ') + query.lastError().text())
         nrFlags = 0
         while query.next():
-            nrFlags += 1
+            nrFlags = query.value(0)
         return nrFlags
 
+    def getFlagStatistics(self, processName = None, className = None):
+        """
+        Returns the number of flags grouped by process, layer and dimension, counted by the server.
+        processName: only flags of this process are counted
+        className: only flags of this layer are counted
+        returns: dict {(process name, layer, dimension): number of flags}
+        """
+        self.checkAndOpenDb()
+        sql = self.gen.getFlagStatistics(processName=processName, className=className)
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr('Problem while retrieving flag statistics: ') + query.lastError().text())
+        statisticsDict = dict()
+        while query.next():
+            statisticsDict[(query.value(0), query.value(1), query.value(2))] = query.value(3)
+        return statisticsDict
+
+    def getProcessRunMetrics(self, processName):
+        """
+        Returns the metrics recorded by each run of a process, oldest first.
+        returns: list of dicts with the keys finished, featuresScanned, flagsRaised, elapsedTime and layerMetrics
+        ({layer: {'features': number of staged features, 'flags': number of flags, 'elapsedTime': seconds}})
+        """
+        self.checkAndOpenDb()
+        sql = self.gen.getProcessRunMetrics(processName)
+        query = QSqlQuery(sql, self.db)
+        if not query.isActive():
+            raise Exception(self.tr('Problem while retrieving process metrics: ') + query.lastError().text())
+        metricsList = []
+        while query.next():
+            metricsList.append({'finished' : query.value(0), 
+                                'featuresScanned' : query.value(1), 
+                                'flagsRaised' : query.value(2), 
+                                'elapsedTime' : query.value(3), 
+                                'layerMetrics' : json.loads(query.value(4)) if query.value(4) else dict()})
+        return metricsList
+
     def createValidationHistoryViewTable(self, idListString=None):
         """
         Creates the view table for validation processes history. 
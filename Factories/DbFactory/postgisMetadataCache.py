@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-22
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os, cPickle
+
+from qgis.core import QgsMessageLog
+
+class PostgisMetadataCache(object):
+    """
+    In-memory cache of the schema metadata of a PostgisDb (domains, check constraints, array columns,
+    not null columns and primary keys). Everything is read from the database catalog once and reused until
+    the schema fingerprint (see PostgisDb.getSchemaFingerprint) changes.
+    When cacheDir is given, the metadata is also stored on disk, keyed by database OID and fingerprint.
+    """
+    def __init__(self, abstractDb, cacheDir = None):
+        """
+        Constructor
+        :param abstractDb: (PostgisDb) database whose metadata is cached.
+        :param cacheDir: (str) directory used to store the metadata on disk. If None, the cache is kept only in memory.
+        """
+        self.abstractDb = abstractDb
+        self.cacheDir = cacheDir
+        self.databaseOid = None
+        self.fingerprint = None
+        self.dataDict = dict()
+
+    def validate(self):
+        """
+        Checks the schema fingerprint and drops the cached metadata if it changed
+        """
+        databaseOid, fingerprint = self.abstractDb.getSchemaFingerprint()
+        if (databaseOid, fingerprint) == (self.databaseOid, self.fingerprint):
+            return
+        self.databaseOid = databaseOid
+        self.fingerprint = fingerprint
+        self.dataDict = self.loadFromDisk()
+
+    def isValidated(self):
+        return self.fingerprint is not None
+
+    def getCacheFileName(self):
+        """
+        Gets the file used to store the metadata of this database and fingerprint
+        """
+        host, port, user, password = self.abstractDb.getDatabaseParameters()
+        fileName = '{0}_{1}_{2}_{3}.pickle'.format(host, port, self.databaseOid, self.fingerprint)
+        return os.path.join(self.cacheDir, fileName)
+
+    def loadFromDisk(self):
+        """
+        Loads the metadata stored for the current fingerprint, if any
+        """
+        if not self.cacheDir:
+            return dict()
+        try:
+            with open(self.getCacheFileName(), 'rb') as f:
+                return cPickle.load(f)
+        except:
+            return dict()
+
+    def saveToDisk(self):
+        """
+        Stores the current metadata on disk
+        """
+        if not self.cacheDir:
+            return
+        try:
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            with open(self.getCacheFileName(), 'wb') as f:
+                cPickle.dump(self.dataDict, f, cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            QgsMessageLog.logMessage(self.abstractDb.tr('Problem saving metadata cache: ')+':'.join(map(str, e.args)), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
+
+    def get(self, key, fetchMethod, *args):
+        """
+        Gets the cached value of key, calling fetchMethod(*args) when it is not cached yet
+        """
+        if not self.isValidated():
+            self.validate()
+        if key not in self.dataDict:
+            self.dataDict[key] = fetchMethod(*args)
+            self.saveToDisk()
+        return self.dataDict[key]
+
+    def getDbDomainDict(self, auxGeomDict):
+        """
+        Cached PostgisDb.getDbDomainDict
+        """
+        return self.get('domainDict', self.abstractDb.getDbDomainDict, auxGeomDict)
+
+    def getCheckConstraintDict(self):
+        """
+        Cached PostgisDb.getCheckConstraintDict
+        """
+        return self.get('checkConstraintDict', self.abstractDb.getCheckConstraintDict)
+
+    def getMultiColumnsDict(self):
+        """
+        Cached PostgisDb.getMultiColumnsDict
+        """
+        return self.get('multiColumnsDict', self.abstractDb.getMultiColumnsDict)
+
+    def getNotNullDictV2(self):
+        """
+        Cached PostgisDb.getNotNullDictV2
+        """
+        return self.get('notNullDict', self.abstractDb.getNotNullDictV2)
+
+    def getGeomStructDict(self):
+        """
+        Cached PostgisDb.getGeomStructDict
+        """
+        return self.get('geomStructDict', self.abstractDb.getGeomStructDict)
+
+    def getPrimaryKeyColumn(self, tableName):
+        """
+        Gets the primary key column of a table using the primary keys of all tables, read at once
+        :param tableName: (str) table name as "schema"."table"
+        """
+        primaryKeyDict = self.get('primaryKeyDict', self.abstractDb.getPrimaryKeyDict)
+        tableSchema, tableName = tableName.replace("'","").replace('"','').split('.')
+        return primaryKeyDict.get((tableSchema, tableName))
@@ -312,7 +312,6 @@ class SpatialiteDb(AbstractDb):
         complex: complex class name
         '''
         self.checkAndOpenDb()
-        associatedDict = dict()
         #query to get the possible links to the selected complex in the combobox
         complexName = complex.replace('complexos_', '')
         sql = self.gen.getComplexLinks(complexName)
@@ -320,45 +319,19 @@ class SpatialiteDb(AbstractDb):
         if not query.isActive():
             self.db.close()
             raise Exception(self.tr("Problem loading associated features: ")+query.lastError().text())
-
+        linkList = []
         while query.next():
-            #setting the variables
-            complex_schema = query.value(0)
-            complex = query.value(1)
-            aggregated_schema = query.value(2)
-            aggregated_class = query.value(3)
-            column_name = query.value(4)
-            
-            if aggregated_class.split('_')[-1] not in ['p', 'l', 'a']:
+            #(complex_schema, complex, aggregated_schema, aggregated_class, column_name)
+            link = tuple(query.value(i) for i in range(5))
+            if link[3].split('_')[-1] not in ['p', 'l', 'a']:
                 continue
-
-            #query to obtain the created complexes
-            sql = self.gen.getComplexData(complex_schema, complex)
-            complexQuery = QSqlQuery(sql, self.db)
-            if not complexQuery.isActive():
-                self.db.close()
-                raise Exception(self.tr("Problem executing query: ")+complexQuery.lastError().text())
-
-            while complexQuery.next():
-                complex_uuid = complexQuery.value(0)
-                name = complexQuery.value(1)
-
-                if not (complex_uuid and name):
-                    continue
-
-                associatedDict = self.utils.buildNestedDict(associatedDict, [name, complex_uuid, aggregated_class], [])
-
-                #query to obtain the id of the associated feature
-                sql = self.gen.getAssociatedFeaturesData(aggregated_schema, aggregated_class, column_name, complex_uuid)
-                associatedQuery = QSqlQuery(sql, self.db)
-                if not associatedQuery.isActive():
-                    self.db.close()
-                    raise Exception(self.tr("Problem executing query: ")+associatedQuery.lastError().text())
-
-                while associatedQuery.next():
-                    ogc_fid = associatedQuery.value(0)
-                    associatedDict = self.utils.buildNestedDict(associatedDict, [name, complex_uuid, aggregated_class], [ogc_fid])
-        return associatedDict
+            linkList.append(link)
+        #complexes and associated features of all links are obtained at once
+        try:
+            return self.getAssociatedDictFromLinks(linkList)
+        except Exception as e:
+            self.db.close()
+            raise e
     
     def isComplexClass(self, className):
         '''
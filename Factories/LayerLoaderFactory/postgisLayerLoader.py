@@ -135,11 +135,12 @@ class PostGISLayerLoader(EDGVLayerLoader):
             domLayerDict = self.loadDomains(filteredLayerList, loadedLayers, domainGroup)
         else:
             domLayerDict = dict()
-        #4. Get Aux dicts
-        domainDict = self.abstractDb.getDbDomainDict(self.geomDict)
-        constraintDict = self.abstractDb.getCheckConstraintDict()
-        multiColumnsDict = self.abstractDb.getMultiColumnsDict()
-        notNullDict = self.abstractDb.getNotNullDictV2()
+        #4. Get Aux dicts (cached by the database until its schema changes)
+        metadataCache = self.abstractDb.getMetadataCache()
+        domainDict = metadataCache.getDbDomainDict(self.geomDict)
+        constraintDict = metadataCache.getCheckConstraintDict()
+        multiColumnsDict = metadataCache.getMultiColumnsDict()
+        notNullDict = metadataCache.getNotNullDictV2()
         lyrDict = self.getLyrDict(filteredDictList, isEdgv=isEdgv)
         
         #5. Build Groups
@@ -204,7 +205,7 @@ class PostGISLayerLoader(EDGVLayerLoader):
             if lyr:
                 return lyr
         fullName = '''"{0}"."{1}"'''.format(schema, tableName)
-        pkColumn = self.abstractDb.getPrimaryKeyColumn(fullName)
+        pkColumn = self.abstractDb.getMetadataCache(validate = False).getPrimaryKeyColumn(fullName)
         if useInheritance or self.abstractDb.getDatabaseVersion() in ['3.0', 'Non_Edgv']:
             sql = ''
         else:
@@ -20,6 +20,8 @@
  *                                                                         *
  ***************************************************************************/
 """
+import hashlib, re
+
 from DsgTools.Factories.SqlFactory.sqlGenerator import SqlGenerator
 from DsgTools.dsgEnums import DsgEnums
 
@@ -41,6 +43,18 @@ class PostGISSqlGenerator(SqlGenerator):
         sql = "SELECT id from only "+aggregated_schema+"."+aggregated_class+" where "+column_name+"="+'\''+complex_uuid+'\''
         return sql
 
+    def getAssociatedFeaturesFromLinks(self, linkList):
+        """
+        Gets (complex uuid, complex name, aggregated class, aggregated id) of all complexes of all links.
+        Complexes without associated features of a link come with a null aggregated id.
+        linkList: list of (complex_schema, complex, aggregated_schema, aggregated_class, column_name)
+        """
+        selectList = []
+        for complex_schema, complex, aggregated_schema, aggregated_class, column_name in linkList:
+            selectList.append("""SELECT c.id AS complex_uuid, c.nome AS name, '{3}' AS aggregated_class, a.id::text AS aggregated_id FROM {0}.{1} AS c LEFT JOIN ONLY {2}.{3} AS a ON a.{4} = c.id""".format(complex_schema, complex, aggregated_schema, aggregated_class, column_name))
+        sql = ' UNION ALL '.join(selectList)
+        return sql
+
     def getLinkColumn(self, complexClass, aggregatedClass):
         sql = "SELECT column_name from complex_schema where complex = \'"+complexClass+'\''+" and aggregated_class = "+'\''+aggregatedClass+'\''
         return sql
@@ -108,6 +122,37 @@ class PostGISSqlGenerator(SqlGenerator):
             sql = '''SELECT count(*) FROM "{0}"."{1}" limit 1'''.format(schema,table)
         return sql
 
+    def getLayersElementCount(self, tableList, useInheritance, mode = 'exists'):
+        """
+        Builds a single query that gives (table_schema, table_name, count) for every (schema, table) in tableList.
+        mode 'exists' probes each table for one row (count is 1 or 0), 'exact' runs count(*) and 'estimate' reads
+        pg_class.reltuples (rows of child tables are added when useInheritance is True). Tables without an estimate
+        (never analyzed, reltuples 0 or -1) are counted with count(*).
+        """
+        only = '' if useInheritance else 'ONLY '
+        if mode == 'estimate':
+            children = ''
+            if useInheritance:
+                children = ' + coalesce((SELECT sum(greatest(ch.reltuples, 0)) FROM pg_inherits i JOIN pg_class ch ON ch.oid = i.inhrelid WHERE i.inhparent = c.oid), 0)'
+            selectList = []
+            for schema, table in tableList:
+                selectList.append("""SELECT e.table_schema, e.table_name, CASE WHEN e.estimate <= 0 THEN (SELECT count(*) FROM {0}"{1}"."{2}") ELSE e.estimate::bigint END AS count
+                FROM (SELECT n.nspname::text AS table_schema, c.relname::text AS table_name, greatest(c.reltuples, 0){3} AS estimate
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{4}' AND c.relname = '{5}') AS e""".format(only, schema, table, children, schema.replace("'", "''"), table.replace("'", "''")))
+            sql = ' UNION ALL '.join(selectList)
+            return sql
+        if mode == 'exact':
+            countSql = '''(SELECT count(*) FROM {0}"{1}"."{2}")'''
+        else:
+            countSql = '''(EXISTS (SELECT 1 FROM {0}"{1}"."{2}" LIMIT 1))::int'''
+        selectList = []
+        for schema, table in tableList:
+            count = countSql.format(only, schema, table)
+            selectList.append("""SELECT '{0}'::text AS table_schema, '{1}'::text AS table_name, {2}::bigint AS count""".format(schema.replace("'", "''"), table.replace("'", "''"), count))
+        sql = ' UNION ALL '.join(selectList)
+        return sql
+
     def getElementCountFromLayerWithInh(self, layer):
         sql = "SELECT count(*) FROM "+layer
         return sql
@@ -373,6 +418,10 @@ class PostGISSqlGenerator(SqlGenerator):
             log text NOT NULL,
             status int NOT NULL,
             finished timestamp NOT NULL default now(),
+            features_scanned bigint,
+            flags_raised bigint,
+            elapsed_time double precision,
+            layer_metrics text,
             CONSTRAINT process_history_pk PRIMARY KEY (id),
             CONSTRAINT process_history_status_fk FOREIGN KEY (status) REFERENCES validation.status (id) MATCH FULL ON UPDATE NO ACTION ON DELETE NO ACTION
         
@@ -415,9 +464,82 @@ class PostGISSqlGenerator(SqlGenerator):
             REFERENCES dominios.node_type (code) MATCH FULL
             ON UPDATE NO ACTION ON DELETE NO ACTION#
         INSERT INTO validation.settings(earthcoverage) VALUES (NULL)#
-        INSERT INTO validation.status(id,status) VALUES (0,'Not yet ran'), (1,'Finished'), (2,'Failed'), (3,'Running'), (4,'Finished with flags')   
+        INSERT INTO validation.status(id,status) VALUES (0,'Not yet ran'), (1,'Finished'), (2,'Failed'), (3,'Running'), (4,'Finished with flags')#
         """ % (srid, srid, srid, srid)
+        return sql + self.createFlagIndexes()
+
+    def checkProcessMetricsColumns(self):
+        sql = "select count(*) from information_schema.columns where table_schema = 'validation' and table_name = 'process_history' and column_name = 'layer_metrics'"
+        return sql
+
+    def createProcessMetricsColumns(self):
+        """
+        Migration of process_history tables created without the per-run metrics
+        """
+        sql = """ALTER TABLE validation.process_history ADD COLUMN features_scanned bigint#
+        ALTER TABLE validation.process_history ADD COLUMN flags_raised bigint#
+        ALTER TABLE validation.process_history ADD COLUMN elapsed_time double precision#
+        ALTER TABLE validation.process_history ADD COLUMN layer_metrics text"""
         return sql
+
+    def checkFlagIndexes(self):
+        sql = "select count(*) from pg_indexes where schemaname = 'validation' and indexname = 'aux_flags_validacao_p_process_idx'"
+        return sql
+
+    def createFlagIndexes(self):
+        """
+        B-tree indexes on (process_name, layer, feat_id), used by flag deletion and filtering,
+        and GiST indexes on the geometry of the flag tables, used by the flag layers.
+        It is also the migration of flag tables created without indexes.
+        """
+        sqlList = ["""CREATE INDEX aux_flags_validacao_process_idx ON validation.aux_flags_validacao (process_name, layer, feat_id)"""]
+        for tableName in ['aux_flags_validacao_p', 'aux_flags_validacao_l', 'aux_flags_validacao_a']:
+            sqlList.append("""CREATE INDEX {0}_process_idx ON validation.{0} (process_name, layer, feat_id)""".format(tableName))
+            sqlList.append("""CREATE INDEX {0}_geom_gist ON validation.{0} USING gist (geom)""".format(tableName))
+            sqlList.append("""ANALYZE validation.{0}""".format(tableName))
+        return '#'.join(sqlList)
+
+    def getFlagPartitionName(self, tableName, processName):
+        """
+        Gets the name of the partition of a flag table that holds the flags of processName.
+        The name is kept short enough for the names of its constraints and indexes.
+        """
+        suffix = re.sub('[^a-z0-9_]', '_', processName.lower())[:18]
+        return '{0}_{1}_{2}'.format(tableName, suffix, hashlib.md5(processName.encode('utf-8')).hexdigest()[:7])
+
+    def createFlagPartitions(self, processName):
+        """
+        Creates, if needed, the partitions of aux_flags_validacao_p/_l/_a that hold the flags of processName.
+        Partitions inherit their flag table, so everything that reads the flag tables also reads them.
+        """
+        sqlList = []
+        for tableName in ['aux_flags_validacao_p', 'aux_flags_validacao_l', 'aux_flags_validacao_a']:
+            partitionName = self.getFlagPartitionName(tableName, processName)
+            sqlList.append("""DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'validation' AND tablename = '{0}') THEN
+                    CREATE TABLE validation.{0} (
+                        CONSTRAINT {0}_pk PRIMARY KEY (id),
+                        CONSTRAINT {0}_process_check CHECK (process_name = '{2}')
+                    ) INHERITS (validation.{1});
+                    CREATE INDEX {0}_layer_idx ON validation.{0} (layer, feat_id);
+                    CREATE INDEX {0}_geom_gist ON validation.{0} USING gist (geom);
+                END IF;
+            END
+            $$""".format(partitionName, tableName, processName.replace("'", "''")))
+        return '#'.join(sqlList)
+
+    def truncateFlagPartitions(self, processName):
+        """
+        Deletes all flags of processName when partitioning is used: the partitions of the process are truncated
+        and the flags stored before partitioning are deleted from the flag tables themselves.
+        The partitions must exist (see createFlagPartitions).
+        """
+        sqlList = []
+        for tableName in ['aux_flags_validacao_p', 'aux_flags_validacao_l', 'aux_flags_validacao_a']:
+            sqlList.append("""TRUNCATE validation.{0}""".format(self.getFlagPartitionName(tableName, processName)))
+            sqlList.append("""DELETE FROM ONLY validation.{0} WHERE process_name = '{1}'""".format(tableName, processName.replace("'", "''")))
+        return '#'.join(sqlList)
     
     def validationStatus(self, processName):
         sql = "SELECT status FROM validation.process_history where process_name = '%s' ORDER BY finished DESC LIMIT 1; " % processName
@@ -427,21 +549,56 @@ class PostGISSqlGenerator(SqlGenerator):
         sql = "SELECT sta.status FROM validation.process_history as hist left join validation.status as sta on sta.id = hist.status where hist.process_name = '%s' ORDER BY hist.finished DESC LIMIT 1 " % processName
         return sql
     
-    def setValidationStatusQuery(self, processName,log,status):
-        sql = "INSERT INTO validation.process_history (process_name, log, status) values ('%s','%s',%s)" % (processName,log,status)
+    def setValidationStatusQuery(self, processName,log,status, metrics = None):
+        if not metrics:
+            sql = "INSERT INTO validation.process_history (process_name, log, status) values ('%s','%s',%s)" % (processName,log,status)
+            return sql
+        sql = u"""INSERT INTO validation.process_history (process_name, log, status, features_scanned, flags_raised, elapsed_time, layer_metrics) 
+        values ('{0}','{1}',{2},{3},{4},{5},'{6}')""".format(processName, log, status, metrics['featuresScanned'], metrics['flagsRaised'], metrics['elapsedTime'], metrics['layerMetrics'].replace("'", "''"))
         return sql
-    
-    def insertFlagIntoDb(self, layer, feat_id, reason, geom, srid, processName, dimension, geometryColumn, flagSRID):
-        if dimension == 0:
-            tableName = 'aux_flags_validacao_p'
-        elif dimension == 1:
-            tableName = 'aux_flags_validacao_l'
-        elif dimension == 2:
-            tableName = 'aux_flags_validacao_a'
-        sql = u"""INSERT INTO validation.{0} (process_name, layer, feat_id, reason, geom, dimension, geometry_column) values 
-        ('{1}','{2}',{3},'{4}',ST_Transform(ST_SetSRID(ST_Multi('{5}'),{6}),{7}), {8}, '{9}');""".format(tableName, processName, layer, str(feat_id), reason, geom, srid, flagSRID, dimension, geometryColumn)
+
+    def getProcessRunMetrics(self, processName):
+        sql = """SELECT finished, features_scanned, flags_raised, elapsed_time, layer_metrics FROM validation.process_history 
+        WHERE process_name = '{0}' AND elapsed_time IS NOT NULL ORDER BY finished""".format(processName)
         return sql
     
+    def insertFlagsFromSource(self, source, processName, flagSRID, partitioned = False):
+        """
+        Inserts the flags selected by source into the flag table of each dimension in a single statement.
+        source must return the columns (layer, feat_id, reason, geom, srid, geometry_column)
+        partitioned: flags are inserted into the partitions of processName (see createFlagPartitions)
+        """
+        insertList = []
+        for dimension, tableName in enumerate(['aux_flags_validacao_p', 'aux_flags_validacao_l', 'aux_flags_validacao_a']):
+            if partitioned:
+                tableName = self.getFlagPartitionName(tableName, processName)
+            insertList.append(u"""INSERT INTO validation.{0} (process_name, layer, feat_id, reason, geom, dimension, geometry_column)
+            SELECT '{1}', layer, feat_id, reason, ST_Transform(ST_SetSRID(ST_Multi(geom),srid),{2}), {3}, geometry_column FROM flags WHERE ST_Dimension(geom) = {3}""".format(tableName, processName, flagSRID, dimension))
+        sql = u"""WITH flags AS ({0}), 
+        points AS ({1}), 
+        lines AS ({2}) 
+        {3};""".format(source, insertList[0], insertList[1], insertList[2])
+        return sql
+
+    def insertFlagsIntoDb(self, flagValueList, processName, flagSRID, partitioned = False):
+        """
+        Inserts flags with a multi-row INSERT, routing each flag to the flag table of its dimension.
+        flagValueList: list of tuples (layer, feat_id, reason, geom, srid, geometryColumn)
+        """
+        valueList = []
+        for layer, feat_id, reason, geom, srid, geometryColumn in flagValueList:
+            valueList.append(u"""('{0}',{1},'{2}','{3}'::geometry,{4},'{5}')""".format(unicode(layer).replace("'", "''"), str(feat_id), unicode(reason).replace("'", "''"), geom, srid, geometryColumn))
+        source = u"""SELECT * FROM (VALUES {0}) AS v(layer, feat_id, reason, geom, srid, geometry_column)""".format(','.join(valueList))
+        return self.insertFlagsFromSource(source, processName, flagSRID, partitioned)
+
+    def createFlagStagingTable(self, tableName):
+        sql = """CREATE TEMP TABLE {0} (layer text, feat_id bigint, reason text, geom text, srid integer, geometry_column text) ON COMMIT DROP""".format(tableName)
+        return sql
+
+    def insertFlagsFromStagingTable(self, tableName, processName, flagSRID, partitioned = False):
+        source = """SELECT layer, feat_id, reason, geom::geometry AS geom, srid, geometry_column FROM pg_temp.{0}""".format(tableName)
+        return self.insertFlagsFromSource(source, processName, flagSRID, partitioned)
+
     def getRunningProc(self):
         sql = "SELECT process_name, status FROM validation.process_history ORDER BY finished DESC LIMIT 1;"
         return sql
@@ -467,21 +624,19 @@ class PostGISSqlGenerator(SqlGenerator):
                     clauseList.append(flagClause)
             whereClause = """where {0}""".format(' AND '.join(clauseList))
         sql = """
-        DELETE FROM validation.aux_flags_validacao_p 
-        WHERE id in 
-        (SELECT id FROM validation.aux_flags_validacao_p {0})#
-        
-        DELETE FROM validation.aux_flags_validacao_l 
-        WHERE id in 
-        (SELECT id FROM validation.aux_flags_validacao_l {0})#
-
-        DELETE FROM validation.aux_flags_validacao_a 
-        WHERE id in 
-        (SELECT id FROM validation.aux_flags_validacao_a {0})
+        DELETE FROM validation.aux_flags_validacao_p {0}#
+        DELETE FROM validation.aux_flags_validacao_l {0}#
+        DELETE FROM validation.aux_flags_validacao_a {0}
         """.format(whereClause)
         return sql
     
     def testSpatialRule(self, class_a, necessity, predicate_function, class_b, min_card, max_card, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn):
+        """
+        Gets (id, geom) of the features of class_a that break the rule.
+        Features of class_b are only visited through correlated subqueries with a bounding box prefilter,
+        so the GiST index of class_b is used. Counts are cut as soon as the rule is known to be broken.
+        A rule that requires features of class_b is not checked when class_b has no (other) feature.
+        """
         #TODO: Add SRIDS
         class_a = '"'+'"."'.join(class_a.replace('"','').split('.'))+'"'
         class_b = '"'+'"."'.join(class_b.replace('"','').split('.'))+'"'
@@ -490,57 +645,50 @@ class PostGISSqlGenerator(SqlGenerator):
         if class_a!=class_b:
             sameClassRestriction=''
         else:
-            sameClassRestriction=' WHERE a.{0} <> b.{1} '.format(aKeyColumn, bKeyColumn)
-                    
+            sameClassRestriction=' AND a.{0} <> b.{1} '.format(aKeyColumn, bKeyColumn)
+        # class_b has features to be compared with a
+        candidatesExist = """EXISTS (SELECT 1 FROM {0} AS b WHERE TRUE {1})""".format(class_b, sameClassRestriction)
+        # b features that intersect a, using the index of b
+        intersecting = """SELECT 1 FROM {0} AS b WHERE a.{1} && b.{2} AND ST_Intersects(a.{1}, b.{2}) {3}""".format(class_b, aGeomColumn, bGeomColumn, sameClassRestriction)
+        # b features that satisfy the predicate with a, using the index of b (every predicate but ST_Disjoint implies a && b)
+        satisfying = """SELECT 1 FROM {0} AS b WHERE a.{2} && b.{3} AND {1}(a.{2}, b.{3}) {4}""".format(class_b, predicate_function, aGeomColumn, bGeomColumn, sameClassRestriction)
+
         if predicate_function == 'ST_Disjoint':
             if necessity == '\'f\'':
-                sql = """SELECT DISTINCT foo.id, foo.geom FROM
-                (SELECT a.{4} id, SUM(CASE WHEN {0}(a.{6},b.{7}) = 'f' THEN 1 ELSE 0 END) count, a.{6} geom 
-                    FROM {1} as a,{2} as b {3} GROUP BY a.{4}, a.{6}) as foo
-                WHERE foo.count > 0
-                """.format(predicate_function, class_a, class_b, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn)                
+                # must be disjoint: a intersects some b
+                sql = """SELECT a.{0} AS id, a.{1} AS geom FROM {2} AS a
+                WHERE EXISTS ({3})
+                """.format(aKeyColumn, aGeomColumn, class_a, intersecting)
             elif necessity == '\'t\'':
-                sql = """SELECT DISTINCT foo.id, foo.geom FROM
-                (SELECT a.{4} id, SUM(CASE WHEN {0}(a.{6},b.{7}) = 'f' THEN 1 ELSE 0 END) count, a.{6} geom 
-                    FROM {1} as a,{2} as b {3} GROUP BY a.{4}, a.{6}) as foo
-                WHERE foo.count = 0
-                """.format(predicate_function, class_a, class_b, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn)
+                # must not be disjoint: a intersects no b
+                sql = """SELECT a.{0} AS id, a.{1} AS geom FROM {2} AS a
+                WHERE NOT EXISTS ({3}) AND {4}
+                """.format(aKeyColumn, aGeomColumn, class_a, intersecting, candidatesExist)
         else:
             if necessity == '\'f\'':# must (be)
-                if max_card == '*':
-                    sql = """SELECT DISTINCT foo.id, foo.geom FROM
-                    (SELECT a.{4} id, SUM(CASE WHEN {0}(a.{6},b.{7}) THEN 1 ELSE 0 END) count, a.{6} geom 
-                        FROM {1} as a,{2} as b {3} GROUP BY a.{4}, a.{6}) as foo
-                    WHERE foo.count < {8}
-                    """.format(predicate_function, class_a, class_b, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn, min_card)
-                elif min_card is None and max_card is None:
-                    sql = """SELECT DISTINCT foo.id, foo.geom FROM
-                    (SELECT a.{4} id, SUM(CASE WHEN {0}(a.{6},b.{7}) THEN 1 ELSE 0 END) count, a.{6} geom 
-                        FROM {1} as a,{2} as b {3} GROUP BY a.{4}, a.{6}) as foo
-                    WHERE foo.count != 0;
-                    """.format(predicate_function, class_a, class_b, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn, min_card)
+                if min_card is None and max_card is None:
+                    sql = """SELECT a.{0} AS id, a.{1} AS geom FROM {2} AS a
+                    WHERE EXISTS ({3})
+                    """.format(aKeyColumn, aGeomColumn, class_a, satisfying)
                 else:
-                    sql = """SELECT DISTINCT foo.id, foo.geom FROM
-                    (SELECT a.{4} id, SUM(CASE WHEN {0}(a.{6},b.{7}) THEN 1 ELSE 0 END) count, a.{6} geom 
-                        FROM {1} as a,{2} as b {3} GROUP BY a.{4}, a.{6}) as foo
-                    WHERE foo.count < {8} OR foo.count > {9}
-                    """.format(predicate_function, class_a, class_b, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn, min_card, max_card)
+                    # counting only up to the first value that breaks the cardinality
+                    if max_card == '*':
+                        limit = int(min_card)
+                        cardinalityClause = 'c.count < {0}'.format(min_card)
+                    else:
+                        limit = int(max_card) + 1
+                        cardinalityClause = '(c.count < {0} OR c.count > {1})'.format(min_card, max_card)
+                    sql = """SELECT a.{0} AS id, a.{1} AS geom FROM {2} AS a
+                    LEFT JOIN LATERAL (SELECT count(*) AS count FROM ({3} LIMIT {4}) AS limited) AS c ON TRUE
+                    WHERE {5} AND {6}
+                    """.format(aKeyColumn, aGeomColumn, class_a, satisfying, limit, cardinalityClause, candidatesExist)
             elif necessity == '\'t\'':# must not (be)
-                if class_a!=class_b:
-                    sameClassRestriction=''
-                else:
-                    sameClassRestriction=' AND a.{0} <> b.{1} '.format(aKeyColumn, bKeyColumn)
-                    
                 sql = """SELECT DISTINCT a.{5} id, (ST_Dump(ST_Intersection(a.{7}, b.{8}))).geom as geom
-                FROM {0} as a, {1} as b 
+                FROM {0} as a JOIN {1} as b ON a.{7} && b.{8}
                     WHERE {2}(a.{7},b.{8}) = {3} {4}
                 """.format(class_a, class_b, predicate_function, necessity, sameClassRestriction, aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn)
         return sql
     
-    def getDimension(self, geom):
-        sql = "select ST_Dimension('%s')" % geom
-        return sql
-    
     def getMulti(self,cl):
         #TODO: get pk
         cl = '"'+'"."'.join(cl.replace('"','').split('.'))+'"'
@@ -668,6 +816,23 @@ class PostGISSqlGenerator(SqlGenerator):
     def getFlagsByProcess(self, processName):
         sql = """select layer, feat_id, geometry_column from validation.aux_flags_validacao where process_name = '%s'""" % processName
         return sql
+
+    def getFlagCountByProcess(self, processName):
+        sql = """select count(*) from validation.aux_flags_validacao where process_name = '{0}'""".format(processName)
+        return sql
+
+    def getFlagStatistics(self, processName = None, className = None):
+        """
+        Gets the number of flags grouped by process, layer and dimension
+        """
+        clauseList = []
+        if processName:
+            clauseList.append("""process_name = '{0}'""".format(processName))
+        if className:
+            clauseList.append("""layer = '{0}'""".format(className))
+        whereClause = 'where {0}'.format(' AND '.join(clauseList)) if clauseList else ''
+        sql = """select process_name, layer, dimension, count(*) from validation.aux_flags_validacao {0} group by process_name, layer, dimension""".format(whereClause)
+        return sql
     
     def forceValidity(self, tableSchema, tableName, idList, srid, keyColumn, geometryColumn):
         sql = """update "{0}"."{1}" set "{5}" = ST_Multi(result."{5}") from (
@@ -904,13 +1069,24 @@ class PostGISSqlGenerator(SqlGenerator):
         sql = '''DROP TABLE IF EXISTS {0}'''.format(tableName)
         return sql
     
-    def populateTempTable(self, tableName, attributes, prepareValues):
-        tableName = '"'+'"."'.join(tableName.split('.'))
+    def createCopyStagingTable(self, stagingTable, tableName, attributes, geomColumnName):
+        tableName = '"'+'"."'.join(tableName.replace('"','').split('.'))+'"'
         columnTupleString = '"'+'","'.join(map(str,attributes))+'"'
-        valueTuppleString = ','.join(map(str,prepareValues))
-        sql = """INSERT INTO {0}_temp"({1}) VALUES ({2})""".format(tableName, columnTupleString, valueTuppleString)
+        sql = """CREATE TEMP TABLE {0} ON COMMIT DROP AS SELECT {1} FROM {2} WHERE 1=2;
+        ALTER TABLE {0} ADD COLUMN "{3}" text""".format(stagingTable, columnTupleString, tableName, geomColumnName)
         return sql
-    
+
+    def insertFromCopyStagingTable(self, stagingTable, tableName, attributes, geomColumnName, srid):
+        tableName = '"'+'"."'.join(tableName.replace('"','').split('.'))+'"'
+        columnTupleString = '"'+'","'.join(map(str,attributes))+'"'
+        sql = """INSERT INTO {0} ({1},"{2}") SELECT {1}, ST_SetSRID(ST_Multi("{2}"::geometry),{3}) FROM pg_temp.{4}""".format(tableName, columnTupleString, geomColumnName, srid, stagingTable)
+        return sql
+
+    def analyzeTable(self, tableName):
+        tableName = '"'+'"."'.join(tableName.replace('"','').split('.'))+'"'
+        sql = """ANALYZE {0}""".format(tableName)
+        return sql
+
     def createSpatialIndex(self, tableName, geomColumnName='geom'):
         tableName = '"'+'"."'.join(tableName.replace('"','').split('.'))
         sql = 'create index "{0}_temp_gist" on {1}_temp" using gist ({2})'.format(tableName.split('.')[-1].replace('"',''), tableName, geomColumnName)
@@ -1069,6 +1245,11 @@ class PostGISSqlGenerator(SqlGenerator):
         sql = """select row_to_json(a) from (select * from {0}) as a""".format(domainTable)
         return sql
 
+    def getDomainCodeDictList(self, domainTableList):
+        selectList = ["""select {0} as idx, row_to_json(a)::text from (select * from {1}) as a""".format(idx, domainTable) for idx, domainTable in enumerate(domainTableList)]
+        sql = ' UNION ALL '.join(selectList)
+        return sql
+
     def getGeomStructDict(self):
         sql = """select row_to_json(a) from (
                     select table_name, array_agg(row_to_json(row(column_name::text, is_nullable))) from information_schema.columns where 
@@ -1503,6 +1684,39 @@ class PostGISSqlGenerator(SqlGenerator):
         sql = '''select edgvversion from public.{0} where name = '{1}' '''.format(tableName, settingName)
         return sql
     
+    def getPrimaryKeyDict(self):
+        sql = '''
+        SELECT n.nspname, c.relname, a.attname
+        FROM   pg_index i
+        JOIN   pg_class c ON c.oid = i.indrelid
+        JOIN   pg_namespace n ON n.oid = c.relnamespace
+        JOIN   pg_attribute a ON a.attrelid = i.indrelid
+                             AND a.attnum = ANY(i.indkey)
+        WHERE  i.indisprimary
+        AND    n.nspname NOT IN ('pg_catalog', 'information_schema');
+        '''
+        return sql
+
+    def getSchemaFingerprint(self):
+        # temporary and unlogged tables (other sessions' pg_temp_N schemas) and the *_temp tables
+        # staged by the validation processes are left out, so they do not invalidate the metadata cache
+        sql = '''
+        SELECT (SELECT oid FROM pg_database WHERE datname = current_database()), md5(
+            coalesce((SELECT string_agg(a.attrelid::text || ':' || a.attnum || ':' || a.attname || ':' || a.atttypid || ':' || a.attnotnull, ',' ORDER BY a.attrelid, a.attnum)
+                FROM pg_attribute a JOIN pg_class c ON c.oid = a.attrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE a.attnum > 0 AND NOT a.attisdropped AND c.relkind IN ('r', 'v', 'm', 'f') AND c.relpersistence = 'p'
+                AND c.relname NOT LIKE '%\\_temp'
+                AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg\\_toast%' AND n.nspname NOT LIKE 'pg\\_temp%'), '') ||
+            coalesce((SELECT string_agg(co.oid::text || ':' || pg_get_constraintdef(co.oid), ',' ORDER BY co.oid)
+                FROM pg_constraint co JOIN pg_namespace n ON n.oid = co.connamespace LEFT JOIN pg_class c ON c.oid = co.conrelid
+                WHERE n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg\\_temp%'
+                AND (c.oid IS NULL OR (c.relpersistence = 'p' AND c.relname NOT LIKE '%\\_temp'))), '') ||
+            coalesce((SELECT string_agg(s.relid::text || ':' || (s.n_tup_ins + s.n_tup_upd + s.n_tup_del), ',' ORDER BY s.relid)
+                FROM pg_stat_user_tables s WHERE s.schemaname = 'dominios'), '')
+        );
+        '''
+        return sql
+
     def getPrimaryKeyColumn(self, tableName):
         if '.' in tableName:
             tableSchema, tableName = tableName.replace("'","").replace('"','').split('.')
@@ -1572,27 +1786,6 @@ class PostGISSqlGenerator(SqlGenerator):
         """.format(srid)
         return sql
 
-    def checkCoverageForGapsWithFrame(self, frameTable, geomColumn):
-        frameSchema, frameTable = frameTable.split('.')
-        sql = """
-        select (ST_Dump(ST_SymDifference(a.geom, b.geom))).geom from
-        (select ST_Union({0}) as geom from "{1}"."{2}") as a,
-        (select ST_Union(geom) as geom from validation.coverage_temp) as b
-        """.format(geomColumn, frameSchema, frameTable)
-        return sql
-
-    def checkCoverageForOverlaps(self, table='validation.coverage_temp', geomColumn='geom', keyColumn='id'):
-        tableSchema, tableName = table.split('.')
-        sql = """
-        select (ST_Dump(foo.geom)).geom as geom from (
-        select (ST_GeoTableSummary('{0}', '{1}', '{2}', '{3}', 10, 'S3')).geom
-        UNION
-        select (ST_GeoTableSummary('{0}', '{1}', '{2}', '{3}', 10, 'S2')).geom
-        ) as foo 
-        where ST_IsEmpty(foo.geom) = 'f'
-        """.format(tableSchema, tableName, geomColumn, keyColumn)
-        return sql
-
     def getProcessOrClassFlags(self, filterType, filteringProcess=None):
         """
         Returns all process or classes that raised flags.
@@ -1600,6 +1793,18 @@ class PostGISSqlGenerator(SqlGenerator):
         have the process filter ignored.
         """
         sql = ""
+        if filterType == "process" and not filteringProcess:
+            # skip scan over the process_name index, instead of reading every flag
+            sql = """
+        WITH RECURSIVE processes AS (
+            (SELECT process_name FROM validation.aux_flags_validacao ORDER BY process_name LIMIT 1)
+            UNION ALL
+            SELECT (SELECT f.process_name FROM validation.aux_flags_validacao AS f WHERE f.process_name > p.process_name ORDER BY f.process_name LIMIT 1)
+            FROM processes AS p WHERE p.process_name IS NOT NULL
+        )
+        SELECT process_name FROM processes WHERE process_name IS NOT NULL
+            """
+            return sql
         if filterType == "process":          
             sql = """
         SELECT DISTINCT process_name 
@@ -1655,14 +1860,80 @@ class PostGISSqlGenerator(SqlGenerator):
                 whereClause = " WHERE layer = '{0}'".format(className)
         return "{0}{1};".format(sql, whereClause)
     
-    def checkCoverageForGaps(self, table='validation.coverage_temp', geomColumn='geom', keyColumn='id'):
-        tableSchema, tableName = table.split('.')
-        sql = """
-        select (ST_Dump(foo.geom)).geom as geom from (
-        select (ST_GeoTableSummary('{0}', '{1}', '{2}', '{3}', 10, 'S4')).geom
-        ) as foo 
-        where ST_IsEmpty(foo.geom) = 'f'
-        """.format(tableSchema, tableName, geomColumn, keyColumn)
+    def checkCoverage(self, table='validation.coverage_temp', geomColumn='geom', keyColumn='id', frameTable=None, frameGeomColumn='geom', checkGaps=True, checkOverlaps=True, featuresPerTile=2000):
+        """
+        Checks gaps and overlaps of a coverage in a single query. It returns rows (kind, geom), kind being
+        'overlap', 'gap' (between features of the coverage) or 'frame' (between the frame and the coverage).
+        Overlaps come from a self join that uses the spatial index of the table.
+        Gaps are computed per tile, subtracting the union of the features of the tile from the tile:
+        tiles are the cells of a grid sized to hold about featuresPerTile features each, clipped by the
+        frame when frameTable is given. The gaps of all tiles are merged at the end. Without a frame, the gap
+        that reaches the border of the grid is the outside of the coverage and is discarded.
+        """
+        tableSchema, tableName = table.replace('"','').split('.')
+        table = '"{0}"."{1}"'.format(tableSchema, tableName)
+        if frameTable:
+            frameSchema, frameTable = frameTable.replace('"','').split('.')
+            frameTable = '"{0}"."{1}"'.format(frameSchema, frameTable)
+            extentSource = """SELECT "{0}" AS geom FROM {1} UNION ALL SELECT "{2}" AS geom FROM {3}""".format(geomColumn, table, frameGeomColumn, frameTable)
+        else:
+            extentSource = """SELECT "{0}" AS geom FROM {1}""".format(geomColumn, table)
+        cteList = ["""bounds AS (
+            SELECT ST_Extent(source.geom)::geometry AS box, min(ST_SRID(source.geom)) AS srid,
+                greatest(1, ceil(sqrt((SELECT count(*) FROM {1}) / {2}::float)))::int AS n
+            FROM ({0}) AS source
+        )""".format(extentSource, table, featuresPerTile),
+        """grid AS (
+            SELECT ST_XMin(box) - m AS xmin, ST_YMin(box) - m AS ymin, (ST_XMax(box) - ST_XMin(box) + 2 * m) / n AS dx, (ST_YMax(box) - ST_YMin(box) + 2 * m) / n AS dy, n, srid
+            FROM (SELECT box, srid, n, greatest(ST_XMax(box) - ST_XMin(box), ST_YMax(box) - ST_YMin(box), 0.000001) * 0.01 AS m FROM bounds WHERE box IS NOT NULL) AS b
+        )""",
+        """cells AS (
+            SELECT ST_MakeEnvelope(xmin + i * dx, ymin + j * dy, xmin + (i + 1) * dx, ymin + (j + 1) * dy, srid) AS geom
+            FROM grid, generate_series(0, n - 1) AS i, generate_series(0, n - 1) AS j
+        )"""]
+        if frameTable:
+            cteList.append("""frame AS (
+            SELECT ST_Union("{0}") AS geom FROM {1}
+        )""".format(frameGeomColumn, frameTable))
+            cteList.append("""tiles AS (
+            SELECT row_number() OVER () AS tile_id, 
+                CASE WHEN ST_CoveredBy(c.geom, f.geom) THEN c.geom ELSE ST_CollectionExtract(ST_Intersection(c.geom, f.geom), 3) END AS geom
+            FROM cells AS c, frame AS f WHERE c.geom && f.geom AND ST_Intersects(c.geom, f.geom)
+        )""")
+        else:
+            cteList.append("""tiles AS (
+            SELECT row_number() OVER () AS tile_id, geom FROM cells
+        )""")
+        cteList.append("""tile_unions AS (
+            SELECT t.tile_id, ST_Union(c."{0}") AS geom
+            FROM tiles AS t JOIN {1} AS c ON c."{0}" && t.geom AND ST_Intersects(c."{0}", t.geom)
+            GROUP BY t.tile_id
+        )""".format(geomColumn, table))
+        cteList.append("""gaps AS (
+            SELECT (ST_Dump(ST_Union(tile_gaps.geom))).geom AS geom FROM (
+                SELECT CASE WHEN u.geom IS NULL THEN t.geom ELSE ST_CollectionExtract(ST_Difference(t.geom, u.geom), 3) END AS geom
+                FROM tiles AS t LEFT JOIN tile_unions AS u ON u.tile_id = t.tile_id
+            ) AS tile_gaps WHERE NOT ST_IsEmpty(tile_gaps.geom)
+        )""")
+        cteList.append("""overlaps AS (
+            SELECT (ST_Dump(ST_CollectionExtract(ST_Intersection(a."{0}", b."{0}"), 3))).geom AS geom
+            FROM {1} AS a JOIN {1} AS b ON a."{0}" && b."{0}" AND a."{2}" < b."{2}"
+            WHERE ST_Relate(a."{0}", b."{0}", '2********')
+        )""".format(geomColumn, table, keyColumn))
+        selectList = []
+        if checkOverlaps:
+            selectList.append("""SELECT 'overlap'::text AS kind, geom FROM overlaps WHERE NOT ST_IsEmpty(geom)""")
+        if checkGaps:
+            if frameTable:
+                selectList.append("""SELECT CASE WHEN ST_Intersects(g.geom, ST_Boundary(f.geom)) THEN 'frame'::text ELSE 'gap'::text END AS kind, g.geom FROM gaps AS g, frame AS f""")
+                # parts of the coverage out of the frame
+                selectList.append("""SELECT 'frame'::text AS kind, (ST_Dump(ST_CollectionExtract(ST_Difference(c."{0}", f.geom), 3))).geom AS geom
+            FROM {1} AS c, frame AS f WHERE NOT ST_CoveredBy(c."{0}", f.geom)""".format(geomColumn, table))
+            else:
+                selectList.append("""SELECT 'gap'::text AS kind, g.geom FROM gaps AS g, grid
+            WHERE NOT ST_Intersects(g.geom, ST_Boundary(ST_MakeEnvelope(xmin, ymin, xmin + n * dx, ymin + n * dy, srid)))""")
+        sql = """WITH {0}
+        {1}""".format(',\n        '.join(cteList), '\n        UNION ALL\n        '.join(selectList))
         return sql
 
     def createValidationHistoryViewTableQuery(self, idListString=None):
@@ -43,6 +43,19 @@ class SpatialiteSqlGenerator(SqlGenerator):
             sql = "SELECT OGC_FID from "+aggregated_schema+"_"+aggregated_class+" where "+column_name+"="+'\''+complex_uuid+'\''
         return sql
 
+    def getAssociatedFeaturesFromLinks(self, linkList):
+        """
+        Gets (complex uuid, complex name, aggregated class, aggregated id) of all complexes of all links.
+        Complexes without associated features of a link come with a null aggregated id.
+        linkList: list of (complex_schema, complex, aggregated_schema, aggregated_class, column_name)
+        """
+        selectList = []
+        for complex_schema, complex, aggregated_schema, aggregated_class, column_name in linkList:
+            idColumn = 'id' if aggregated_schema == 'complexos' else 'OGC_FID'
+            selectList.append("""SELECT c.id AS complex_uuid, c.nome AS name, '{2}' AS aggregated_class, CAST(a.{3} AS TEXT) AS aggregated_id FROM {0} AS c LEFT JOIN {1} AS a ON a.{4} = c.id""".format(complex_schema+'_'+complex, aggregated_schema+'_'+aggregated_class, aggregated_class, idColumn, column_name))
+        sql = ' UNION ALL '.join(selectList)
+        return sql
+
     def getLinkColumn(self, complexClass, aggregatedClass):
         if self.isComplexClass(aggregatedClass):
             sql = 'SELECT column_name from public_complex_schema where complex = \''+complexClass+'\''+' and aggregated_class = '+'\''+aggregatedClass[10:]+'\''
@@ -200,6 +213,23 @@ class SpatialiteSqlGenerator(SqlGenerator):
         layer = '_'.join([schema, table])
         return self.getElementCountFromLayer(layer)
     
+    def getLayersElementCount(self, tableList, useInheritance, mode = 'exists'):
+        """
+        Builds a single query that gives (table_schema, table_name, count) for every (schema, table) in tableList.
+        mode 'exists' probes each table for one row (count is 1 or 0), 'exact' and 'estimate' run count(*),
+        since SpatiaLite keeps no row estimates.
+        """
+        if mode == 'exists':
+            countSql = '''EXISTS (SELECT 1 FROM "{0}" LIMIT 1)'''
+        else:
+            countSql = '''(SELECT count(*) FROM "{0}")'''
+        selectList = []
+        for schema, table in tableList:
+            count = countSql.format('_'.join([schema, table]))
+            selectList.append("""SELECT '{0}' AS table_schema, '{1}' AS table_name, {2} AS count""".format(schema.replace("'", "''"), table.replace("'", "''"), count))
+        sql = ' UNION ALL '.join(selectList)
+        return sql
+
     def getFullTablesName(self, name):
         sql = "SELECT f_table_name as name FROM geometry_columns WHERE f_table_name LIKE '%{0}%' ORDER BY name".format(name)
         return sql
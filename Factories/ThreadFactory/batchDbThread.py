@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-23
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from PyQt4.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+from DsgTools.Factories.DbFactory.dbFactory import DbFactory
+
+class BatchDbSignals(QObject):
+    # database name and error message (None on success)
+    dbProcessed = pyqtSignal(object, object)
+
+class BatchDbTask(QRunnable):
+    def __init__(self, connectionParameters, dbName, operation, connectionDb, stopped, signals):
+        """
+        Runs operation on a single database. The task opens its own connection inside the worker thread,
+        since QSqlDatabase connections cannot be shared between threads.
+        :param connectionParameters: (tuple) (host, port, user, password) of the server.
+        :param dbName: (str) database to be processed.
+        :param operation: (function) operation(abstractDb, dbName) run on the worker thread.
+        :param connectionDb: (str) database the worker connects to. If None, it connects to dbName.
+        :param stopped: (list) shared cancel flag ([False] while running).
+        :param signals: (BatchDbSignals) signals object living on the GUI thread.
+        """
+        super(BatchDbTask, self).__init__()
+        self.connectionParameters = connectionParameters
+        self.dbName = dbName
+        self.operation = operation
+        self.connectionDb = connectionDb if connectionDb else dbName
+        self.stopped = stopped
+        self.signals = signals
+
+    def run(self):
+        """
+        Connects, runs the operation and reports the result of this database
+        """
+        if self.stopped[0]:
+            self.signals.dbProcessed.emit(self.dbName, self.signals.tr('Operation canceled by user.').encode('utf-8'))
+            return
+        host, port, user, password = self.connectionParameters
+        abstractDb = None
+        errorMsg = None
+        try:
+            abstractDb = DbFactory().createDbFactory('QPSQL')
+            abstractDb.connectDatabaseWithParameters(host, port, self.connectionDb, user, password)
+            self.operation(abstractDb, self.dbName)
+        except Exception as e:
+            errorMsg = self.getErrorMessage(e)
+        finally:
+            if abstractDb:
+                abstractDb.db.close()
+        self.signals.dbProcessed.emit(self.dbName, errorMsg)
+
+    def getErrorMessage(self, e):
+        """
+        Formats the exception args as an utf-8 string, as expected by BatchDbManager.logInternalError
+        """
+        errors = []
+        for arg in e.args:
+            if isinstance(arg, unicode):
+                errors.append(arg.encode('utf-8'))
+            else:
+                errors.append(str(arg))
+        return ':'.join(errors)
+
+class BatchDbExecutor(QObject):
+    dbProcessed = pyqtSignal(object)
+    finished = pyqtSignal()
+
+    def __init__(self, connectionParameters, maxWorkers = 4, parent = None):
+        """
+        Runs an operation over a list of databases of a server on a pool of worker threads.
+        Results are aggregated as successList and exceptionDict ({dbName: error message}).
+        :param connectionParameters: (tuple) (host, port, user, password) of the server.
+        :param maxWorkers: (int) maximum number of databases processed at the same time.
+        """
+        super(BatchDbExecutor, self).__init__(parent)
+        self.connectionParameters = connectionParameters
+        self.threadPool = QThreadPool(self)
+        self.threadPool.setMaxThreadCount(max(1, maxWorkers))
+        self.signals = BatchDbSignals()
+        self.signals.dbProcessed.connect(self.registerResult)
+        self.stopped = [False]
+        self.successList = []
+        self.exceptionDict = dict()
+        self.pending = 0
+
+    def execute(self, dbNameList, operation, connectionDb = None):
+        """
+        Starts the operation on each database. finished is emitted when all of them were processed.
+        :param dbNameList: (list-of-str) databases to be processed.
+        :param operation: (function) operation(abstractDb, dbName), run on a worker thread.
+        :param connectionDb: (str) database used by the workers' connections. If None, each worker connects to the database it processes.
+        """
+        self.stopped[0] = False
+        self.successList = []
+        self.exceptionDict = dict()
+        self.pending = len(dbNameList)
+        if self.pending == 0:
+            self.finished.emit()
+            return
+        for dbName in dbNameList:
+            task = BatchDbTask(self.connectionParameters, dbName, operation, connectionDb, self.stopped, self.signals)
+            self.threadPool.start(task)
+
+    def isFinished(self):
+        return self.pending == 0
+
+    @pyqtSlot()
+    def cancel(self):
+        """
+        Databases that were not started yet are skipped. Running ones are finished.
+        """
+        self.stopped[0] = True
+
+    @pyqtSlot(object, object)
+    def registerResult(self, dbName, errorMsg):
+        """
+        Aggregates the result of a database (runs on the GUI thread)
+        """
+        if errorMsg is None:
+            self.successList.append(dbName)
+        else:
+            self.exceptionDict[dbName] = errorMsg
+        self.pending -= 1
+        self.dbProcessed.emit(dbName)
+        if self.pending == 0:
+            self.finished.emit()
@@ -24,6 +24,8 @@ import osgeo.gdal
 import osgeo.osr
 import numpy
 import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 # Import the PyQt and QGIS libraries
 from PyQt4.QtCore import *
@@ -31,9 +33,16 @@ from PyQt4.QtCore import *
 from qgis.core import QgsMessageLog
 
 import os, codecs
+from xml.sax.saxutils import escape
 
 from DsgTools.Factories.ThreadFactory.genericThread import GenericThread
 
+# pixels read at once while building band histograms (rounded to the native block height)
+PIXELS_PER_BLOCK = 4*1024*1024
+# widest value range of an exact integer histogram, wider ranges use GDAL's approximate histogram
+MAX_HISTOGRAM_SIZE = 2**24
+INTEGER_TYPES = (osgeo.gdal.GDT_Byte, osgeo.gdal.GDT_UInt16, osgeo.gdal.GDT_Int16, osgeo.gdal.GDT_UInt32, osgeo.gdal.GDT_Int32)
+
 class DpiMessages(QObject):
     def __init__(self, thread):
         super(DpiMessages, self).__init__()
@@ -68,7 +77,7 @@ class DpiThread(GenericThread):
 
         self.messenger = DpiMessages(self)
 
-    def setParameters(self, filesList, rasterType, minOutValue, maxOutValue, outDir, percent, epsg, stopped, bands = []):
+    def setParameters(self, filesList, rasterType, minOutValue, maxOutValue, outDir, percent, epsg, stopped, bands = [], workers = None):
         """
         Sets thread parameters
         filesList: files processed
@@ -80,6 +89,7 @@ class DpiThread(GenericThread):
         epsg: epsg code
         stopped: process stopped
         bands: bands used
+        workers: number of images processed at the same time (defaults to the number of cpus)
         """
         self.filesList = filesList
         self.rasterType = rasterType
@@ -90,6 +100,7 @@ class DpiThread(GenericThread):
         self.epsg = epsg
         self.stopped = stopped
         self.bands = bands
+        self.workers = workers
 
     def run(self):
         """
@@ -113,36 +124,134 @@ class DpiThread(GenericThread):
             imgIn = osgeo.gdal.Open(file)
             if not imgIn:
                 continue
-            steps += imgIn.RasterCount
+            # one step for each band histogram and one for the output file
+            steps += (len(self.bands) if self.bands else imgIn.RasterCount) + 1
             del imgIn
 
-        steps *= 6
-
         # Progress bar steps calculated
         self.signals.rangeCalculated.emit(steps, self.getId())
 
-        problemOcurred = False
-        for file in self.filesList:
-            ret = self.stretchImage(file, self.outDir, self.percent, self.epsg, self.bands)
-            if ret == 1:
-                pass
-            elif ret == 0:
-                problemOcurred = True
-            else:
-                return (-1, self.messenger.getUserCanceledFeedbackMessage())
+        #images are processed at the same time by a pool of threads (gdal releases the GIL while reading and warping)
+        workers = self.workers if self.workers else multiprocessing.cpu_count()
+        pool = ThreadPool(max(1, min(workers, len(filesList))))
+        retList = pool.map(self.processImage, filesList)
+        pool.close()
+        pool.join()
 
-        if problemOcurred:
+        if -1 in retList:
+            return (-1, self.messenger.getUserCanceledFeedbackMessage())
+        elif 0 in retList:
             return (0, self.messenger.getProblemFeedbackMessage())
         else:
             return (1, self.messenger.getSuccessFeedbackMessage())
 
+    def processImage(self, inFile):
+        """
+        Stretches a single image, logging any problem
+        inFile: image file
+        """
+        try:
+            return self.stretchImage(inFile, self.outDir, self.percent, self.epsg, self.bands)
+        except Exception as e:
+            QgsMessageLog.logMessage(self.messenger.getProblemMessage() + inFile + ': ' + ':'.join(map(unicode, e.args)), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
+            return 0
+
+    def getIntegerHistogram(self, band):
+        """
+        Builds the exact histogram of an integer band reading it block by block, in a single pass
+        band: gdal band
+        returns: (first value, histogram) or (None, None) if canceled or if the value range is too wide
+        """
+        sizeX, sizeY = band.XSize, band.YSize
+        blockY = max(1, band.GetBlockSize()[1])
+        lines = max(1, PIXELS_PER_BLOCK // max(1, sizeX) // blockY) * blockY
+        histMin, histogram = None, None
+        for row in range(0, sizeY, lines):
+            if self.stopped[0]:
+                return None, None
+            arr = band.ReadAsArray(0, row, sizeX, min(lines, sizeY - row)).ravel().astype(numpy.int64)
+            blockMin, blockMax = int(arr.min()), int(arr.max())
+            if histogram is None:
+                newMin, newMax = blockMin, blockMax
+            else:
+                newMin, newMax = min(histMin, blockMin), max(histMin + len(histogram) - 1, blockMax)
+            if newMax - newMin >= MAX_HISTOGRAM_SIZE:
+                return None, None
+            if histogram is None or (newMin, newMax) != (histMin, histMin + len(histogram) - 1):
+                #widening the histogram to the new value range
+                newHistogram = numpy.zeros(newMax - newMin + 1, dtype=numpy.int64)
+                if histogram is not None:
+                    newHistogram[histMin - newMin : histMin - newMin + len(histogram)] = histogram
+                histMin, histogram = newMin, newHistogram
+            histogram[blockMin - histMin : blockMax - histMin + 1] += numpy.bincount(arr - blockMin)
+        return histMin, histogram
+
+    def getCutValues(self, band, percent):
+        """
+        Gets the values that leave percent/2 % of the pixels below and above them.
+        Integer bands use an exact single pass histogram (giving the same values as sorting the band),
+        other bands use GDAL's approximate histogram.
+        band: gdal band
+        percent: percent of pixels that are saturated
+        returns: (minValue, maxValue) or None if canceled
+        """
+        values, histogram = None, None
+        if band.DataType in INTEGER_TYPES:
+            histMin, histogram = self.getIntegerHistogram(band)
+            if self.stopped[0]:
+                return None
+            if histogram is not None:
+                values = numpy.arange(histMin, histMin + len(histogram))
+        if histogram is None:
+            minValue, maxValue = band.ComputeRasterMinMax(1)
+            buckets = 65536
+            histogram = numpy.array(band.GetHistogram(minValue, maxValue, buckets, 1, 1), dtype=numpy.int64)
+            #lower bound of each bucket (GetHistogram buckets are (maxValue - minValue)/buckets wide)
+            values = minValue + numpy.arange(buckets) * (maxValue - minValue) / float(buckets)
+        cumulative = numpy.cumsum(histogram)
+        total = int(cumulative[-1])
+        if percent == 0:
+            bottomIndex, topIndex = 0, total - 1
+        else:
+            bottomIndex = int(percent/200.*total)
+            topIndex = min(total - 1, int(math.ceil((1.-percent/200.)*total)))
+        #value of the pixel at each position of the sorted band
+        minValue = float(values[numpy.searchsorted(cumulative, bottomIndex, 'right')])
+        maxValue = float(values[numpy.searchsorted(cumulative, topIndex, 'right')])
+        return minValue, maxValue
+
+    def createStretchedVRT(self, imgIn, bands, cutValuesList, rasterType):
+        """
+        Creates an in-memory VRT that applies the linear stretch on the fly (values out of the cut values are saturated)
+        imgIn: input gdal dataset
+        bands: band indexes (0 based)
+        cutValuesList: (minValue, maxValue) of each band
+        rasterType: output raster type
+        """
+        vrt = osgeo.gdal.GetDriverByName('VRT').Create('', imgIn.RasterXSize, imgIn.RasterYSize, 0, rasterType)
+        vrt.SetProjection(imgIn.GetProjection())
+        vrt.SetGeoTransform(imgIn.GetGeoTransform())
+        rect = '<SrcRect xOff="0" yOff="0" xSize="{0}" ySize="{1}"/><DstRect xOff="0" yOff="0" xSize="{0}" ySize="{1}"/>'.format(imgIn.RasterXSize, imgIn.RasterYSize)
+        for outBandNumber, (bandNumber, (minValue, maxValue)) in enumerate(zip(bands, cutValuesList), 1):
+            vrt.AddBand(rasterType)
+            if maxValue > minValue:
+                #the lookup table interpolates between its entries and saturates outside them
+                transform = '<LUT>{0!r}:{1!r},{2!r}:{3!r}</LUT>'.format(minValue, float(self.minOutValue), maxValue, float(self.maxOutValue))
+            else:
+                transform = '<ScaleOffset>{0!r}</ScaleOffset><ScaleRatio>0</ScaleRatio>'.format(float(self.minOutValue))
+            source = '<ComplexSource><SourceFilename relativeToVRT="0">{0}</SourceFilename><SourceBand>{1}</SourceBand>{2}{3}</ComplexSource>'.format(escape(imgIn.GetDescription()), bandNumber+1, rect, transform)
+            vrt.GetRasterBand(outBandNumber).SetMetadataItem('source_0', source, 'new_vrt_sources')
+        return vrt
+
     def stretchImage(self, inFile, outDir, percent, epsg, bands):
         """
         Method that applies a specific histogram stretching to a group of images.
         The method also performs a conversion changing the raster type.
+        Cut values come from a single pass histogram and the stretch is applied block by block while the
+        reprojected output is written, through a virtual raster (no temporary file is created).
         """
         #Getting the output raster type
-        (rasterType, minOutValue, maxOutValue) = (self.rasterType, self.minOutValue, self.maxOutValue)
+        rasterType = self.rasterType
 
         #Open image
         imgIn = osgeo.gdal.Open(inFile)
@@ -160,8 +269,6 @@ class DpiThread(GenericThread):
         outDriver = imgIn.GetDriver()
         createOptions = ['PHOTOMETRIC=RGB', 'ALPHA=NO']
 
-        #creating temp file for contrast stretch
-        outFileTmp = os.path.join(outDir, baseName+'_tmp'+extension)
         #creating output file for contrast stretch
         outFile = os.path.join(outDir, baseName+'_stretch'+extension)
 
@@ -169,68 +276,34 @@ class DpiThread(GenericThread):
         if bands == []:
             bands = range(0, imgIn.RasterCount)
 
-        #Creating a temp image, with the same input parameters, to store the converted input image to 8 bits
-        imgOut = outDriver.Create(outFileTmp, imgIn.RasterXSize, imgIn.RasterYSize, len(bands), rasterType, options=createOptions)
-        imgOut.SetProjection(imgIn.GetProjection())
-        imgOut.SetGeoTransform(imgIn.GetGeoTransform())
-
-        #Linear stretching
-        topPercent = 1.-percent/200.
-        bottomPercent = percent/200.
-        outBandNumber = 1
+        #Linear stretching parameters
+        cutValuesList = []
         for bandNumber in bands:
-            if not self.stopped[0]:
-                b1 = imgIn.GetRasterBand(bandNumber+1)
-                arr = b1.ReadAsArray()
-                # Updating progress
-                self.signals.stepProcessed.emit(self.getId())
-
-                #computing percentile
-                newArr = arr.flatten()
-                newArr.sort()
-                total = len(newArr)
-                if percent == 0:
-                    minValue = float(newArr[0])
-                    maxValue = float(newArr[total-1])
-                else:
-                    minValue = float(newArr[int(bottomPercent*total)])
-                    maxValue = float(newArr[int(math.ceil(topPercent*total))])
-                del newArr
-                # Updating progress
-                self.signals.stepProcessed.emit(self.getId())
-
-                #Transformation parameters
-                #Rouding the values out of bounds
-                numpy.putmask(arr, arr > maxValue, maxValue)
-                numpy.putmask(arr, arr < minValue, minValue)
-                # Updating progress
-                self.signals.stepProcessed.emit(self.getId())
-
-                #The maxOutValue and the minOutValue must be set according to the convertion that will be applied (e.g. 8 bits, 16 bits, 32 bits)
-                a = (maxOutValue-minOutValue)/(maxValue-minValue)
-                newArr = (arr-minValue)*a+minOutValue
-                # Updating progress
-                self.signals.stepProcessed.emit(self.getId())
-
-                outB = imgOut.GetRasterBand(outBandNumber)
-                outBandNumber += 1
-                outB.WriteArray(newArr)
-                outB.FlushCache()
-                # Updating progress
-                self.signals.stepProcessed.emit(self.getId())
-
-                QgsMessageLog.logMessage("Band " + str(bandNumber) + ": "+str(minValue)+" , "+str(maxValue), "DSG Tools Plugin", QgsMessageLog.INFO)
-            else:
+            if self.stopped[0]:
+                QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
+                return -1
+            cutValues = self.getCutValues(imgIn.GetRasterBand(bandNumber+1), percent)
+            if cutValues is None:
                 QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
                 return -1
+            cutValuesList.append(cutValues)
+            # Updating progress
+            self.signals.stepProcessed.emit(self.getId())
+            QgsMessageLog.logMessage("Band " + str(bandNumber) + ": "+str(cutValues[0])+" , "+str(cutValues[1]), "DSG Tools Plugin", QgsMessageLog.INFO)
+        stretchedVrt = self.createStretchedVRT(imgIn, bands, cutValuesList, rasterType)
 
         #creating final image for reprojection
         outRasterSRS = osgeo.osr.SpatialReference()
         outRasterSRS.ImportFromEPSG(epsg)
 
         #this code uses virtual raster to compute the parameters of the output image
-        vrt = osgeo.gdal.AutoCreateWarpedVRT(imgOut, None, outRasterSRS.ExportToWkt(), osgeo.gdal.GRA_NearestNeighbour,  0.0)
-        imgWGS = outDriver.CreateCopy(outFile, vrt, options = createOptions)
+        vrt = osgeo.gdal.AutoCreateWarpedVRT(stretchedVrt, None, outRasterSRS.ExportToWkt(), osgeo.gdal.GRA_NearestNeighbour,  0.0)
+        #returning 0 on the callback makes gdal abort the copy
+        imgWGS = outDriver.CreateCopy(outFile, vrt, options = createOptions, callback = lambda complete, message, data: 0 if self.stopped[0] else 1)
+        if self.stopped[0]:
+            imgWGS = None
+            QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
+            return -1
 
         #Checking if the output file was created with success
         if os.path.exists(outFile):
@@ -240,10 +313,8 @@ class DpiThread(GenericThread):
 
         #Deleting the objects
         imgWGS = None
-        imgOut = None
+        vrt = None
+        stretchedVrt = None
         imgIn = None
 
-        #Unlinking the temp file
-        osgeo.gdal.Unlink(outFileTmp)
-
         return 1
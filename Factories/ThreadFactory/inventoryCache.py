@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-26
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import sqlite3
+
+class InventoryCache(object):
+    """
+    Persistent (SQLite) record of the files already inspected by the inventory, keyed by path.
+    A record is only reused while the file keeps the same size and modification time.
+    Files that GDAL/OGR do not recognize are also recorded, so they are not opened again.
+    """
+    def __init__(self, cacheFile):
+        """
+        Constructor
+        :param cacheFile: (str) SQLite file used to store the records.
+        """
+        self.connection = sqlite3.connect(cacheFile)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS inventory (
+                                    path TEXT PRIMARY KEY,
+                                    size INTEGER,
+                                    mtime REAL,
+                                    source_type TEXT,
+                                    extent_wkt TEXT,
+                                    prj_wkt TEXT)""")
+        self.connection.commit()
+        self.recordDict = dict()
+
+    def loadFolder(self, parentFolder):
+        """
+        Loads the records of all files under parentFolder, so they can be read by getRecord from any thread
+        :param parentFolder: (unicode) folder path, using '/' as separator.
+        """
+        prefix = parentFolder.rstrip('/') + '/'
+        cursor = self.connection.execute("""SELECT path, size, mtime, source_type, extent_wkt, prj_wkt FROM inventory WHERE path >= ? AND path < ?""", (prefix, prefix + u'\uffff'))
+        # { path : (size, mtime, sourceType, extentWkt, prjWkt) }
+        self.recordDict = {row[0] : row[1:] for row in cursor}
+
+    def getRecord(self, path, size, mtime):
+        """
+        Gets the cached (sourceType, extentWkt, prjWkt) of a file loaded by loadFolder, or None if the file changed or was never inspected
+        """
+        record = self.recordDict.get(path)
+        if record is None or record[0] != size or record[1] != mtime:
+            return None
+        return record[2:]
+
+    def update(self, recordList):
+        """
+        Stores records
+        :param recordList: (list-of-tuple) (path, size, mtime, sourceType, extentWkt, prjWkt)
+        """
+        if len(recordList) == 0:
+            return
+        self.connection.executemany("""INSERT OR REPLACE INTO inventory (path, size, mtime, source_type, extent_wkt, prj_wkt) VALUES (?, ?, ?, ?, ?, ?)""", recordList)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -21,9 +21,11 @@
  ***************************************************************************/
 """
 import os
+import stat
 import time
 import csv
 import shutil
+from multiprocessing.pool import ThreadPool
 from osgeo import gdal, ogr
 
 # Import the PyQt and QGIS libraries
@@ -34,6 +36,7 @@ from qgis.core import QgsMessageLog
 from qgis._core import QgsAction, QgsPoint
 
 from DsgTools.Factories.ThreadFactory.genericThread import GenericThread
+from DsgTools.Factories.ThreadFactory.inventoryCache import InventoryCache
 from exceptions import OSError
 
 class InventoryMessages(QObject):
@@ -75,6 +78,12 @@ class InventoryMessages(QObject):
         Returns user canceled message
         """
         return self.tr('User canceled inventory processing!')
+
+    def getThroughputMessage(self, fileCount, cachedCount, elapsed):
+        """
+        Returns the inventory throughput message
+        """
+        return self.tr('Inventory: {0} files in {1:.1f} s ({2:.1f} files/s), {3} unchanged files read from cache.').format(fileCount, elapsed, fileCount/max(elapsed, 0.001), cachedCount)
     
     @pyqtSlot()
     def progressCanceled(self):
@@ -92,7 +101,16 @@ class InventoryThread(GenericThread):
         gdal.DontUseExceptions()
         ogr.DontUseExceptions()
         
-    def setParameters(self, parentFolder, outputFile, makeCopy, destinationFolder, formatsList, isWhitelist, isOnlyGeo, stopped):
+    def setParameters(self, parentFolder, outputFile, makeCopy, destinationFolder, formatsList, isWhitelist, isOnlyGeo, stopped, cacheFile = None, workers = 8):
+        """
+        Sets thread parameters
+        cacheFile: SQLite file that keeps the inspected files between runs (defaults to dsgtools_inventory.sqlite in the QGIS settings folder)
+        workers: number of threads used to scan folders and open files
+        """
+        if not cacheFile:
+            cacheFile = os.path.join(QgsApplication.qgisSettingsDirPath(), 'dsgtools_inventory.sqlite')
+        self.cacheFile = cacheFile
+        self.workers = workers
         self.parentFolder = parentFolder
         self.outputFile = outputFile
         self.makeCopy = makeCopy
@@ -125,49 +143,59 @@ class InventoryThread(GenericThread):
             QgsMessageLog.logMessage(self.messenger.getInventoryErrorMessage()+'\n'+e.strerror, "DSG Tools Plugin", QgsMessageLog.INFO)
             return (0, self.messenger.getInventoryErrorMessage()+'\n'+e.strerror)
 
+        cache = None
+        pool = None
         try:
             outwriter = csv.writer(csvfile)
             # defining the first row
             outwriter.writerow(['fileName', 'date', 'size (KB)', 'extension'])
             # creating the memory layer used in only geo mode
             layer = self.createMemoryLayer()
-            # iterating over the parent folder recursively
-            for root, dirs, files in os.walk(parentFolder):
-                # Progress bar steps calculated
-                self.signals.rangeCalculated.emit(len(files), self.getId())
-                for file in files:
-                    # check if the user stopped the operation
-                    if not self.stopped[0]:
-                        extension = file.split('.')[-1]
-                        # check if the file should be skipped
-                        if not self.inventoryFile(extension):
-                            continue
-                        # making the full path
-                        line = os.path.join(root,file)
-                        line = line.encode(encoding='UTF-8')
-                        # changing the separator, it will be changed later
-                        line = line.replace(os.sep, '/')
-                        # forcing the inventory of .prj files
-                        if extension == 'prj':
-                            self.writeLine(outwriter, line, extension)
-                        else:
-                            # check if GDAL/OGR recognizes the file
-                            gdalSrc = gdal.Open(line)
-                            ogrSrc = ogr.Open(line)
-                            if gdalSrc or ogrSrc:
-                                #if only geo mode
-                                if self.isOnlyGeo:
-                                    self.computeBoxAndAttributes(layer, line, extension)
-                                else:
-                                    self.writeLine(outwriter, line, extension)
-                                self.files.append(line)
-                            gdalSrc = None
-                            ogrSrc = None
-                            
-                        self.signals.stepProcessed.emit(self.getId())
+            startTime = time.time()
+            pool = ThreadPool(max(1, self.workers))
+            # listing the candidate files of the parent folder recursively
+            fileInfoList = self.scanFolder(parentFolder, pool)
+            if fileInfoList is None:
+                QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
+                return (-1, self.messenger.getUserCanceledFeedbackMessage())
+            # Progress bar steps calculated
+            self.signals.rangeCalculated.emit(len(fileInfoList), self.getId())
+            # records of the files inspected on previous runs
+            cache = InventoryCache(self.cacheFile)
+            cache.loadFolder(self.getCachePath(parentFolder))
+            self.inventoryCache = cache
+            self.extensionDriverDict = self.getExtensionDriverDict()
+            newRecordList = []
+            cachedCount = 0
+            # files are inspected by the pool, results come back in the scan order
+            for fileInfo, sourceType, extentWkt, prjWkt, fromCache in pool.imap(self.inspectFile, fileInfoList, 16):
+                # check if the user stopped the operation
+                if self.stopped[0]:
+                    cache.update(newRecordList)
+                    QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
+                    return (-1, self.messenger.getUserCanceledFeedbackMessage())
+                path, extension, size, mtime, ctime = fileInfo
+                # making the full path
+                line = path.encode(encoding='UTF-8')
+                # changing the separator, it will be changed later
+                line = line.replace(os.sep, '/')
+                if fromCache:
+                    cachedCount += 1
+                elif sourceType is not None:
+                    newRecordList.append((self.getCachePath(path), size, mtime, sourceType, extentWkt, prjWkt))
+                # forcing the inventory of .prj files
+                if extension == 'prj':
+                    self.writeLine(outwriter, line, extension, ctime, size)
+                elif sourceType:
+                    #if only geo mode
+                    if self.isOnlyGeo:
+                        self.computeBoxAndAttributes(layer, line, extension, (extentWkt, prjWkt), ctime, size)
                     else:
-                        QgsMessageLog.logMessage(self.messenger.getUserCanceledFeedbackMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
-                        return (-1, self.messenger.getUserCanceledFeedbackMessage())
+                        self.writeLine(outwriter, line, extension, ctime, size)
+                    self.files.append(line)
+                self.signals.stepProcessed.emit(self.getId())
+            cache.update(newRecordList)
+            QgsMessageLog.logMessage(self.messenger.getThroughputMessage(len(fileInfoList), cachedCount, time.time() - startTime), "DSG Tools Plugin", QgsMessageLog.INFO)
         except csv.Error, e:
             csvfile.close()
             QgsMessageLog.logMessage(self.messenger.getInventoryErrorMessage()+'\n'+e, "DSG Tools Plugin", QgsMessageLog.INFO)
@@ -180,6 +208,11 @@ class InventoryThread(GenericThread):
             csvfile.close()
             QgsMessageLog.logMessage(self.messenger.getInventoryErrorMessage()+'\n'+':'.join(e.args), "DSG Tools Plugin", QgsMessageLog.INFO)
             return (0, self.messenger.getInventoryErrorMessage())
+        finally:
+            if pool:
+                pool.terminate()
+            if cache:
+                cache.close()
         csvfile.close()
         
         if self.isOnlyGeo:
@@ -192,12 +225,141 @@ class InventoryThread(GenericThread):
             QgsMessageLog.logMessage(self.messenger.getSuccessInventoryMessage(), "DSG Tools Plugin", QgsMessageLog.INFO)
             return (1, self.messenger.getSuccessInventoryMessage())
         
-    def computeBoxAndAttributes(self, layer, line, extension):
+    def scanFolder(self, parentFolder, pool):
+        """
+        Lists the files of parentFolder recursively that should be inventoried.
+        Folders of the same level are listed at the same time by the pool.
+        parentFolder: folder to be scanned
+        pool: thread pool
+        returns: list of (path, extension, size, mtime, ctime) or None if the user stopped the operation
+        """
+        fileInfoList = []
+        folderList = [parentFolder]
+        while len(folderList) > 0:
+            if self.stopped[0]:
+                return None
+            nextFolderList = []
+            for files, folders in pool.map(self.scanDirectory, folderList):
+                fileInfoList += files
+                nextFolderList += folders
+            folderList = nextFolderList
+        return fileInfoList
+
+    def scanDirectory(self, folder):
+        """
+        Lists a single folder, as os.walk does (unreadable entries are skipped and symbolic links to folders are not followed)
+        folder: folder path
+        returns: (list of (path, extension, size, mtime, ctime), list of sub folders)
+        """
+        files, folders = [], []
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return files, folders
+        for name in sorted(names):
+            path = os.path.join(folder, name)
+            try:
+                fileStat = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(fileStat.st_mode):
+                if not os.path.islink(path):
+                    folders.append(path)
+                continue
+            extension = name.split('.')[-1]
+            # check if the file should be skipped
+            if not self.inventoryFile(extension):
+                continue
+            files.append((path, extension, fileStat.st_size, fileStat.st_mtime, fileStat.st_ctime))
+        return files, folders
+
+    def getCachePath(self, path):
+        """
+        Path used as key on the inventory cache (unicode, using '/' as separator)
+        """
+        if not isinstance(path, unicode):
+            path = path.decode('utf-8')
+        return path.replace(os.sep, '/')
+
+    def getExtensionDriverDict(self):
+        """
+        Maps the file extensions declared by the GDAL/OGR drivers to the libraries able to open them
+        returns: { extension : set(['gdal', 'ogr']) }
+        """
+        extensionDriverDict = dict()
+        for i in range(gdal.GetDriverCount()):
+            driver = gdal.GetDriver(i)
+            extensions = driver.GetMetadataItem('DMD_EXTENSIONS') or driver.GetMetadataItem('DMD_EXTENSION')
+            if not extensions:
+                continue
+            isRaster = driver.GetMetadataItem('DCAP_RASTER') == 'YES'
+            isVector = driver.GetMetadataItem('DCAP_VECTOR') == 'YES'
+            sourceTypes = set()
+            # drivers without capabilities (gdal < 2) are raster drivers
+            if isRaster or not isVector:
+                sourceTypes.add('gdal')
+            if isVector:
+                sourceTypes.add('ogr')
+            for extension in extensions.lower().split():
+                extensionDriverDict.setdefault(extension, set()).update(sourceTypes)
+        return extensionDriverDict
+
+    def openDataSource(self, filename, extension):
+        """
+        Opens a file with OGR or GDAL. When the extension belongs to the drivers of only one library, the other is not tried.
+        Unknown extensions are tried with both (OGR first).
+        filename: file name
+        extension: file extension
+        returns: (sourceType, dataSource) where sourceType is 'ogr', 'gdal' or '' (not recognized)
+        """
+        sourceTypes = self.extensionDriverDict.get(extension.lower(), set(['gdal', 'ogr']))
+        if 'ogr' in sourceTypes:
+            ogrSrc = ogr.Open(filename)
+            if ogrSrc:
+                return ('ogr', ogrSrc)
+        if 'gdal' in sourceTypes:
+            gdalSrc = gdal.Open(filename)
+            if gdalSrc:
+                return ('gdal', gdalSrc)
+        return ('', None)
+
+    def inspectFile(self, fileInfo):
+        """
+        Checks if GDAL/OGR recognizes a file (and gets its extent in only geo mode), reusing the cache when the file did not change.
+        Runs on the pool threads.
+        fileInfo: (path, extension, size, mtime, ctime)
+        returns: (fileInfo, sourceType, extentWkt, prjWkt, fromCache)
+        """
+        path, extension, size, mtime, ctime = fileInfo
+        if extension == 'prj':
+            return (fileInfo, None, None, None, False)
+        record = self.inventoryCache.getRecord(self.getCachePath(path), size, mtime)
+        if record is not None:
+            sourceType, extentWkt, prjWkt = record
+            # extents are only computed in only geo mode, so older records may lack them
+            if not (self.isOnlyGeo and sourceType and extentWkt is None):
+                return (fileInfo, sourceType, extentWkt, prjWkt, True)
+        line = path.encode(encoding='UTF-8')
+        sourceType, dataSource = self.openDataSource(line, extension)
+        extentWkt, prjWkt = None, None
+        if dataSource and self.isOnlyGeo:
+            (ogrPoly, prjWkt) = self.getSourceExtent(sourceType, dataSource)
+            if ogrPoly:
+                extentWkt = ogrPoly.ExportToWkt()
+        dataSource = None
+        return (fileInfo, sourceType, extentWkt, prjWkt, False)
+
+    def computeBoxAndAttributes(self, layer, line, extension, extent = None, ctime = None, size = None):
         """
         Computes bounding box and inventory attributes
+        extent: (extent wkt, projection wkt) already computed. If None, the file is opened to get it.
         """
         # get the bounding box and wkt projection
-        (ogrPoly, prjWkt) = self.getExtent(line)
+        if extent is None:
+            (ogrPoly, prjWkt) = self.getExtent(line)
+        else:
+            ogrPoly = ogr.CreateGeometryFromWkt(extent[0]) if extent[0] else None
+            prjWkt = extent[1]
         if ogrPoly == None or prjWkt == None:
             return
         # making a QGIS projection
@@ -206,7 +368,7 @@ class InventoryThread(GenericThread):
         # reprojecting the bounding box
         qgsPolygon = self.reprojectBoundingBox(crsSrc, ogrPoly)
         # making the attributes
-        attributes = self.makeAttributes(line, extension)
+        attributes = self.makeAttributes(line, extension, ctime, size)
         # inserting into memory layer
         self.insertIntoMemoryLayer(layer, qgsPolygon, attributes)
         
@@ -302,26 +464,33 @@ class InventoryThread(GenericThread):
         else:
             return not self.isInFormatsList(ext)
         
-    def writeLine(self, outwriter, line, extension):
+    def writeLine(self, outwriter, line, extension, ctime = None, size = None):
         """
         Write CSV line
         outwriter: csv file
         line: csv line
         extension: file extension
+        ctime: file creation time (read from the file if None)
+        size: file size in bytes (read from the file if None)
         """
-        row = self.makeAttributes(line, extension)
+        row = self.makeAttributes(line, extension, ctime, size)
         outwriter.writerow(row)
         
-    def makeAttributes(self, line, extension):
+    def makeAttributes(self, line, extension, ctime = None, size = None):
         """
         Make the attributes array
         line: csv line
         extension: file extension
-        """
-        creationDate = time.ctime(os.path.getctime(line))
-        size = os.path.getsize(line)/1000.
+        ctime: file creation time (read from the file if None)
+        size: file size in bytes (read from the file if None)
+        """
+        if ctime is None:
+            ctime = os.path.getctime(line)
+        if size is None:
+            size = os.path.getsize(line)
+        creationDate = time.ctime(ctime)
         
-        return [line, creationDate, size, extension]
+        return [line, creationDate, size/1000., extension]
         
     def getRasterExtent(self, gt, cols, rows):
         """ 
@@ -348,9 +517,22 @@ class InventoryThread(GenericThread):
         Makes a ogr polygon to represent the extent (i.e. bounding box)
         filename: file name
         """
-        gdalSrc = gdal.Open(filename)
         ogrSrc = ogr.Open(filename)
         if ogrSrc:
+            return self.getSourceExtent('ogr', ogrSrc)
+        gdalSrc = gdal.Open(filename)
+        if gdalSrc:
+            return self.getSourceExtent('gdal', gdalSrc)
+        return (None, None)
+
+    def getSourceExtent(self, sourceType, dataSource):
+        """
+        Makes a ogr polygon to represent the extent (i.e. bounding box) of an opened data source
+        sourceType: 'ogr' or 'gdal'
+        dataSource: ogr or gdal data source
+        """
+        if sourceType == 'ogr':
+            ogrSrc = dataSource
             poly = ogr.Geometry(ogr.wkbPolygon)
             spatialRef = None
             for id in range(ogrSrc.GetLayerCount()):
@@ -374,7 +556,8 @@ class InventoryThread(GenericThread):
             if not spatialRef:
                 return (None, None)
             return (poly, spatialRef.ExportToWkt())
-        elif gdalSrc:
+        elif sourceType == 'gdal':
+            gdalSrc = dataSource
             gdalSrc.GetProjectionRef()
             gt = gdalSrc.GetGeoTransform()
             cols = gdalSrc.RasterXSize
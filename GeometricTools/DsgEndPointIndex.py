@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-15
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import numpy
+
+from qgis.core import QgsPoint
+
+class DsgEndPointIndex(object):
+    """
+    Index of the start and end points of lines.
+    Coordinates are kept in arrays and quantized by tolerance, so endpoints closer than
+    tolerance (float noise) share the same key. Keys are sorted once, which gives the
+    degree of every endpoint without any per point python lookup.
+    """
+    def __init__(self, tolerance = 10**-9):
+        """
+        Constructor
+        :param tolerance: float, endpoints whose coordinates round to the same multiple of tolerance are the same node
+        """
+        self.tolerance = tolerance
+        self.coordList = []
+        self.featIdList = []
+        self.isBuilt = False
+
+    def addFeature(self, feat):
+        """
+        Stores the start and end points of each part of a line feature
+        :param feat: QgsFeature
+        """
+        geom = feat.geometry()
+        if not geom:
+            return
+        if geom.isMultipart():
+            lines = geom.asMultiPolyline()
+        else:
+            lines = [geom.asPolyline()]
+        for line in lines:
+            if len(line) == 0:
+                continue
+            self.coordList.append((line[0].x(), line[0].y()))
+            self.coordList.append((line[-1].x(), line[-1].y()))
+            self.featIdList.append(feat.id())
+            self.featIdList.append(feat.id())
+        self.isBuilt = False
+
+    def build(self):
+        """
+        Sorts the quantized endpoints and groups the equal ones
+        """
+        self.coords = numpy.array(self.coordList, dtype=numpy.float64).reshape(-1, 2)
+        self.featIds = numpy.array(self.featIdList, dtype=numpy.int64)
+        keys = numpy.round(self.coords / self.tolerance).astype(numpy.int64)
+        # stable sort by x key and then by y key, equal endpoints keep their insertion order
+        self.order = numpy.lexsort((keys[:, 1], keys[:, 0]))
+        self.keyX = numpy.ascontiguousarray(keys[self.order, 0])
+        self.keyY = numpy.ascontiguousarray(keys[self.order, 1])
+        newGroup = numpy.ones(len(self.order), dtype=bool)
+        newGroup[1:] = (self.keyX[1:] != self.keyX[:-1]) | (self.keyY[1:] != self.keyY[:-1])
+        self.groupStarts = numpy.nonzero(newGroup)[0]
+        self.groupCounts = numpy.diff(numpy.append(self.groupStarts, len(self.order)))
+        self.isBuilt = True
+
+    def getNodeCount(self):
+        """
+        Number of distinct endpoints
+        """
+        if not self.isBuilt:
+            self.build()
+        return len(self.groupStarts)
+
+    def getDanglePoints(self):
+        """
+        Gets the endpoints that are used only once, i.e., endpoints with degree 1
+        :return: list of QgsPoint
+        """
+        if not self.isBuilt:
+            self.build()
+        dangleIdx = self.order[self.groupStarts[self.groupCounts == 1]]
+        return [QgsPoint(x, y) for x, y in self.coords[dangleIdx]]
+
+    def getFeatureIds(self, point):
+        """
+        Gets the ids of the features that have point as start or end point
+        :param point: QgsPoint
+        :return: list of feature ids
+        """
+        if not self.isBuilt:
+            self.build()
+        kx = int(numpy.round(point.x() / self.tolerance))
+        ky = int(numpy.round(point.y() / self.tolerance))
+        lo = numpy.searchsorted(self.keyX, kx, 'left')
+        hi = numpy.searchsorted(self.keyX, kx, 'right')
+        start = lo + numpy.searchsorted(self.keyY[lo:hi], ky, 'left')
+        end = lo + numpy.searchsorted(self.keyY[lo:hi], ky, 'right')
+        return self.featIds[self.order[start:end]].tolist()
+
+    def __getitem__(self, point):
+        """
+        Dict-like access, kept for the code written for the former {QgsPoint: [feature ids]} dict
+        """
+        return self.getFeatureIds(point)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-20
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import numpy
+
+from qgis.core import QgsPoint
+
+class DsgNetworkGraph(object):
+    """
+    Directed graph of a line network.
+    Nodes are integer ids given to the distinct start/end points of the lines (exact coordinates) and edges are
+    integer ids given to the lines, in the order they were added. Each edge keeps its feature id and its feature.
+    The node/edge incidence is stored as CSR arrays (it does not change when an edge is flipped), while the edge
+    directions are stored in the edgeStart/edgeEnd arrays. Directed (out/in) CSR adjacency is derived on demand.
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.coordList = []
+        self.featureIdList = []
+        self.features = []
+        self.isBuilt = False
+
+    def addEdge(self, feature, startPoint, endPoint):
+        """
+        Adds a line to the graph
+        :param feature: (QgsFeature) line feature.
+        :param startPoint: (QgsPoint) line starting node.
+        :param endPoint: (QgsPoint) line ending node.
+        :return: (int) edge id.
+        """
+        self.coordList.append((startPoint.x(), startPoint.y()))
+        self.coordList.append((endPoint.x(), endPoint.y()))
+        self.featureIdList.append(feature.id())
+        self.features.append(feature)
+        self.isBuilt = False
+        return len(self.features) - 1
+
+    def build(self):
+        """
+        Gives ids to the nodes and builds the incidence arrays
+        """
+        coords = numpy.array(self.coordList, dtype=numpy.float64).reshape(-1, 2)
+        self.featureIds = numpy.array(self.featureIdList, dtype=numpy.int64)
+        self.edgeIdDict = {featId : edgeId for edgeId, featId in enumerate(self.featureIdList)}
+        # endpoints sorted by x and then by y, so node ids follow the coordinates order
+        order = numpy.lexsort((coords[:, 1], coords[:, 0]))
+        sortedCoords = coords[order]
+        newNode = numpy.ones(len(order), dtype=bool)
+        newNode[1:] = (sortedCoords[1:, 0] != sortedCoords[:-1, 0]) | (sortedCoords[1:, 1] != sortedCoords[:-1, 1])
+        self.nodeX = numpy.ascontiguousarray(sortedCoords[newNode, 0])
+        self.nodeY = numpy.ascontiguousarray(sortedCoords[newNode, 1])
+        endpointNodes = numpy.empty(len(order), dtype=numpy.int64)
+        endpointNodes[order] = numpy.cumsum(newNode) - 1
+        # endpoint 2*e is the start of edge e and 2*e + 1 is its end
+        self.edgeStart = endpointNodes[0::2].copy()
+        self.edgeEnd = endpointNodes[1::2].copy()
+        self.isActive = numpy.ones(len(self.features), dtype=bool)
+        # incidence CSR: edges touching node n are incidenceEdges[incidencePtr[n]:incidencePtr[n+1]]
+        incidenceOrder = numpy.argsort(endpointNodes, kind='mergesort')
+        self.incidenceEdges = incidenceOrder // 2
+        self.incidencePtr = numpy.zeros(len(self.nodeX) + 1, dtype=numpy.int64)
+        self.incidencePtr[1:] = numpy.cumsum(numpy.bincount(endpointNodes, minlength=len(self.nodeX)))
+        self.adjacency = None
+        self.isBuilt = True
+
+    def getNodeCount(self):
+        """
+        Number of nodes
+        """
+        if not self.isBuilt:
+            self.build()
+        return len(self.nodeX)
+
+    def getNodeId(self, point):
+        """
+        Gets the id of the node at point
+        :param point: (QgsPoint) node point.
+        :return: (int) node id or None, if there is no node at point.
+        """
+        if not self.isBuilt:
+            self.build()
+        x, y = point.x(), point.y()
+        lo = numpy.searchsorted(self.nodeX, x, 'left')
+        hi = numpy.searchsorted(self.nodeX, x, 'right')
+        idx = lo + numpy.searchsorted(self.nodeY[lo:hi], y, 'left')
+        if idx < hi and self.nodeY[idx] == y:
+            return int(idx)
+        return None
+
+    def getNodePoint(self, node):
+        """
+        :param node: (int) node id.
+        :return: (QgsPoint) node point.
+        """
+        return QgsPoint(self.nodeX[node], self.nodeY[node])
+
+    def getEdgeId(self, featureId):
+        """
+        :param featureId: (int) line feature id.
+        :return: (int) edge id or None, if the feature is not on the graph.
+        """
+        if not self.isBuilt:
+            self.build()
+        return self.edgeIdDict.get(featureId)
+
+    def getEdges(self, node):
+        """
+        Gets the active edges touching node (an edge that starts and ends at node is given twice)
+        :param node: (int) node id.
+        :return: (numpy.array) edge ids.
+        """
+        edges = self.incidenceEdges[self.incidencePtr[node]:self.incidencePtr[node + 1]]
+        return edges[self.isActive[edges]]
+
+    def getOutEdges(self, node):
+        """
+        :param node: (int) node id.
+        :return: (numpy.array) ids of the active edges starting at node.
+        """
+        edges = self.getEdges(node)
+        return numpy.unique(edges[self.edgeStart[edges] == node])
+
+    def getInEdges(self, node):
+        """
+        :param node: (int) node id.
+        :return: (numpy.array) ids of the active edges ending at node.
+        """
+        edges = self.getEdges(node)
+        return numpy.unique(edges[self.edgeEnd[edges] == node])
+
+    def getNeighbours(self, node):
+        """
+        Gets the other node of each line touching node, regardless of line direction
+        :param node: (int) node id.
+        :return: (list-of-int) node ids.
+        """
+        neighbours = []
+        for edge in self.getOutEdges(node):
+            neighbours.append(int(self.edgeEnd[edge]))
+        for edge in self.getInEdges(node):
+            neighbours.append(int(self.edgeStart[edge]))
+        return neighbours
+
+    def getDirectedAdjacency(self):
+        """
+        Builds (or reuses) the directed CSR adjacency of the active edges.
+        Out edges of node n are outEdges[outPtr[n]:outPtr[n+1]] and in edges are inEdges[inPtr[n]:inPtr[n+1]].
+        :return: (tuple-of-numpy.array) outPtr, outEdges, inPtr, inEdges
+        """
+        if not self.isBuilt:
+            self.build()
+        if self.adjacency is None:
+            nodeCount = len(self.nodeX)
+            activeEdges = numpy.nonzero(self.isActive)[0]
+            adjacency = []
+            for nodes in (self.edgeStart[activeEdges], self.edgeEnd[activeEdges]):
+                order = numpy.argsort(nodes, kind='mergesort')
+                ptr = numpy.zeros(nodeCount + 1, dtype=numpy.int64)
+                ptr[1:] = numpy.cumsum(numpy.bincount(nodes, minlength=nodeCount))
+                adjacency += [ptr, activeEdges[order]]
+            self.adjacency = tuple(adjacency)
+        return self.adjacency
+
+    def flipEdge(self, edge):
+        """
+        Inverts the direction of an edge
+        :param edge: (int) edge id.
+        """
+        self.edgeStart[edge], self.edgeEnd[edge] = self.edgeEnd[edge], self.edgeStart[edge]
+        self.adjacency = None
+
+    def mergeEdges(self, keptEdge, removedEdge, node):
+        """
+        Merges two edges that share node. The kept edge takes the place of the removed one at its other node.
+        :param keptEdge: (int) id of the edge that remains on graph.
+        :param removedEdge: (int) id of the edge merged into keptEdge.
+        :param node: (int) id of the node shared by both edges.
+        """
+        if self.edgeStart[removedEdge] == node:
+            otherNode = self.edgeEnd[removedEdge]
+        else:
+            otherNode = self.edgeStart[removedEdge]
+        if self.edgeStart[keptEdge] == node:
+            self.edgeStart[keptEdge] = otherNode
+        else:
+            self.edgeEnd[keptEdge] = otherNode
+        edges = self.incidenceEdges[self.incidencePtr[otherNode]:self.incidencePtr[otherNode + 1]]
+        edges[edges == removedEdge] = keptEdge
+        self.isActive[removedEdge] = False
+        self.adjacency = None
+
+    def getNodeDict(self):
+        """
+        Gets the graph as the node dictionary used by the network processes.
+        :return: { (QgsPoint) node : { 'start' : [features starting at node], 'end' : [features ending at node] } }
+        """
+        outPtr, outEdges, inPtr, inEdges = self.getDirectedAdjacency()
+        features = self.features
+        nodeDict = dict()
+        for node in xrange(len(self.nodeX)):
+            nodeDict[self.getNodePoint(node)] = {
+                                                    'start' : [features[e] for e in outEdges[outPtr[node]:outPtr[node + 1]]],
+                                                    'end' : [features[e] for e in inEdges[inPtr[node]:inPtr[node + 1]]]
+                                                }
+        return nodeDict
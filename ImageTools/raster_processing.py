@@ -28,9 +28,12 @@
 
 from osgeo import gdal, osr
 import sys
-import colorsys
 import numpy
 import struct
+import multiprocessing
+
+# pixels read at once by pansharpenImage (rounded to the raster's native block height)
+PIXELS_PER_BAND = 4*1024*1024
 
 
 class RasterProcess():
@@ -128,24 +131,20 @@ class RasterProcess():
         
         return outRaster
 
-    def pansharpenImage(self, rgbfile, panfile, destfile):
+    def pansharpenImage(self, rgbfile, panfile, destfile, workers = 1):
         '''
         Performs a HSV fusion
         rgbfile: original RGB raster file
         panfile: original PAN raster file
         destfile: destination file
+        workers: number of processes used to fuse disjoint row bands
         '''
         rgb = self.openRaster(rgbfile)
         red = rgb.GetRasterBand(1)
-        green = rgb.GetRasterBand(2)
-        blue = rgb.GetRasterBand(3)
 
         panraster = self.openRaster(panfile)
         pan = panraster.GetRasterBand(1)
         
-        rgb_to_hsv = numpy.vectorize(colorsys.rgb_to_hsv)
-        hsv_to_rgb = numpy.vectorize(colorsys.hsv_to_rgb)
-        
         if red.DataType > pan.DataType:
             pixelType = red.DataType
         else:
@@ -157,24 +156,110 @@ class RasterProcess():
         outB = outRaster.GetRasterBand(3)
 
         sizeX = pan.XSize
-        sizeY = pan.YSize        
-        for row in range(sizeY):
-            redblock = self.readBlock(red, sizeX, 1, row, red.DataType)
-            greenblock = self.readBlock(green, sizeX, 1, row, green.DataType)
-            blueblock = self.readBlock(blue, sizeX, 1, row, blue.DataType)
-            
-            panblock = self.readBlock(pan, sizeX, 1, row, pan.DataType)
-            
-            h, s, v = rgb_to_hsv(redblock, greenblock, blueblock)
-            r, g, b = hsv_to_rgb(h, s, panblock)
-            
-            self.writeBlock(outR, r, sizeX, 1, row, pixelType)
-            self.writeBlock(outG, g, sizeX, 1, row, pixelType)
-            self.writeBlock(outB, b, sizeX, 1, row, pixelType)
+        sizeY = pan.YSize
+        rowBandList = [(rgbfile, panfile, row, lines) for row, lines in self.getRowBands(pan, sizeX, sizeY)]
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer = initFusionWorker)
+            fusedBands = pool.imap(fuseRowBand, rowBandList)
+        else:
+            pool = None
+            fusedBands = (self.fuseRowBand(rgb, panraster, row, lines) for _, _, row, lines in rowBandList)
+        # bands come back in order and are written by this process only
+        for row, lines, r, g, b in fusedBands:
+            self.writeBlock(outR, r, sizeX, lines, row, pixelType)
+            self.writeBlock(outG, g, sizeX, lines, row, pixelType)
+            self.writeBlock(outB, b, sizeX, lines, row, pixelType)
+        if pool:
+            pool.close()
+            pool.join()
 
         rgb = None
         panraster = None
         outRaster = None
+
+    def getRowBands(self, band, sizeX, sizeY):
+        '''
+        Splits the raster rows in bands whose height is a multiple of the native block height of band
+        band: gdal band used to get the block size
+        sizeX: raster width
+        sizeY: raster height
+        returns: list of (first row, number of rows)
+        '''
+        blockY = max(1, band.GetBlockSize()[1])
+        lines = max(1, PIXELS_PER_BAND // max(1, sizeX) // blockY) * blockY
+        return [(row, min(lines, sizeY - row)) for row in range(0, sizeY, lines)]
+
+    def fuseRowBand(self, rgb, panraster, row, lines):
+        '''
+        Reads and fuses a row band
+        rgb: gdal RGB raster
+        panraster: gdal PAN raster
+        row: first row
+        lines: number of rows
+        returns: (row, lines, red, green, blue)
+        '''
+        red = rgb.GetRasterBand(1)
+        green = rgb.GetRasterBand(2)
+        blue = rgb.GetRasterBand(3)
+        pan = panraster.GetRasterBand(1)
+        sizeX = pan.XSize
+
+        redblock = self.readBlock(red, sizeX, lines, row, red.DataType)
+        greenblock = self.readBlock(green, sizeX, lines, row, green.DataType)
+        blueblock = self.readBlock(blue, sizeX, lines, row, blue.DataType)
+
+        panblock = self.readBlock(pan, sizeX, lines, row, pan.DataType)
+
+        h, s, v = self.rgbToHsv(redblock, greenblock, blueblock)
+        r, g, b = self.hsvToRgb(h, s, panblock)
+        return row, lines, r, g, b
+
+    def rgbToHsv(self, r, g, b):
+        '''
+        Converts RGB arrays to HSV arrays, giving the same values as colorsys.rgb_to_hsv for each pixel
+        r: red array
+        g: green array
+        b: blue array
+        '''
+        r = numpy.asarray(r, dtype=numpy.float64)
+        g = numpy.asarray(g, dtype=numpy.float64)
+        b = numpy.asarray(b, dtype=numpy.float64)
+        maxc = numpy.maximum(numpy.maximum(r, g), b)
+        minc = numpy.minimum(numpy.minimum(r, g), b)
+        v = maxc
+        gray = minc == maxc
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            delta = numpy.where(gray, 1.0, maxc - minc)
+            s = numpy.where(gray, 0.0, (maxc - minc) / maxc)
+            rc = (maxc - r) / delta
+            gc = (maxc - g) / delta
+            bc = (maxc - b) / delta
+        h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = numpy.where(gray, 0.0, numpy.mod(h / 6.0, 1.0))
+        return h, s, v
+
+    def hsvToRgb(self, h, s, v):
+        '''
+        Converts HSV arrays to RGB arrays, giving the same values as colorsys.hsv_to_rgb for each pixel
+        h: hue array
+        s: saturation array
+        v: value array
+        '''
+        h = numpy.asarray(h, dtype=numpy.float64)
+        s = numpy.asarray(s, dtype=numpy.float64)
+        v = numpy.asarray(v, dtype=numpy.float64)
+        i = numpy.trunc(h * 6.0)
+        f = (h * 6.0) - i
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        i = numpy.mod(i, 6).astype(numpy.int64)
+        r = numpy.choose(i, [v, q, p, p, t, v])
+        g = numpy.choose(i, [t, v, v, q, p, p])
+        b = numpy.choose(i, [p, p, t, v, v, q])
+        # colorsys gives v for the three channels when there is no saturation
+        gray = s == 0.0
+        return numpy.where(gray, v, r), numpy.where(gray, v, g), numpy.where(gray, v, b)
         
     def normalize(self, arr):
         '''
@@ -233,7 +318,27 @@ class RasterProcess():
 
         band.WriteRaster(0, offsetY, sizeX, sizeY, block.astype(numpytype).tostring())
 
-obj = RasterProcess()
-obj.pansharpenImage('/home/lclaudio/Documents/classificacao_rgb.tif',
-                    '/home/lclaudio/Documents/corte_amp.tif',
-                    '/home/lclaudio/Documents/teste.tif')
+def initFusionWorker():
+    '''
+    Prepares a pansharpening worker process
+    '''
+    global workerProcess, workerRasters
+    workerProcess = RasterProcess()
+    workerRasters = dict()
+
+def fuseRowBand(parameters):
+    '''
+    Fuses a row band on a worker process. Rasters are opened once per worker.
+    parameters: (rgbfile, panfile, row, lines)
+    '''
+    rgbfile, panfile, row, lines = parameters
+    if (rgbfile, panfile) not in workerRasters:
+        workerRasters[(rgbfile, panfile)] = (workerProcess.openRaster(rgbfile), workerProcess.openRaster(panfile))
+    rgb, panraster = workerRasters[(rgbfile, panfile)]
+    return workerProcess.fuseRowBand(rgb, panraster, row, lines)
+
+if __name__ == '__main__':
+    obj = RasterProcess()
+    obj.pansharpenImage('/home/lclaudio/Documents/classificacao_rgb.tif',
+                        '/home/lclaudio/Documents/corte_amp.tif',
+                        '/home/lclaudio/Documents/teste.tif')
@@ -54,8 +54,9 @@ class FieldSetup(QtGui.QDialog, FORM_CLASS):
         if self.abstractDb.db.driverName() == 'QPSQL':
             self.geomTypeDict = self.abstractDb.getGeomTypeDict()
             self.geomDict = self.abstractDb.getGeomDict(self.geomTypeDict)
-            self.domainDict = self.abstractDb.getDbDomainDict(self.geomDict)
-            self.geomStructDict = self.abstractDb.getGeomStructDict()
+            metadataCache = self.abstractDb.getMetadataCache()
+            self.domainDict = metadataCache.getDbDomainDict(self.geomDict)
+            self.geomStructDict = metadataCache.getGeomStructDict()
         self.returnDict = returnDict
         self.setupUi(self)
         self.tableComboBox.setCurrentIndex(-1)  
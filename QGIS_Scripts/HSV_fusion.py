@@ -28,9 +28,11 @@
 
 from osgeo import gdal, osr
 import sys
-import colorsys
 import numpy
 
+# pixels read at once by pansharpenImage (rounded to the raster's native block height)
+PIXELS_PER_BAND = 4*1024*1024
+
 class RasterProcess():
     def __init__(self):
         """
@@ -144,9 +146,6 @@ class RasterProcess():
         panraster = self.openRaster(panfile)
         pan = panraster.GetRasterBand(1)
         
-        rgb_to_hsv = numpy.vectorize(colorsys.rgb_to_hsv)
-        hsv_to_rgb = numpy.vectorize(colorsys.hsv_to_rgb)
-        
         if red.DataType > pan.DataType:
             pixelType = red.DataType
         else:
@@ -162,20 +161,15 @@ class RasterProcess():
 
         p = 0
         progress.setPercentage(p)
-        block = 10
-        for row in range(0, sizeY, block):
-            if row + block < sizeY:
-                lines = block
-            else:
-                lines = sizeY - row
+        for row, lines in self.getRowBands(pan, sizeX, sizeY):
             redblock = self.readBlock(red, sizeX, lines, row, red.DataType)
             greenblock = self.readBlock(green, sizeX, lines, row, green.DataType)
             blueblock = self.readBlock(blue, sizeX, lines, row, blue.DataType)
 
             panblock = self.readBlock(pan, sizeX, lines, row, pan.DataType)
 
-            h, s, v = rgb_to_hsv(redblock, greenblock, blueblock)
-            r, g, b = hsv_to_rgb(h, s, panblock)
+            h, s, v = self.rgbToHsv(redblock, greenblock, blueblock)
+            r, g, b = self.hsvToRgb(h, s, panblock)
 
             self.writeBlock(outR, r, sizeX, lines, row, pixelType)
             self.writeBlock(outG, g, sizeX, lines, row, pixelType)
@@ -188,6 +182,65 @@ class RasterProcess():
         rgb = None
         panraster = None
         outRaster = None
+
+    def getRowBands(self, band, sizeX, sizeY):
+        """
+        Splits the raster rows in bands whose height is a multiple of the native block height of band
+        band: gdal band used to get the block size
+        sizeX: raster width
+        sizeY: raster height
+        returns: list of (first row, number of rows)
+        """
+        blockY = max(1, band.GetBlockSize()[1])
+        lines = max(1, PIXELS_PER_BAND // max(1, sizeX) // blockY) * blockY
+        return [(row, min(lines, sizeY - row)) for row in range(0, sizeY, lines)]
+
+    def rgbToHsv(self, r, g, b):
+        """
+        Converts RGB arrays to HSV arrays, giving the same values as colorsys.rgb_to_hsv for each pixel
+        r: red array
+        g: green array
+        b: blue array
+        """
+        r = numpy.asarray(r, dtype=numpy.float64)
+        g = numpy.asarray(g, dtype=numpy.float64)
+        b = numpy.asarray(b, dtype=numpy.float64)
+        maxc = numpy.maximum(numpy.maximum(r, g), b)
+        minc = numpy.minimum(numpy.minimum(r, g), b)
+        v = maxc
+        gray = minc == maxc
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            delta = numpy.where(gray, 1.0, maxc - minc)
+            s = numpy.where(gray, 0.0, (maxc - minc) / maxc)
+            rc = (maxc - r) / delta
+            gc = (maxc - g) / delta
+            bc = (maxc - b) / delta
+        h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = numpy.where(gray, 0.0, numpy.mod(h / 6.0, 1.0))
+        return h, s, v
+
+    def hsvToRgb(self, h, s, v):
+        """
+        Converts HSV arrays to RGB arrays, giving the same values as colorsys.hsv_to_rgb for each pixel
+        h: hue array
+        s: saturation array
+        v: value array
+        """
+        h = numpy.asarray(h, dtype=numpy.float64)
+        s = numpy.asarray(s, dtype=numpy.float64)
+        v = numpy.asarray(v, dtype=numpy.float64)
+        i = numpy.trunc(h * 6.0)
+        f = (h * 6.0) - i
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        i = numpy.mod(i, 6).astype(numpy.int64)
+        r = numpy.choose(i, [v, q, p, p, t, v])
+        g = numpy.choose(i, [t, v, v, q, p, p])
+        b = numpy.choose(i, [p, p, t, v, v, q])
+        # colorsys gives v for the three channels when there is no saturation
+        gray = s == 0.0
+        return numpy.where(gray, v, r), numpy.where(gray, v, g), numpy.where(gray, v, b)
         
     def normalize(self, arr):
         """
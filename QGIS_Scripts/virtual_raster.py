@@ -27,7 +27,10 @@
 
 import processing
 from processing.core.GeoAlgorithmExecutionException import GeoAlgorithmExecutionException
-from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsSpatialIndex, QgsFeatureRequest, QgsCoordinateTransform, QgsFeature
+from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsSpatialIndex, QgsFeatureRequest, QgsCoordinateTransform, QgsFeature, QgsGeometry
+from osgeo import gdal
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
 import shutil, stat
 
@@ -77,32 +80,73 @@ def reprojectLayer(fromLayer, toLayer):
 def populateIndex(idx, layer):
     """
     Populates the layer index
+    returns: dict of the indexed features by id
     """
+    featureDict = dict()
     for feat in layer.getFeatures():
         idx.insertFeature(feat)
+        featureDict[feat.id()] = feat
+    return featureDict
         
 def getCandidates(idx, layer, bbox):
     """
     Gets candidates to be processed using the index to speedup the process
     """
     ids = idx.intersects(bbox)
-    candidates = []
-    for id in ids:
-        candidates.append(layer.getFeatures(QgsFeatureRequest().setFilterFid(id)).next())
-    return candidates
+    if len(ids) == 0:
+        return []
+    #all candidates are fetched by a single request
+    return [feat for feat in layer.getFeatures(QgsFeatureRequest().setFilterFids(ids))]
     
 def makeVrtDict(candidates, camada):
     """
     Makes a VRT dictionary
     """
+    #spatial index over the image footprints, so each candidate is tested only against the footprints that touch its bounding box
+    footprintIdx = QgsSpatialIndex()
+    footprintDict = populateIndex(footprintIdx, camada)
     vrt = dict()
     for candidate in candidates:
         map_index = candidate['map_index']
         vrt[map_index] = []
-        for feat in camada.getFeatures():
-            if candidate.geometry().intersects(feat.geometry()):
+        candidateGeom = candidate.geometry()
+        engine = QgsGeometry.createGeometryEngine(candidateGeom.geometry())
+        engine.prepareGeometry()
+        for id in sorted(footprintIdx.intersects(candidateGeom.boundingBox())):
+            feat = footprintDict[id]
+            if engine.intersects(feat.geometry().geometry()):
                 vrt[map_index].append(feat)
     return vrt            
+
+def buildOverviews(filename):
+    """
+    Builds external (.ovr) overviews, as gdalogr:overviews with levels 4 8 32 128 and nearest resampling does
+    filename: raster file
+    returns: filename when gdal fails, otherwise None
+    """
+    #opening read only makes gdal write the overviews in an external .ovr file
+    dataset = gdal.Open(filename, gdal.GA_ReadOnly)
+    if dataset is None:
+        return filename
+    ret = dataset.BuildOverviews('NEAREST', [4, 8, 32, 128])
+    dataset = None
+    return filename if ret != 0 else None
+
+def buildMissingOverviews(filenameList):
+    """
+    Builds the overviews of the rasters that lack .ovr files, several rasters at the same time
+    filenameList: raster files
+    """
+    missingList = [filename for filename in filenameList if not os.path.isfile(filename+'.ovr')]
+    if len(missingList) == 0:
+        return
+    progress.setText('Fazendo Pirâmides...')
+    pool = ThreadPool(min(cpu_count(), len(missingList)))
+    errorList = [filename for filename in pool.imap_unordered(buildOverviews, missingList) if filename]
+    pool.close()
+    pool.join()
+    if len(errorList) > 0:
+        raise GeoAlgorithmExecutionException('Problema ao fazer pirâmides: %s' % ', '.join(errorList))
             
 def createVrt(vrt):
     """
@@ -112,26 +156,26 @@ def createVrt(vrt):
     size = len(vrt.keys())
     p = 0
     progress.setPercentage(p)    
+    rasterDict = dict()
     for key in vrt.keys():
-        vrtfilename = os.path.join(Pasta, key, key+'.vrt')
         features = vrt[key]
-        rasterList = []
+        rasterDict[key] = []
         for feat in features:
             filename = feat['fileName']
             newfilename = copyFileSet(Pasta, key, filename)
-            raster = QgsRasterLayer(newfilename, newfilename)
-            rasterList.append(raster)
-            ovr = newfilename+'.ovr'
-            if not os.path.isfile(ovr):
-                progress.setText('Fazendo Pirâmides...')
-                #('gdalogr:overviews', input, levels=8, clean=False, resampling_method=0(nearest), format=1(Gtiff .ovr))
-                processing.runalg('gdalogr:overviews', raster, '4 8 32 128', True, 0, 1)
-        
+            rasterDict[key].append(newfilename)
+
         if int(float(count)/size*100) != p:
             p = int(float(count)/size*100)
             progress.setPercentage(p)    
         count += 1
-    
+
+    #overviews of all copied rasters are built concurrently
+    buildMissingOverviews(list(set([filename for key in rasterDict.keys() for filename in rasterDict[key]])))
+
+    for key in rasterDict.keys():
+        vrtfilename = os.path.join(Pasta, key, key+'.vrt')
+        rasterList = [QgsRasterLayer(newfilename, newfilename) for newfilename in rasterDict[key]]
         progress.setText('Fazendo raster virtual...')
         processing.runalg('gdalogr:buildvirtualraster', rasterList, 0, False, False, vrtfilename)
         
@@ -31,9 +31,42 @@ import processing
 from processing.core.GeoAlgorithmExecutionException import GeoAlgorithmExecutionException
 from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsSpatialIndex, QgsFeatureRequest, QgsCoordinateTransform, QgsFeature, QgsCoordinateReferenceSystem
 from PyQt4.QtCore import QSettings
+from osgeo import gdal
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
 
 #script methods
+def buildOverviews(filename):
+    """
+    Builds external (.ovr) overviews, as gdalogr:overviews with levels 4 8 32 128 and nearest resampling does
+    filename: raster file
+    returns: filename when gdal fails, otherwise None
+    """
+    #opening read only makes gdal write the overviews in an external .ovr file
+    dataset = gdal.Open(filename, gdal.GA_ReadOnly)
+    if dataset is None:
+        return filename
+    ret = dataset.BuildOverviews('NEAREST', [4, 8, 32, 128])
+    dataset = None
+    return filename if ret != 0 else None
+
+def buildMissingOverviews(filenameList):
+    """
+    Builds the overviews of the rasters that lack .ovr files, several rasters at the same time
+    filenameList: raster files
+    """
+    missingList = [filename for filename in filenameList if not os.path.isfile(filename+'.ovr')]
+    if len(missingList) == 0:
+        return
+    progress.setText('Fazendo Pirâmides...')
+    pool = ThreadPool(min(cpu_count(), len(missingList)))
+    errorList = [filename for filename in pool.imap_unordered(buildOverviews, missingList) if filename]
+    pool.close()
+    pool.join()
+    if len(errorList) > 0:
+        raise GeoAlgorithmExecutionException('Problema ao fazer pirâmides: %s' % ', '.join(errorList))
+
 def createVrt(inventario, vrt):
     #Camada de inventario
     layer = processing.getObject(Inventario)
@@ -43,6 +76,7 @@ def createVrt(inventario, vrt):
     p = 0
     progress.setPercentage(p)    
     rasterList = []
+    filenameList = []
     for feature in layer.getFeatures():
         filename = feature['fileName']
         
@@ -51,16 +85,14 @@ def createVrt(inventario, vrt):
             raster.setCrs( QgsCoordinateReferenceSystem(int(CRS.split(':')[-1]), QgsCoordinateReferenceSystem.EpsgCrsId) )
            
         rasterList.append(raster)
-        ovr = filename+'.ovr'
-        if not os.path.isfile(ovr):
-            progress.setText('Fazendo Pirâmides...')
-            #('gdalogr:overviews', input, levels=8, clean=False, resampling_method=0(nearest), format=1(Gtiff .ovr))
-            processing.runalg('gdalogr:overviews', raster, '4 8 32 128', True, 0, 1)
+        filenameList.append(filename)
 
         if int(float(count)/size*100) != p:
             p = int(float(count)/size*100)
             progress.setPercentage(p)    
         count += 1
+    #overviews are built concurrently for the rasters that lack them
+    buildMissingOverviews(filenameList)
     progress.setText('Fazendo raster virtual...')
     processing.runalg('gdalogr:buildvirtualraster', rasterList, 0, False, False, VRT)
 #end of script methods
@@ -27,8 +27,8 @@ from qgis.core import QgsMessageLog
 
 # Qt imports
 from PyQt4 import QtGui, uic
-from PyQt4.QtCore import pyqtSlot, Qt, QSettings, pyqtSignal
-from PyQt4.QtGui import QListWidgetItem, QMessageBox, QMenu, QApplication, QCursor, QFileDialog
+from PyQt4.QtCore import pyqtSlot, Qt, QSettings, pyqtSignal, QEventLoop
+from PyQt4.QtGui import QListWidgetItem, QMessageBox, QMenu, QApplication, QCursor, QFileDialog, QProgressDialog
 from PyQt4.QtSql import QSqlDatabase,QSqlQuery
 
 # DSGTools imports
@@ -36,6 +36,7 @@ from DsgTools.Utils.utils import Utils
 from DsgTools.Factories.SqlFactory.sqlGeneratorFactory import SqlGeneratorFactory
 from DsgTools.ServerTools.viewServers import ViewServers
 from DsgTools.Factories.DbFactory.dbFactory import DbFactory
+from DsgTools.Factories.ThreadFactory.batchDbThread import BatchDbExecutor
 
 from DsgTools.UserTools.profile_editor import ProfileEditor
 from DsgTools.ServerTools.createView import CreateView
@@ -140,6 +141,44 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
             msg +=', '.join(successList)
         msg += self.logInternalError(exceptionDict)
         QMessageBox.warning(self, self.tr('Operation Complete!'), msg)
+
+    def getMaxWorkers(self):
+        """
+        Gets the number of databases processed at the same time by batch operations
+        """
+        settings = QSettings()
+        settings.beginGroup('PythonPlugins/DsgTools/Options')
+        maxWorkers = settings.value('batchMaxWorkers')
+        settings.endGroup()
+        if maxWorkers:
+            return int(maxWorkers)
+        else:
+            return 4
+
+    def runBatchOperation(self, dbNameList, operation, labelText, connectionDb = None):
+        """
+        Runs operation over dbNameList on background threads, keeping the interface responsive.
+        Each worker opens its own connection to the database it processes (or to connectionDb, when given).
+        :param dbNameList: (list-of-str) databases to be processed.
+        :param operation: (function) operation(abstractDb, dbName).
+        :param labelText: (str) text shown on the progress dialog.
+        :param connectionDb: (str) database used by the workers' connections.
+        :return: (tuple) successList, exceptionDict
+        """
+        host, port, user, password = self.serverWidget.abstractDb.getDatabaseParameters()
+        executor = BatchDbExecutor((host, port, user, password), maxWorkers = self.getMaxWorkers(), parent = self)
+        progress = QProgressDialog(labelText, self.tr('Cancel'), 0, len(dbNameList), self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.canceled.connect(executor.cancel)
+        executor.dbProcessed.connect(lambda dbName : progress.setValue(progress.value() + 1))
+        loop = QEventLoop()
+        executor.finished.connect(loop.quit)
+        executor.execute(dbNameList, operation, connectionDb = connectionDb)
+        if not executor.isFinished():
+            loop.exec_()
+        progress.close()
+        return executor.successList, executor.exceptionDict
     
     def logInternalError(self, exceptionDict):
         msg = ''
@@ -159,9 +198,7 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
             QMessageBox.warning(self, self.tr('Warning'), self.tr('Please select one or more databases to drop!'))
         if QtGui.QMessageBox.question(self, self.tr('Question'), self.tr('Do you really want to drop databases: ')+', '.join(selectedDbNameList), QtGui.QMessageBox.Ok|QtGui.QMessageBox.Cancel) == QtGui.QMessageBox.Cancel:
             return
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         successList, exceptionDict = self.batchDropDbs(selectedDbNameList)
-        QApplication.restoreOverrideCursor()
         self.setDatabases()
         header = self.tr('Drop operation complete. \n')
         self.outputMessage(header, successList, exceptionDict)
@@ -170,44 +207,31 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
     @pyqtSlot(bool)
     def on_upgradePostgisPushButton_clicked(self):
         selectedDbNameList = self.getSelectedDbList()
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         successList, exceptionDict = self.batchUpgradePostgis(selectedDbNameList)
-        QApplication.restoreOverrideCursor()
         self.setDatabases()
         header = self.tr('Upgrade Posgtis operation complete. \n')
         self.outputMessage(header, successList, exceptionDict)
 
     def batchUpgradePostgis(self, dbList):
-        exceptionDict = dict()
-        successList = []
-        dbsDict = self.instantiateAbstractDbs(instantiateTemplates = True)
-        self.closeAbstractDbs(dbsDict)
-        for dbName in dbsDict.keys():
-            try:
-                if self.serverWidget.abstractDb.checkIfTemplate(dbName):
-                    self.serverWidget.abstractDb.setDbAsTemplate(dbName = dbName, setTemplate = False)
-                    dbsDict[dbName].upgradePostgis()
-                    self.serverWidget.abstractDb.setDbAsTemplate(dbName = dbName, setTemplate = True)
-                    successList.append(dbName)
-                else:
-                    dbsDict[dbName].upgradePostgis()
-                    successList.append(dbName)
-            except Exception as e:
-                exceptionDict[dbName] =  ':'.join(e.args)
-        return successList, exceptionDict
+        dbNameList = list(dbList)
+        for templateName in ['template_edgv_213', 'template_edgv_fter_2a_ed', 'template_edgv_3']:
+            if templateName not in dbNameList:
+                dbNameList.append(templateName)
+        def upgradePostgis(abstractDb, dbName):
+            if abstractDb.checkIfTemplate(dbName):
+                abstractDb.setDbAsTemplate(dbName = dbName, setTemplate = False)
+                abstractDb.upgradePostgis()
+                abstractDb.setDbAsTemplate(dbName = dbName, setTemplate = True)
+            else:
+                abstractDb.upgradePostgis()
+        return self.runBatchOperation(dbNameList, upgradePostgis, self.tr('Upgrading PostGIS...'))
 
     def batchDropDbs(self, dbList):
-        exceptionDict = dict()
-        successList = []
-        dbsDict = self.instantiateAbstractDbs()
-        self.closeAbstractDbs(dbsDict)
-        for dbName in dbList:
-            try:
-                self.serverWidget.abstractDb.dropDatabase(dbName)
-                successList.append(dbName)
-            except Exception as e:
-                exceptionDict[dbName] =  ':'.join(e.args)
-        return successList, exceptionDict
+        # a database cannot be dropped through a connection to itself
+        connectionDb = self.serverWidget.abstractDb.db.databaseName()
+        def dropDatabase(abstractDb, dbName):
+            abstractDb.dropDatabase(dbName)
+        return self.runBatchOperation(dbList, dropDatabase, self.tr('Dropping databases...'), connectionDb = connectionDb)
     
     @pyqtSlot(bool)
     def on_importStylesPushButton_clicked(self):
@@ -234,9 +258,7 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
         selectedStyles = dlg.selectedStyles
         if not selectedStyles:
             return
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         successList, exceptionDict = self.batchImportStyles(dbsDict, styleDir, selectedStyles, versionList[0])
-        QApplication.restoreOverrideCursor()
         header = self.tr('Import operation complete. \n')
         self.outputMessage(header, successList, exceptionDict)
         self.populateStylesInterface()
@@ -260,29 +282,21 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
         return styleList
     
     def batchImportStyles(self, dbsDict, styleDir, styleList, version):
-        exceptionDict = dict()
-        successList = []
-        for dbName in dbsDict.keys():
+        # style folders are checked once, on the interface thread
+        invalidStyleDict = dict()
+        for style in styleList:
+            currentStyleFilesDir = "{0}/{1}".format(styleDir, style.split("/")[1])
+            fileList = os.listdir(currentStyleFilesDir)
+            # iterate over the list of files and check if there are non-QML files
+            onlyQml = bool(sum([int(".qml" in file.lower()) for file in fileList]))
+            if not onlyQml:
+                invalidStyleDict[style] = self.tr("There are non-QML files in directory {0}.").format(currentStyleFilesDir)
+        def importStyles(abstractDb, dbName):
             for style in styleList:
-                currentStyleFilesDir = "{0}/{1}".format(styleDir, style.split("/")[1])
-                fileList = os.listdir(currentStyleFilesDir)
-                # iterate over the list of files and check if there are non-QML files
-                onlyQml = bool(sum([int(".qml" in file.lower()) for file in fileList]))
-                try:
-                    if not onlyQml:
-                        raise Exception(self.tr("There are non-QML files in directory {0}.").format(currentStyleFilesDir))
-                    dbsDict[dbName].importStylesIntoDb(style)
-                    successList.append(dbName)
-                except Exception as e:
-                    errors = []
-                    for arg in e.args:
-                        if isinstance(arg, basestring):
-                            s = '{}'.format(arg.encode('utf-8'))
-                        else:
-                            s = str(arg)
-                        errors.append(s)
-                    exceptionDict[dbName] =  ':'.join(errors)
-        return successList, exceptionDict
+                if style in invalidStyleDict:
+                    raise Exception(invalidStyleDict[style])
+                abstractDb.importStylesIntoDb(style)
+        return self.runBatchOperation(dbsDict.keys(), importStyles, self.tr('Importing styles...'))
     
     def getStyleDir(self, versionList):
         currentPath = os.path.join(os.path.dirname(__file__),'..','Styles', self.serverWidget.abstractDb.versionFolderDict[versionList[0]])
@@ -345,9 +359,7 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
             return
         else:
             removeStyleDict = { style : styleDict[style] for style in selectedStyles }
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         successList, exceptionDict = self.batchDeleteStyles(dbsDict, removeStyleDict)
-        QApplication.restoreOverrideCursor()
         header = self.tr('Delete operation complete. \n')
         self.outputMessage(header, successList, exceptionDict)
         self.populateStylesInterface()
@@ -355,16 +367,17 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
         self.logInternalError(closeExceptionDict)       
     
     def batchDeleteStyles(self, dbsDict, styleDict):
-        exceptionDict = dict()
-        successList = []
+        # styles are grouped by database, so each database is handled by a single worker
+        dbStyleDict = dict()
         for style in styleDict.keys():
             for dbName in styleDict[style].keys():
-                try:
-                    dbsDict[dbName].deleteStyle(style)
-                    successList.append(dbName)
-                except Exception as e:
-                    exceptionDict[dbName] =  ':'.join(e.args)
-        return successList, exceptionDict
+                if dbName not in dbStyleDict:
+                    dbStyleDict[dbName] = []
+                dbStyleDict[dbName].append(style)
+        def deleteStyles(abstractDb, dbName):
+            for style in dbStyleDict[dbName]:
+                abstractDb.deleteStyle(style)
+        return self.runBatchOperation(dbStyleDict.keys(), deleteStyles, self.tr('Deleting styles...'))
     
     def getSQLFile(self):
         fd = QFileDialog()
@@ -377,24 +390,16 @@ class BatchDbManager(QtGui.QDialog, FORM_CLASS):
         sqlFilePath = self.getSQLFile()
         if sqlFilePath == '':
             return
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         successList, exceptionDict = self.batchCustomizeFromSQLFile(dbsDict, sqlFilePath)
-        QApplication.restoreOverrideCursor()
         header = self.tr('Customize from SQL file operation complete. \n')
         self.outputMessage(header, successList, exceptionDict)
         closeExceptionDict = self.closeAbstractDbs(dbsDict)
         self.logInternalError(closeExceptionDict)
     
     def batchCustomizeFromSQLFile(self, dbsDict, sqlFilePath):
-        exceptionDict = dict()
-        successList = []
-        for dbName in dbsDict.keys():
-            try:
-                dbsDict[dbName].runSqlFromFile(sqlFilePath)
-                successList.append(dbName)
-            except Exception as e:
-                exceptionDict[dbName] =  ':'.join(e.args)
-        return successList, exceptionDict
+        def runSqlFromFile(abstractDb, dbName):
+            abstractDb.runSqlFromFile(sqlFilePath)
+        return self.runBatchOperation(dbsDict.keys(), runSqlFromFile, self.tr('Customizing databases...'))
 
     def populateOtherInterfaces(self):
         dbsDict = self.instantiateAbstractDbs()
@@ -29,6 +29,7 @@ import processing, binascii
 from collections import OrderedDict
 from DsgTools.ValidationTools.ValidationProcesses.validationProcess import ValidationProcess
 from DsgTools.GeometricTools.DsgGeometryHandler import DsgGeometryHandler
+from DsgTools.GeometricTools.DsgNetworkGraph import DsgNetworkGraph
 
 class HidrographyFlowParameters(list):
     def __init__(self, x):
@@ -95,6 +96,7 @@ class CreateNetworkNodesProcess(ValidationProcess):
                               }
             self.nodeDict = None
             self.nodeTypeDict = None
+        self.networkGraph = None
     
     def getFrameOutterBounds(self, frameLayer):
         """
@@ -131,15 +133,16 @@ class CreateNetworkNodesProcess(ValidationProcess):
     def identifyAllNodes(self, networkLayer):
         """
         Identifies all nodes from a given layer (or selected features of it). The result is returned as a dict of dict.
+        The network graph built on the way is kept as self.networkGraph.
         :param networkLayer: target layer to which nodes identification is required.
         :return: { node_id : { start : [feature_which_starts_with_node], end : feature_which_ends_with_node } }.
         """
-        nodeDict = dict()
+        self.networkGraph = DsgNetworkGraph()
         isMulti = QgsWKBTypes.isMultiType(int(networkLayer.wkbType()))
         if self.parameters['Only Selected']:
             features = networkLayer.selectedFeatures()
         else:
-            features = [feat for feat in networkLayer.getFeatures()]
+            features = networkLayer.getFeatures()
         for feat in features:
             nodes = self.DsgGeometryHandler.getFeatureNodes(networkLayer, feat)
             if nodes:
@@ -152,21 +155,11 @@ class CreateNetworkNodesProcess(ValidationProcess):
                         continue
                     else:
                         # if feat is multipart, "nodes" is a list of list
-                        nodes = nodes[0]                
-                # initial node
-                pInit, pEnd = nodes[0], nodes[-1]
-                # filling starting node information into dictionary
-                if pInit not in nodeDict:
-                    # if the point is not already started into dictionary, it creates a new item
-                    nodeDict[pInit] = { 'start' : [], 'end' : [] }
-                if feat not in nodeDict[pInit]['start']:
-                    nodeDict[pInit]['start'].append(feat)                            
-                # filling ending node information into dictionary
-                if pEnd not in nodeDict:
-                    nodeDict[pEnd] = { 'start' : [], 'end' : [] }
-                if feat not in nodeDict[pEnd]['end']:
-                    nodeDict[pEnd]['end'].append(feat)
-        return nodeDict
+                        nodes = nodes[0]
+                # initial and final nodes
+                self.networkGraph.addEdge(feat, nodes[0], nodes[-1])
+        self.networkGraph.build()
+        return self.networkGraph.getNodeDict()
 
     def changeLineDict(self, nodeList, line):
         """
@@ -189,6 +182,11 @@ class CreateNetworkNodesProcess(ValidationProcess):
             else:
                 # if line is not found for some reason
                 return False
+        if nodeList and self.networkGraph:
+            # graph edge direction is kept along with the node dict
+            edge = self.networkGraph.getEdgeId(line.id())
+            if edge is not None:
+                self.networkGraph.flipEdge(edge)
         # if a nodeList is not found, method doesn't change anything
         return bool(nodeList)
 
@@ -29,6 +29,7 @@ from PyQt4.QtCore import QVariant
 from DsgTools.ValidationTools.ValidationProcesses.validationProcess import ValidationProcess
 from DsgTools.ValidationTools.ValidationProcesses.unbuildEarthCoveragePolygonsProcess import UnbuildEarthCoveragePolygonsProcess
 from DsgTools.CustomWidgets.progressWidget import ProgressWidget
+from DsgTools.GeometricTools.DsgEndPointIndex import DsgEndPointIndex
 
 from collections import deque, OrderedDict
 
@@ -145,55 +146,22 @@ class IdentifyDanglesProcess(ValidationProcess):
                 featureList = lyr.getFeatures()
                 size = len(lyr.allFeatureIds())
         localProgress = ProgressWidget(1, size, self.tr('Building search structure for {0}.{1}').format(tableSchema,tableName), parent=self.iface.mapCanvas())
-        # start and end points dict
-        endVerticesDict = {}
+        # start and end points index
+        endVerticesDict = DsgEndPointIndex()
         # iterating over features to store start and end points
         for feat in featureList:
-            geom = feat.geometry()
-            if geom.isMultipart():
-                multiLine = geom.asMultiPolyline()
-                for j in xrange(len(multiLine)):
-                    line = multiLine[j]
-                    startPoint = line[0]
-                    endPoint = line[len(line) - 1]
-                    # storing start point in the dict
-                    if startPoint not in endVerticesDict.keys():
-                        endVerticesDict[startPoint] = []
-                    endVerticesDict[startPoint].append(feat.id())
-                    # storing end point in the dict
-                    if endPoint not in endVerticesDict.keys():
-                        endVerticesDict[endPoint] = []
-                    endVerticesDict[endPoint].append(feat.id())
-            else:
-                line = geom.asPolyline()
-                startPoint = line[0]
-                endPoint = line[len(line) - 1]
-                # storing start point in the dict
-                if startPoint not in endVerticesDict.keys():
-                    endVerticesDict[startPoint] = []
-                endVerticesDict[startPoint].append(feat.id())
-                # storing end point in the dict
-                if endPoint not in endVerticesDict.keys():
-                    endVerticesDict[endPoint] = []
-                endVerticesDict[endPoint].append(feat.id())
+            endVerticesDict.addFeature(feat)
             localProgress.step()
         return endVerticesDict
     
     def searchDanglesOnPointDict(self, endVerticesDict, tableSchema, tableName):
         """
-        Counts the number of points on each endVerticesDict's key and returns a list of QgsPoint built from key candidate.
+        Counts the number of points on each endVerticesDict's node and returns a list of QgsPoint built from the nodes used only once.
         """
-        pointList = []
-        idList = []
-        # actual search for dangles
-        localProgress = ProgressWidget(1, len(endVerticesDict.keys()), self.tr('Searching dangles on {0}.{1}').format(tableSchema, tableName), parent=self.iface.mapCanvas())
-        for point in endVerticesDict.keys():
-            # this means we only have one occurrence of point, therefore it is a dangle
-            if len(endVerticesDict[point]) > 1:
-                localProgress.step()
-                continue
-            pointList.append(point)
-            localProgress.step()
+        localProgress = ProgressWidget(1, 1, self.tr('Searching dangles on {0}.{1}').format(tableSchema, tableName), parent=self.iface.mapCanvas())
+        # a point with only one occurrence is a dangle
+        pointList = endVerticesDict.getDanglePoints()
+        localProgress.step()
         return pointList
 
     def getCoordinateTransformer(self, inputLyr, outputLyr):
@@ -259,39 +227,31 @@ class IdentifyDanglesProcess(ValidationProcess):
         Builds buffer areas from each point and evaluates the intersecting lines. If there are more than two intersections, it is a dangle.
         """
         spatialIdx, allFeatureDict = self.buildSpatialIndexAndIdDict(filterLayer)
-        notDangleIndexList = []
-        for i in range(len(pointList)):
-            candidateCount = 0
-            qgisPoint = QgsGeometry.fromPoint(pointList[i])
+        filteredDangleList = []
+        for point in pointList:
+            qgisPoint = QgsGeometry.fromPoint(point)
             #search radius to narrow down candidates
             buffer = qgisPoint.buffer(searchRadius, -1)
-            bufferBB = buffer.boundingBox()
+            # the buffer is tested against every candidate, so it is prepared once
+            bufferEngine = QgsGeometry.createGeometryEngine(buffer.geometry())
+            bufferEngine.prepareGeometry()
             #gets candidates from spatial index
-            candidateIds = spatialIdx.intersects(bufferBB)
-            #if there is only one feat in candidateIds, that means that it is not a dangle
-            bufferCount = len([id for id in candidateIds if buffer.intersects(allFeatureDict[id].geometry())])
-            for id in candidateIds:
-                if not isRefLyr:
-                    if buffer.intersects(allFeatureDict[id].geometry()) and \
-                    qgisPoint.distance(allFeatureDict[id].geometry()) < 10**-9: #float problem, tried with intersects and touches and did not get results
-                        notDangleIndexList.append(i)
-                        break
+            candidateIds = spatialIdx.intersects(buffer.boundingBox())
+            #single pass: buffer intersection is evaluated only once per candidate
+            intersectingGeoms = [allFeatureDict[id].geometry() for id in candidateIds if bufferEngine.intersects(allFeatureDict[id].geometry().geometry())]
+            if not isRefLyr:
+                #float problem, tried with intersects and touches and did not get results
+                isDangle = not any(qgisPoint.distance(geom) < 10**-9 for geom in intersectingGeoms)
+            else:
+                if ignoreNotSplit:
+                    #float problem, tried with intersects and touches and did not get results
+                    candidateCount = len([geom for geom in intersectingGeoms if qgisPoint.distance(geom) < 10**-9 or qgisPoint.intersects(geom)])
                 else:
-                    if ignoreNotSplit:
-                        if buffer.intersects(allFeatureDict[id].geometry()) and \
-                        (qgisPoint.distance(allFeatureDict[id].geometry()) < 10**-9 or \
-                        qgisPoint.intersects(allFeatureDict[id].geometry())): #float problem, tried with intersects and touches and did not get results
-                            candidateCount += 1
-                    else:
-                        if buffer.intersects(allFeatureDict[id].geometry()) and \
-                        (qgisPoint.touches(allFeatureDict[id].geometry())): #float problem, tried with intersects and touches and did not get results
-                            candidateCount += 1
-                    if candidateCount == bufferCount:
-                        notDangleIndexList.append(i)
-        filteredDangleList = []
-        for i in range(len(pointList)):
-            if i not in notDangleIndexList:
-                filteredDangleList.append(pointList[i])
+                    candidateCount = len([geom for geom in intersectingGeoms if qgisPoint.touches(geom)])
+                #if every line that reaches the buffer touches the point, it is not a dangle
+                isDangle = len(candidateIds) == 0 or candidateCount != len(intersectingGeoms)
+            if isDangle:
+                filteredDangleList.append(point)
         return filteredDangleList
 
     def filterPseudoDangles(self, pointList, filterLayer, searchRadius):
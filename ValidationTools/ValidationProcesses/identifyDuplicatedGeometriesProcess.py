@@ -62,14 +62,14 @@ class IdentifyDuplicatedGeometriesProcess(ValidationProcess):
                 classAndGeom = self.classesWithElemDict[key]
                 localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + classAndGeom['tableName'], parent=self.iface.mapCanvas())
                 localProgress.step()
-                processTableName, lyr, keyColumn = self.prepareExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
+                processTableName, lyr, keyColumn = self.prepareStagedExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
                 localProgress.step()
                 # running the process
                 localProgress = ProgressWidget(0, 1, self.tr('Running process for ') + classAndGeom['tableName'], parent=self.iface.mapCanvas())
                 localProgress.step()
                 duplicated = self.abstractDb.getDuplicatedGeomRecords(processTableName, classAndGeom['geom'], keyColumn)
                 localProgress.step()
-                self.abstractDb.dropTempTable(processTableName)
+                self.releaseStagedTable(processTableName)
                 # storing flags
                 if len(duplicated) > 0:
                     if classAndGeom['tableSchema'] not in ('validation'):
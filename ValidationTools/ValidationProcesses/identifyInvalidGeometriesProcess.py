@@ -69,7 +69,7 @@ class IdentifyInvalidGeometriesProcess(ValidationProcess):
                 classAndGeom = self.classesWithElemDict[key]
                 localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + classAndGeom['tableName'], parent=self.iface.mapCanvas())
                 localProgress.step()
-                processTableName, lyr, keyColumn = self.prepareExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
+                processTableName, lyr, keyColumn = self.prepareStagedExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
                 localProgress.step()
                     
                 # running the process
@@ -77,8 +77,8 @@ class IdentifyInvalidGeometriesProcess(ValidationProcess):
                 localProgress.step()
                 result = self.abstractDb.getInvalidGeomRecords(processTableName, classAndGeom['geom'], keyColumn)
                 localProgress.step()
-                # dropping temp table
-                self.abstractDb.dropTempTable(processTableName)
+                # releasing temp table
+                self.releaseStagedTable(processTableName)
                 #storing flags
                 if len(result) > 0:
                     if classAndGeom['tableSchema'] not in ('validation'):
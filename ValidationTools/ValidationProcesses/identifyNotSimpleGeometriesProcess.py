@@ -63,7 +63,7 @@ class IdentifyNotSimpleGeometriesProcess(ValidationProcess):
                 classAndGeom = self.classesWithElemDict[key]
                 localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + classAndGeom['tableName'], parent=self.iface.mapCanvas())
                 localProgress.step()
-                processTableName, lyr, keyColumn = self.prepareExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
+                processTableName, lyr, keyColumn = self.prepareStagedExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
                 localProgress.step()
                     
                 # running the process
@@ -71,8 +71,8 @@ class IdentifyNotSimpleGeometriesProcess(ValidationProcess):
                 localProgress.step()
                 result = self.abstractDb.getNotSimpleRecords(processTableName, classAndGeom['geom'], keyColumn)
                 localProgress.step()
-                # dropping temp table
-                self.abstractDb.dropTempTable(processTableName)
+                # releasing temp table
+                self.releaseStagedTable(processTableName)
                 #storing flags
                 if len(result) > 0:
                     if classAndGeom['tableSchema'] not in ('validation'):
@@ -63,7 +63,7 @@ class IdentifyVertexNearEdgeProcess(ValidationProcess):
                 classAndGeom = self.classesWithElemDict[key]
                 localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + classAndGeom['tableName'], parent=self.iface.mapCanvas())
                 localProgress.step()
-                processTableName, lyr, keyColumn = self.prepareExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
+                processTableName, lyr, keyColumn = self.prepareStagedExecution(classAndGeom, selectedFeatures = self.parameters['Only Selected'])
                 tableSchema, tableName = self.abstractDb.getTableSchema(processTableName)
                 localProgress.step()
                 
@@ -73,8 +73,8 @@ class IdentifyVertexNearEdgeProcess(ValidationProcess):
                 result = self.abstractDb.getVertexNearEdgesRecords(tableSchema, tableName, tol, classAndGeom['geom'], keyColumn, classAndGeom['geomType'])
                 localProgress.step()
                 
-                # dropping temp table
-                self.abstractDb.dropTempTable(processTableName)
+                # releasing temp table
+                self.releaseStagedTable(processTableName)
                 
                 # storing flags
                 if len(result) > 0:
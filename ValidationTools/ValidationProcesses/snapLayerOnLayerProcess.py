@@ -44,7 +44,7 @@ class SnapLayerOnLayerProcess(ValidationProcess):
                 cat, lyrName, geom, geomType, tableType = key.split(',')
                 interfaceDict[key] = {self.tr('Category'):cat, self.tr('Layer Name'):lyrName, self.tr('Geometry\nColumn'):geom, self.tr('Geometry\nType'):geomType, self.tr('Layer\nType'):tableType}
             # adjusting process parameters
-            self.parameters = {'Snap': 5.0, 'Reference and Layers': OrderedDict({'referenceDictList':{}, 'layersDictList':interfaceDict}), 'Only Selected':False}
+            self.parameters = {'Snap': 5.0, 'Reference and Layers': OrderedDict({'referenceDictList':{}, 'layersDictList':interfaceDict}), 'Only Selected':False, 'Parallel Workers':1}
 
     def execute(self):
         """
@@ -87,7 +87,10 @@ class SnapLayerOnLayerProcess(ValidationProcess):
                 features = [feature for feature in featureList]
                 self.localProgress = ProgressWidget(1, len(features) - 1, self.tr('Processing features on ') + clDict['tableName'], parent=self.iface.mapCanvas())
 
-                snappedFeatures = snapper.snapFeatures(features, tol)
+                if self.parameters['Parallel Workers'] > 1:
+                    snappedFeatures = snapper.parallelSnapFeatures(features, tol, nWorkers=self.parameters['Parallel Workers'])
+                else:
+                    snappedFeatures = snapper.snapFeatures(features, tol)
                 self.updateOriginalLayerV2(lyr, None, featureList=snappedFeatures)
                 self.logLayerTime(clDict['lyrName'])
 
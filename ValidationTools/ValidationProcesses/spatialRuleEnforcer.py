@@ -25,7 +25,7 @@ import os, binascii
 from PyQt4 import QtGui
 from PyQt4.QtCore import pyqtSlot, pyqtSignal
 
-from qgis.core import QgsMessageLog, QgsDataSourceURI, QgsGeometry, QgsFeatureRequest, QgsVectorLayerEditBuffer
+from qgis.core import QgsMessageLog, QgsDataSourceURI, QgsGeometry, QgsFeatureRequest, QgsVectorLayerEditBuffer, QgsSpatialIndex, QgsFeature
 
 from DsgTools.ValidationTools.ValidationProcesses.validationProcess import ValidationProcess
 
@@ -43,10 +43,20 @@ class SpatialRuleEnforcer(ValidationProcess):
                   7:'contains',
                   8:'overlaps',#we still must check what to do here
                   9:'overlaps'}#we still must check what to do here
-    
+
+    #this relates the QgsGeometry methods with the QgsGeometryEngine ones (used with prepared geometries)
+    enginePredicates = {'equals':'isEqual',
+                        'disjoint':'disjoint',
+                        'intersects':'intersects',
+                        'touches':'touches',
+                        'crosses':'crosses',
+                        'within':'within',
+                        'overlaps':'overlaps',
+                        'contains':'contains'}
+
     necessity = {0:True,
                  1:False}
-    
+
     def __init__(self, postgisDb, iface, instantiating=False):
         """
         Constructor
@@ -55,15 +65,32 @@ class SpatialRuleEnforcer(ValidationProcess):
         self.iface = iface
         self.rulesFile = os.path.join(os.path.dirname(__file__), '..', 'ValidationRules', 'ruleLibrary.rul')
         self.processAlias = self.tr('Spatial Rule Enforcer')
-        
+        #parsed rules, grouped by the layer that defines them, and the rules file mtime used to invalidate them
+        self.rulesDict = None
+        self.rulesMtime = None
+        #layer name (as in the canvas) -> QgsVectorLayer
+        self.layerDict = dict()
+        #layer name (as in the canvas) -> geometry column
+        self.geometryColumnDict = dict()
+        #layer name (as in the canvas) -> (QgsSpatialIndex, {featureId: QgsGeometry})
+        self.layerIndexDict = dict()
+        #flags found during the current edit command, written at once by flushFlags
+        self.pendingFlags = []
+
     def connectEditingSignals(self):
         """
         Connects all editing signals when the rule enforcer is turned on
         """
         self.abstractDb.deleteProcessFlags(self.getName()) #deleting old flags when we start the watch dog again
+        self.layerDict = dict()
+        self.geometryColumnDict = dict()
+        self.layerIndexDict = dict()
         for layer in self.iface.mapCanvas().layers():
+            self.layerDict[layer.name()] = layer
             layer.geometryChanged.connect(self.enforceSpatialRulesForChanges)
             layer.featureAdded.connect(self.enforceSpatialRulesForAddition)
+            layer.featureDeleted.connect(self.updateIndexForDeletion)
+            layer.editingStopped.connect(self.dropLayerIndex)
 
     def disconnectEditingSignals(self):
         """
@@ -72,7 +99,12 @@ class SpatialRuleEnforcer(ValidationProcess):
         for layer in self.iface.mapCanvas().layers():
             layer.geometryChanged.disconnect(self.enforceSpatialRulesForChanges)
             layer.featureAdded.disconnect(self.enforceSpatialRulesForAddition)
-            
+            layer.featureDeleted.disconnect(self.updateIndexForDeletion)
+            layer.editingStopped.disconnect(self.dropLayerIndex)
+        self.layerDict = dict()
+        self.geometryColumnDict = dict()
+        self.layerIndexDict = dict()
+
     def getFullLayerName(self, sender):
         """
         Gets the layer name as present in the rules
@@ -84,19 +116,99 @@ class SpatialRuleEnforcer(ValidationProcess):
         except:
             name = ''
         return name
-    
+
     def getLayer(self, layername):
         """
         Gets the QgsVectorLayer involved in the rule that is about to be tested
         """
+        if layername in self.layerDict:
+            return self.layerDict[layername]
         for layer in self.iface.mapCanvas().layers():
             if layer.name() == layername:
+                self.layerDict[layername] = layer
                 return layer
-            
-    def testRule(self, rule, featureId, geometry):
+
+    def getLayerGeometryColumn(self, layername):
+        """
+        Gets the geometry column of the layer, caching it by layer name
+        """
+        if layername not in self.geometryColumnDict:
+            self.geometryColumnDict[layername] = self.getGeometryColumnFromLayer(self.getLayer(layername))
+        return self.geometryColumnDict[layername]
+
+    def getLayerIndex(self, layername):
+        """
+        Gets the in-memory spatial index of the layer, building it on first use.
+        Features are read through the layer, so the edit buffer is taken into account.
+        returns (QgsSpatialIndex, {featureId: QgsGeometry})
+        """
+        if layername not in self.layerIndexDict:
+            layer = self.getLayer(layername)
+            index = QgsSpatialIndex()
+            geometryDict = dict()
+            for feature in layer.getFeatures():
+                if not feature.geometry():
+                    continue
+                geometryDict[feature.id()] = QgsGeometry(feature.geometry())
+                index.insertFeature(feature)
+            self.layerIndexDict[layername] = (index, geometryDict)
+        return self.layerIndexDict[layername]
+
+    def updateLayerIndex(self, layer, featureId, geometry):
+        """
+        Updates the geometry of featureId in the layer index, if the index was already built
+        layer: QgsVectorLayer that was edited
+        featureId: edited feature id
+        geometry: new feature geometry
+        """
+        if layer.name() not in self.layerIndexDict:
+            return
+        index, geometryDict = self.layerIndexDict[layer.name()]
+        if featureId in geometryDict:
+            index.deleteFeature(self.makeIndexFeature(featureId, geometryDict[featureId]))
+            del geometryDict[featureId]
+        if geometry:
+            geometryDict[featureId] = QgsGeometry(geometry)
+            index.insertFeature(self.makeIndexFeature(featureId, geometry))
+
+    def makeIndexFeature(self, featureId, geometry):
+        """
+        Makes a QgsFeature with id and geometry only, as required by QgsSpatialIndex
+        """
+        feature = QgsFeature(featureId)
+        feature.setGeometry(QgsGeometry(geometry))
+        return feature
+
+    @pyqtSlot(int)
+    def updateIndexForDeletion(self, featureId):
+        """
+        Slot that is activated when a feature is deleted by the user
+        """
+        layer = self.sender()
+        self.updateLayerIndex(layer, featureId, None)
+
+    @pyqtSlot()
+    def dropLayerIndex(self):
+        """
+        Slot that is activated when the user stops editing a layer.
+        Feature ids change after commit (and the buffer is discarded on rollback), so the index is rebuilt on next use.
+        """
+        layer = self.sender()
+        self.layerIndexDict.pop(layer.name(), None)
+
+    def getCandidates(self, layername, geometry):
+        """
+        Gets the features from layername whose bounding box intersect the geometry's bounding box
+        returns a list of (featureId, QgsGeometry)
+        """
+        index, geometryDict = self.getLayerIndex(layername)
+        return [(featureId, geometryDict[featureId]) for featureId in sorted(index.intersects(geometry.boundingBox()))]
+
+    def testRule(self, rule, featureId, geometry, engine = None):
         """
         Tests the rule against the geometry passed as parameter
-        """        
+        engine: prepared QgsGeometryEngine for geometry. When None, one is created here.
+        """
         layer1 = rule[0] #layer that defines the rule
         necessity = rule[1] #rule necessity
         predicate = rule[2] #spatial predicate
@@ -105,96 +217,102 @@ class SpatialRuleEnforcer(ValidationProcess):
         max_card = rule[5] #maximum cardinality
         rule = rule[6] #rule string
 
-        vectorlayer2 = self.getLayer(layer2.split('.')[-1]) #correspondent QgsVectorLayer
-        
-        method = getattr(geometry, predicate) #getting the correspondent QgsGeometry method to be used in the rule
-        
+        if engine is None:
+            engine = self.getPreparedEngine(geometry)
+
+        method = getattr(engine, self.enginePredicates[predicate]) #getting the correspondent prepared predicate to be used in the rule
+
         #querying the features that intersect the geometry's bounding box (i.e. our candidates)
-        candidatesIter = vectorlayer2.getFeatures(QgsFeatureRequest(geometry.boundingBox()))
-        
+        candidates = self.getCandidates(layer2.split('.')[-1], geometry)
+
         #first, lets separate the problem in disjoint case and not disjoint
         #case 1: disjoint
         if predicate == 'disjoint':
             disjointBroken = False
             flagData = []
             #iterating over candidates
-            for feature in candidatesIter:
+            for candidateId, candidateGeometry in candidates:
                 #for the same layer we need to avoid to test a feature against it self
-                if layer1 == layer2 and featureId == feature.id():
+                if layer1 == layer2 and featureId == candidateId:
                     continue
                 #for each one of them we must execute the method
                 #for the disjoint case one fail is sufficient to raise the flag
-                if method(feature.geometry()) != necessity:
+                if method(candidateGeometry.geometry()) != necessity:
                     disjointBroken = True
                     #storing the geometry that represents the rule violation
-                    flagData.append(self.getGeometryProblem(geometry, feature))
-            
+                    flagData.append(self.getGeometryProblem(geometry, candidateGeometry))
+
             if disjointBroken:
                 for hexa in flagData:
                     self.makeBreaksPredicateFlag(layer1, featureId, rule, layer2, hexa)
-        #case 2: not disjoint             
-        else:    
+        #case 2: not disjoint
+        else:
             #checking the rule in the case the situation above does not happen
             occurrences = 0 #number of times the rule checks out
             flagData = []
             #iterating over candidates
-            for feature in candidatesIter:
+            for candidateId, candidateGeometry in candidates:
                 #for the same layer we need to avoid to test a feature against it self
-                if layer1 == layer2 and featureId == feature.id():
+                if layer1 == layer2 and featureId == candidateId:
                     continue
                 #for each one of them we must execute the method
-                if method(feature.geometry()) == necessity:
+                if method(candidateGeometry.geometry()) == necessity:
                     #when this happens the rule is checked, but we still need to check the cardinality
                     occurrences += 1
                 else:
                     #storing the geometry that represents the rule violation
-                    flagData.append(self.getGeometryProblem(geometry, feature))
-    
+                    flagData.append(self.getGeometryProblem(geometry, candidateGeometry))
+
             # lets define when we should raise a flag from now on:
             # occurrences out of bounds.
             # We must stay like this: min_card <= occurrences <= max_card
             # there is the particular case when max_card = *, in this case we must stay like this: min_card <= occurrences
             # so, we can summarize like this:
-            
+
             #cardinality broken case
             if max_card != '*':
                 breaksCardinality = occurrences < int(min_card) or occurrences > int(max_card)
             else:
                 breaksCardinality = occurrences < int(min_card)
-    
+
             if breaksCardinality and necessity == True:
                 self.makeBreaksCardinalityFlag(layer1, featureId, rule, min_card, max_card, layer2, binascii.hexlify(geometry.asWkb()))
-    
+
             #predicate broken case
             if len(flagData) == 0:
                 breaksPredicate = False
             else:
                 breaksPredicate = True
-    
+
             #we only raise a breaksPredicate flag if flagData has elements and if occurrences = 0
             if breaksPredicate and occurrences == 0:
                 for hexa in flagData:
                     self.makeBreaksPredicateFlag(layer1, featureId, rule, layer2, hexa)
 
-        # updating flags for real time use
-        self.ruleTested.emit()
-                    
-    def getGeometryProblem(self, geometry, feature):
+    def getPreparedEngine(self, geometry):
+        """
+        Gets a prepared QgsGeometryEngine for the geometry, so that it is prepared only once for all rules and candidates
+        """
+        engine = QgsGeometry.createGeometryEngine(geometry.geometry())
+        engine.prepareGeometry()
+        return engine
+
+    def getGeometryProblem(self, geometry, candidateGeometry):
         """
         Gets geometry problems.
         When this happens the rule is broken and we need to get the geometry of the actual problem.
         geometry: geometry used during edition mode
-        feature: feature related to the geometry
+        candidateGeometry: geometry of the feature related to the geometry
         """
         #geom must be the intersection
-        geom = geometry.intersection(feature.geometry())
+        geom = geometry.intersection(candidateGeometry)
         #case the intersection is WKBUnknown or WKBNoGeometry, we should use the original geometry
         if geom.wkbType() in [0,7]:
             geom = geometry
         #hex geometry to be added as flag
         hexa = binascii.hexlify(geom.asWkb())
         return hexa
-                
+
     def makeBreaksCardinalityFlag(self, layer1, featureId, rule, min_card, max_card, layer2, hexa):
         """
         Makes a flag when the cardinality is broken
@@ -207,11 +325,10 @@ class SpatialRuleEnforcer(ValidationProcess):
         hexa: WKB geometry to be passed to the flag
         """
         #making the reason
-        vectorlayer1 = self.getLayer(layer1.split('.')[-1]) #correspondent QgsVectorLayer
-        geometryColumn = self.getGeometryColumnFromLayer(vectorlayer1)
+        geometryColumn = self.getLayerGeometryColumn(layer1.split('.')[-1])
         reason = self.tr('Feature id {0} from {1} violates cardinality {2}..{3} of rule: {4} {5}').format(featureId, layer1, min_card, max_card, rule.decode('utf-8'), layer2)
-        self.addFlag([(layer1, str(featureId), reason, hexa, geometryColumn)])
-                
+        self.pendingFlags.append((layer1, str(featureId), reason, hexa, geometryColumn))
+
     def makeBreaksPredicateFlag(self, layer1, featureId, rule, layer2, hexa):
         """
         Makes a flag when the predicate is broken
@@ -222,71 +339,87 @@ class SpatialRuleEnforcer(ValidationProcess):
         hexa: WKB geometry to be passed to the flag
         """
         #making the reason
-        vectorlayer1 = self.getLayer(layer1.split('.')[-1]) #correspondent QgsVectorLayer
-        geometryColumn = self.getGeometryColumnFromLayer(vectorlayer1)
+        geometryColumn = self.getLayerGeometryColumn(layer1.split('.')[-1])
         reason = self.tr('Feature id {0} from {1} violates rule: {2} {3}').format(featureId, layer1, rule.decode('utf-8'), layer2)
-        self.addFlag([(layer1, str(featureId), reason, hexa, geometryColumn)])
+        self.pendingFlags.append((layer1, str(featureId), reason, hexa, geometryColumn))
 
-    @pyqtSlot(int, QgsGeometry)      
-    def enforceSpatialRulesForChanges(self, featureId, geometry):
+    def flushFlags(self):
         """
-        Slot that is activated when a feature is modified by the user
+        Writes all flags found during the current edit command in a single transaction
         """
-        #layer that sent the signal
-        layer = self.sender()
+        if len(self.pendingFlags) > 0:
+            self.addFlag(self.pendingFlags)
+        self.pendingFlags = []
+        # updating flags for real time use
+        self.ruleTested.emit()
+
+    def enforceSpatialRules(self, layer, featureId, geometry):
+        """
+        Tests all rules defined for the layer against the edited geometry and writes the flags found
+        layer: QgsVectorLayer that was edited
+        featureId: edited feature id
+        geometry: edited feature geometry
+        """
+        #keeping the layer index in sync with the edition before testing
+        self.updateLayerIndex(layer, featureId, geometry)
         #layer name as present in the rules
         layername = self.getFullLayerName(layer)
         #rules involving the layer
         rules = self.getRules(layername)
         #removing old flags for this featureId
         self.removeFeatureFlags(layername, featureId)
-        # for each rule we must test what is happening
-        for rule in rules:
-            self.testRule(rule, featureId, geometry) #actual test
+        if rules and geometry:
+            #the edited geometry is prepared once and used by every rule
+            engine = self.getPreparedEngine(geometry)
+            # for each rule we must test what is happening
+            for rule in rules:
+                self.testRule(rule, featureId, geometry, engine) #actual test
+        self.flushFlags()
         self.iface.mapCanvas().refresh()
         for lyr in self.iface.mapCanvas().layers():
             lyr.triggerRepaint()
 
-    @pyqtSlot(int)      
+    @pyqtSlot(int, QgsGeometry)
+    def enforceSpatialRulesForChanges(self, featureId, geometry):
+        """
+        Slot that is activated when a feature is modified by the user
+        """
+        #layer that sent the signal
+        layer = self.sender()
+        self.enforceSpatialRules(layer, featureId, geometry)
+
+    @pyqtSlot(int)
     def enforceSpatialRulesForAddition(self, featureId):
         """
         Slot that is activated when a feature is added by the user
         """
         #layer that sent the signal
         layer = self.sender()
-        #layer name as present in the rules
-        layername = self.getFullLayerName(layer)
-        #rules involving the layer
-        rules = self.getRules(layername)
-        #removing old flags for this featureId
-        self.removeFeatureFlags(layername, featureId)
-        # for each rule we must test what is happening
+        #just checking the newly added feature, the other were already tested
         features = layer.editBuffer().addedFeatures()
-        for key in features.keys():
-            #just checking the newly added feature, the other were already tested
-            if key != featureId:
-                continue
-            for rule in rules:
-                self.testRule(rule, featureId, features[featureId].geometry()) #actual test
-        self.iface.mapCanvas().refresh()
-        for lyr in self.iface.mapCanvas().layers():
-            lyr.triggerRepaint()        
-                
-    def getRules(self, layerName):
+        if featureId not in features:
+            return
+        self.enforceSpatialRules(layer, featureId, features[featureId].geometry())
+
+    def loadRules(self):
         """
-        Get a list of tuples (rules) using the configuration file
+        Parses the configuration file into a dict {layer1: [rules]}.
+        The parsed rules are kept until the file modification time changes.
         """
         try:
+            mtime = os.path.getmtime(self.rulesFile)
+            if self.rulesDict is not None and mtime == self.rulesMtime:
+                return self.rulesDict
             with open(self.rulesFile, 'r') as f:
                 rules = [line.rstrip('\n') for line in f]
         except Exception as e:
-            QtGui.QMessageBox.warning(self, self.tr('Warning!'), self.tr('Problem reading file!'))
+            QtGui.QMessageBox.warning(None, self.tr('Warning!'), self.tr('Problem reading file!'))
             return
-        
-        ret = list()
+
+        rulesDict = dict()
         for line in rules:
             split = line.split(',')
-            layer1 = split[0]    
+            layer1 = split[0]
             necessity = self.necessity[int(split[1].split('_')[0])]
             predicate = self.predicates[int(split[2].split('_')[0])]
             layer2 = split[3]
@@ -294,7 +427,18 @@ class SpatialRuleEnforcer(ValidationProcess):
             min_card = cardinality.split('..')[0]
             max_card = cardinality.split('..')[1]
             rule = split[1]+' '+split[2]
-            if layer1 == layerName:
-                ret.append((layer1, necessity, predicate, layer2, min_card, max_card, rule))
-            
-        return ret
+            if layer1 not in rulesDict:
+                rulesDict[layer1] = []
+            rulesDict[layer1].append((layer1, necessity, predicate, layer2, min_card, max_card, rule))
+        self.rulesDict = rulesDict
+        self.rulesMtime = mtime
+        return self.rulesDict
+
+    def getRules(self, layerName):
+        """
+        Get a list of tuples (rules) using the configuration file
+        """
+        rulesDict = self.loadRules()
+        if rulesDict is None:
+            return
+        return rulesDict.get(layerName, [])
@@ -95,39 +95,54 @@ class SpatialRuleProcess(ValidationProcess):
             self.abstractDb.deleteProcessFlags(self.getName())
             
             rules = self.getRules()
-            for rule in rules:
-                # preparation
-                localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + rule[0], parent=self.iface.mapCanvas())
-                localProgress.step()
-                class_a, lyrA, aKeyColumn = self.prepareExecution(rule[0])
-                class_b, lyrB, bKeyColumn = self.prepareExecution(rule[3])
-                # getting keyColumn because we want to be generic
-                aGeomColumn = self.getGeometryColumnFromLayer(lyrA)
-                bGeomColumn = self.getGeometryColumnFromLayer(lyrB)
-                localProgress.step()
+            # each class is staged once per run, even when it is used by several rules
+            stagedDict = dict()
+            try:
+                for rule in rules:
+                    # preparation
+                    localProgress = ProgressWidget(0, 1, self.tr('Preparing execution for ') + rule[0], parent=self.iface.mapCanvas())
+                    localProgress.step()
+                    class_a, lyrA, aKeyColumn, aGeomColumn = self.stageClass(rule[0], stagedDict)
+                    class_b, lyrB, bKeyColumn, bGeomColumn = self.stageClass(rule[3], stagedDict)
+                    localProgress.step()
 
-                #running the process in the temp table
-                localProgress = ProgressWidget(0, 1, self.tr('Running process on ') + class_a, parent=self.iface.mapCanvas())
-                localProgress.step()
-                invalidGeomRecordList = self.abstractDb.testSpatialRule(class_a, rule[1], rule[2], class_b, rule[4], rule[5], rule[6], aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn)
-                localProgress.step()
-                                
-                # dropping temp table
-                self.abstractDb.dropTempTable(class_a)
-                self.abstractDb.dropTempTable(class_b)
-
-                if len(invalidGeomRecordList) > 0:
-                    numberOfInvGeom = self.addFlag(invalidGeomRecordList)
-                    for tuple in invalidGeomRecordList:
-                        self.addClassesToBeDisplayedList(tuple[0])
-                    msg = str(numberOfInvGeom) + self.tr(' features are invalid. Check flags.')
-                    self.setStatus(msg, 4) #Finished with flags
-                else:
-                    msg = self.tr('All features are valid.')
-                    self.setStatus(msg, 1) #Finished
+                    #running the process in the temp table
+                    localProgress = ProgressWidget(0, 1, self.tr('Running process on ') + class_a, parent=self.iface.mapCanvas())
+                    localProgress.step()
+                    invalidGeomRecordList = self.abstractDb.testSpatialRule(class_a, rule[1], rule[2], class_b, rule[4], rule[5], rule[6], aKeyColumn, bKeyColumn, aGeomColumn, bGeomColumn)
+                    localProgress.step()
+                    self.storeRuleFlags(invalidGeomRecordList)
+            finally:
+                # releasing temp tables
+                for processTableName, lyr, keyColumn, geomColumn in stagedDict.values():
+                    self.releaseStagedTable(processTableName)
             return 1             
         except Exception as e:
             QgsMessageLog.logMessage(':'.join(e.args), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
             self.finishedWithError()
             return 0
 
+    def stageClass(self, cl, stagedDict):
+        """
+        Stages a class for this run, reusing it when it was already staged
+        cl: class name (schema.table)
+        stagedDict: dict {class name: (temp table name, layer, key column, geometry column)} of the classes staged in this run
+        """
+        if cl not in stagedDict:
+            processTableName, lyr, keyColumn = self.prepareStagedExecution(cl)
+            stagedDict[cl] = (processTableName, lyr, keyColumn, self.getGeometryColumnFromLayer(lyr))
+        return stagedDict[cl]
+
+    def storeRuleFlags(self, invalidGeomRecordList):
+        """
+        Stores the flags of a rule and updates the process status
+        """
+        if len(invalidGeomRecordList) > 0:
+            numberOfInvGeom = self.addFlag(invalidGeomRecordList)
+            for tuple in invalidGeomRecordList:
+                self.addClassesToBeDisplayedList(tuple[0])
+            msg = str(numberOfInvGeom) + self.tr(' features are invalid. Check flags.')
+            self.setStatus(msg, 4) #Finished with flags
+        else:
+            msg = self.tr('All features are valid.')
+            self.setStatus(msg, 1) #Finished
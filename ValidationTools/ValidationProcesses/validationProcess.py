@@ -56,6 +56,10 @@ class ValidationProcess(QObject):
         self.dbUserName = None
         self.logMsg = None
         self.processName = None
+        self.stagingCache = None
+        # { layer name : { 'features' : number of staged features, 'elapsedTime' : seconds } }
+        self.layerMetricDict = dict()
+        self.runMetrics = None
     
     def getFlagLyr(self, dimension):
         if dimension == 0:
@@ -78,6 +82,12 @@ class ValidationProcess(QObject):
         """
         self.dbUserName = userName
 
+    def setStagingCache(self, stagingCache):
+        """
+        Sets the session cache of staged tables (StagingCache) shared by the processes.
+        """
+        self.stagingCache = stagingCache
+
     def setParameters(self, params):
         """
         Define the process parameteres
@@ -189,13 +199,15 @@ class ValidationProcess(QObject):
         msg: Status text message
         """
         try:
+            metrics = None
             if status not in [0,3]: # neither running nor instatiating status should be logged
                 self.logProcess()
                 if self.logMsg:
                     msg += "\n" + self.logMsg
                 elif not self.dbUserName:
                     msg += self.tr("Database username: {}\n").format(self.abstractDb.db.userName())
-            self.abstractDb.setValidationProcessStatus(self.getName(), msg, status)
+                metrics = self.runMetrics
+            self.abstractDb.setValidationProcessStatus(self.getName(), msg, status, metrics)
         except Exception as e:
             QMessageBox.critical(None, self.tr('Critical!'), self.tr('A problem occurred! Check log for details.'))
             QgsMessageLog.logMessage(':'.join(e.args), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
@@ -303,11 +315,13 @@ class ValidationProcess(QObject):
         #removing features from the layer.
         pgInputLayer.deleteFeatures(idsToRemove)
 
-    def updateOriginalLayerV2(self, pgInputLayer, qgisOutputVector, featureList=None, featureTupleList=None, deleteFeatures = True):
+    def updateOriginalLayerV2(self, pgInputLayer, qgisOutputVector, featureList=None, featureTupleList=None, deleteFeatures = True, useProvider = False):
         """
         Updates the original layer using the grass output layer
         pgInputLyr: postgis input layer
         qgisOutputVector: qgis output layer
+        useProvider: if the layer is not being edited, writes the changes straight to the data provider in bulk
+        instead of leaving them in the edit buffer
         Speed up tips: http://nyalldawson.net/2016/10/speeding-up-your-pyqgis-scripts/
         1- Make pgIdList, by querying it with flag QgsFeatureRequest.NoGeometry
         2- Build output dict
@@ -317,11 +331,14 @@ class ValidationProcess(QObject):
         # getting keyColumn because we want to be generic
         uri = QgsDataSourceURI(pgInputLayer.dataProvider().dataSourceUri())
         keyColumn = uri.keyColumn()
-        # starting edition mode
-        pgInputLayer.startEditing()
-        pgInputLayer.beginEditCommand('Updating layer')
+        useProvider = useProvider and not pgInputLayer.isEditable()
+        if not useProvider:
+            # starting edition mode
+            pgInputLayer.startEditing()
+            pgInputLayer.beginEditCommand('Updating layer')
         addList = []
-        idsToRemove = []
+        idsToRemove = set()
+        geometryMap = dict()
         inputDict = dict()
         #this is done to work generically with output layers that are implemented different from ours
         isMulti = QgsWKBTypes.isMultiType(int(pgInputLayer.wkbType())) #
@@ -332,18 +349,19 @@ class ValidationProcess(QObject):
             inputDict[feature.id()] = dict()
             inputDict[feature.id()]['featList'] = []
             inputDict[feature.id()]['featWithoutGeom'] = feature
-        inputDictKeys = inputDict.keys()
+        # grouping the output features by feature id in a single pass, membership is tested on the dict
         if qgisOutputVector:
             for feat in qgisOutputVector.dataProvider().getFeatures():
                 if keyColumn == '':
                     featid = feat.id()
                 else:
                     featid = feat[keyColumn]
-                if featid in inputDictKeys: #verificar quando keyColumn = ''
+                if featid in inputDict: #verificar quando keyColumn = ''
                     inputDict[featid]['featList'].append(feat)
         elif featureTupleList:
+            classname = pgInputLayer.name()
             for gfid, gf in featureTupleList:
-                if gfid in inputDictKeys and gf['classname'] == pgInputLayer.name():
+                if gfid in inputDict and gf['classname'] == classname:
                     inputDict[gfid]['featList'].append(gf)
         else:
             for feat in featureList:
@@ -351,10 +369,10 @@ class ValidationProcess(QObject):
                     featid = feat.id()
                 else:
                     featid = feat[keyColumn]
-                if featid in inputDictKeys:
+                if featid in inputDict:
                     inputDict[featid]['featList'].append(feat)
         #finally, do what must be done
-        for id in inputDictKeys:
+        for id in inputDict:
             outFeats = inputDict[id]['featList']
             #starting to make changes
             for i in range(len(outFeats)):
@@ -364,10 +382,9 @@ class ValidationProcess(QObject):
                     if newGeom:
                         if isMulti:
                             newGeom.convertToMultiType()
-                        pgInputLayer.changeGeometry(id, newGeom) #It is faster according to the api
+                        geometryMap[id] = QgsGeometry(newGeom)
                     else:
-                        if id not in idsToRemove:
-                            idsToRemove.append(id)
+                        idsToRemove.add(id)
                 else:
                     #for the rest, let's add them
                     newFeat = QgsFeature(inputDict[id]['featWithoutGeom'])
@@ -381,15 +398,26 @@ class ValidationProcess(QObject):
                             newFeat.setAttribute(idx, provider.defaultValue(idx))
                         addList.append(newFeat)
                     else:
-                        if id not in idsToRemove:
-                            idsToRemove.append(id)
+                        idsToRemove.add(id)
             #in the case we don't find features in the output we should mark them to be removed
             if len(outFeats) == 0 and deleteFeatures:
-                idsToRemove.append(id)
+                idsToRemove.add(id)
+        # features that will be removed don't need their geometries changed
+        for id in idsToRemove:
+            geometryMap.pop(id, None)
+        if useProvider:
+            #writing everything in bulk straight to the provider
+            provider.changeGeometryValues(geometryMap)
+            provider.addFeatures(addList)
+            provider.deleteFeatures(list(idsToRemove))
+            pgInputLayer.triggerRepaint()
+            return
+        for id, newGeom in geometryMap.iteritems():
+            pgInputLayer.changeGeometry(id, newGeom) #It is faster according to the api
         #pushing the changes into the edit buffer
         pgInputLayer.addFeatures(addList, True)
         #removing features from the layer.
-        pgInputLayer.deleteFeatures(idsToRemove)
+        pgInputLayer.deleteFeatures(list(idsToRemove))
         pgInputLayer.endEditCommand()
 
     def getProcessingErrors(self, layer):
@@ -428,8 +456,11 @@ class ValidationProcess(QObject):
         # getting keyColumn because we want to be generic
         uri = QgsDataSourceURI(lyr.dataProvider().dataSourceUri())
         keyColumn = uri.keyColumn()
-        #getting feature map including the edit buffer
-        featureMap = self.mapInputLayer(lyr, selectedFeatures = selectedFeatures)
+        #getting features including the edit buffer, they are streamed into the temp table
+        if selectedFeatures:
+            featureIterator = lyr.getFeatures(QgsFeatureRequest().setFilterFids(lyr.selectedFeaturesIds()))
+        else:
+            featureIterator = lyr.getFeatures()
         #getting table name with schema
         if isinstance(cl, dict):
             tableSchema = cl['tableSchema']
@@ -442,12 +473,50 @@ class ValidationProcess(QObject):
 
         #setting temp table name
         processTableName = fullTableName+'_temp'
+        if self.stagingCache:
+            #the temp table is going to be rewritten, so it is not a staged copy anymore
+            self.stagingCache.discard(processTableName)
         # specific EPSG search
         parameters = {'tableSchema':tableSchema, 'tableName':tableName, 'geometryColumn':geometryColumn}
         srid = self.abstractDb.findEPSG(parameters=parameters)
         #creating temp table
-        self.abstractDb.createAndPopulateTempTableFromMap(fullTableName, featureMap, geometryColumn, keyColumn, srid)
+        rowCount, rowsPerSecond = self.abstractDb.createAndPopulateTempTableFromIterator(fullTableName, featureIterator, geometryColumn, keyColumn, srid)
+        QgsMessageLog.logMessage(self.tr('{0} features from {1} loaded into temp table ({2:.0f} rows/s).').format(rowCount, fullTableName, rowsPerSecond), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
+        self.addLayerMetric(fullTableName, 'features', rowCount)
+        return processTableName, lyr, keyColumn
+
+    def prepareStagedExecution(self, cl, geometryColumn='geom', selectedFeatures = False):
+        """
+        Read-only version of prepareExecution. The temp table is taken from the session staging cache
+        when it already holds the current state of the layer, otherwise it is staged and cached.
+        The returned table must not be modified and must be released with releaseStagedTable.
+        cl: table name
+        """
+        if not self.stagingCache:
+            return self.prepareExecution(cl, geometryColumn=geometryColumn, selectedFeatures=selectedFeatures)
+        if isinstance(cl, dict):
+            geometryColumn = cl['geom']
+            processTableName = '''{0}.{1}_temp'''.format(cl['tableSchema'], cl['tableName'])
+        else:
+            processTableName = cl+'_temp'
+        lyr = self.loadLayerBeforeValidationProcess(cl)
+        entry = self.stagingCache.getEntry(processTableName, lyr, geometryColumn, selectedFeatures)
+        if entry is not None:
+            QgsMessageLog.logMessage(self.tr('Reusing staged temp table {0}.').format(processTableName), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
+            self.addLayerMetric(processTableName[:-len('_temp')], 'features', entry['rowCount'])
+            return processTableName, lyr, entry['keyColumn']
+        processTableName, lyr, keyColumn = self.prepareExecution(cl, geometryColumn=geometryColumn, selectedFeatures=selectedFeatures)
+        rowCount = self.layerMetricDict[processTableName[:-len('_temp')]]['features']
+        self.stagingCache.register(processTableName, lyr, geometryColumn, selectedFeatures, keyColumn, rowCount)
         return processTableName, lyr, keyColumn
+
+    def releaseStagedTable(self, processTableName):
+        """
+        Releases a table got from prepareStagedExecution. Cached tables are kept for the next processes,
+        they are dropped by the staging cache.
+        """
+        if not self.stagingCache:
+            self.abstractDb.dropTempTable(processTableName)
     
     def postProcessSteps(self, processTableName, lyr):
         """
@@ -589,9 +658,13 @@ class ValidationProcess(QObject):
         """
         Updates all original layers making requests with the class name
         """
+        # grouping the output by class name in a single pass over the unified layer
+        tuppleDict = dict()
+        for feature in outputLayer.getFeatures():
+            tuppleDict.setdefault(feature['classname'], []).append((feature['featid'], feature))
         for layer in layerList:
             classname = layer.name()
-            tupplelist = [(feature['featid'], feature) for feature in outputLayer.getFeatures() if feature['classname'] == classname]
+            tupplelist = tuppleDict.get(classname, [])
             self.updateOriginalLayerV2(layer, None, featureTupleList=tupplelist)
 
     def getGeometryColumnFromLayer(self, layer):
@@ -612,9 +685,19 @@ class ValidationProcess(QObject):
                 self.totalTime += elapsedTime
         return elapsedTime
 
+    def addLayerMetric(self, lyr, metric, value):
+        """
+        Accumulates a metric of a layer for this run, recorded in the process history by setStatus
+        lyr: layer name (schema.table)
+        metric: 'features' or 'elapsedTime'
+        """
+        layerMetrics = self.layerMetricDict.setdefault(lyr, {'features' : 0, 'elapsedTime' : 0.0})
+        layerMetrics[metric] += value
+
     def logLayerTime(self, lyr):
         time = self.endTimeCount()
         if self.startTime != 0 and self.endTime != 0:
+            self.addLayerMetric(lyr, 'elapsedTime', time.total_seconds())
             QgsMessageLog.logMessage(self.tr('Elapsed time for process {0} on layer {1}: {2}').format(self.processAlias, lyr, str(time)), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
 
     def logTotalTime(self):
@@ -653,8 +736,9 @@ class ValidationProcess(QObject):
         else:
             logMsg += self.tr("\nUnable to get database parameters for process {}.").format(self.processAlias)
         # logging #Flag
-        logMsg += self.tr("\nNumber of flags raised by the process: {}").format(\
-                        str(self.abstractDb.getNumberOfFlagsByProcess(self.processName)))
+        flagStatistics = self.abstractDb.getFlagStatistics(processName=self.processName)
+        flagsRaised = sum(flagStatistics.values())
+        logMsg += self.tr("\nNumber of flags raised by the process: {}").format(str(flagsRaised))
         # logging total time elapsed
         self.endTimeCount()
         if self.totalTime:
@@ -662,8 +746,24 @@ class ValidationProcess(QObject):
         else:
             logMsg += self.tr("\nUnable to get total elapsed time.")
         self.logMsg = logMsg
+        self.runMetrics = self.getRunMetrics(flagStatistics)
         QgsMessageLog.logMessage(logMsg, "DSG Tools Plugin", QgsMessageLog.CRITICAL)
 
+    def getRunMetrics(self, flagStatistics):
+        """
+        Gets the metrics of this run recorded in the process history
+        flagStatistics: flags of the process, as given by getFlagStatistics
+        """
+        layerMetricDict = dict()
+        for lyr, layerMetrics in self.layerMetricDict.iteritems():
+            layerMetricDict[lyr] = dict(layerMetrics, flags = 0)
+        for (processName, lyr, dimension), count in flagStatistics.iteritems():
+            layerMetricDict.setdefault(lyr, {'features' : 0, 'elapsedTime' : 0.0, 'flags' : 0})['flags'] += count
+        return {'featuresScanned' : sum([layerMetrics['features'] for layerMetrics in layerMetricDict.values()]),
+                'flagsRaised' : sum(flagStatistics.values()),
+                'elapsedTime' : self.totalTime.total_seconds() if self.totalTime else 0.0,
+                'layerMetrics' : json.dumps(layerMetricDict, sort_keys=True)}
+
     def raiseVectorFlags(self, flagLyr, featFlagList):
         flagLyr.startEditing()
         flagLyr.beginEditCommand('Raising flags') #speedup
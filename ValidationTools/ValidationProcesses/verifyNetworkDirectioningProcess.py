@@ -43,6 +43,7 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
         self.processAlias = self.tr('Verify Network Directioning')
         self.canvas = self.iface.mapCanvas()
         self.DsgGeometryHandler = DsgGeometryHandler(iface)
+        self.networkGraph = None
         if not self.instantiating:
             # get an instance of network node creation method class object
             self.createNetworkNodesProcess = CreateNetworkNodesProcess(postgisDb=postgisDb, iface=iface, instantiating=True)
@@ -437,6 +438,11 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
         :param networkLayer: (QgsVectorLayer) hidrography line layer.
         :return: (list-of-QgsPoint) a list of the other node of lines connected to given hidrography node.
         """
+        if self.networkGraph:
+            # next nodes do not depend on lines direction, so the graph incidence is enough
+            nodeId = self.networkGraph.getNodeId(node)
+            if nodeId is not None:
+                return [self.networkGraph.getNodePoint(n) for n in self.networkGraph.getNeighbours(nodeId)]
         if not geomType:
             geomType = networkLayer.geometryType()
         nextNodes = []
@@ -533,15 +539,23 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
                 return None, None, self.tr("No network starting point was found")
         # to avoid unnecessary calculations
         geomType = networkLayer.geometryType()
-        # initiating the list of nodes already checked and the list of nodes to be checked next iteration
-        visitedNodes, newNextNodes = [], []
+        graph = self.networkGraph
+        # network is visited breadth-first over graph node ids, starting from the nodes given
+        nodeList = sorted(set(graph.getNodeId(node) for node in nodeList) - set([None]))
+        # initiating the set of nodes already checked
+        visitedNodes = set()
         nodeFlags = dict()
         # starting dict of (in)valid lines to be returned by the end of method
         validLines, invalidLines = dict(), dict()
+        # set of valid lines, updated along with validLines
+        validLinesSet = set()
         # initiate relation of modified features
         flippedLinesIds, mergedLinesString = [], ""
         while nodeList:
-            for node in nodeList:
+            # nodes to be checked next iteration
+            newNextNodes = set()
+            for nodeId in nodeList:
+                node = graph.getNodePoint(nodeId)
                 # first thing to be done: check if there are more than one non-validated line (hence, enough information for a decision)
                 if node in self.nodeDict:
                     startLines = self.nodeDict[node]['start']
@@ -552,19 +566,18 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
                         self.reclassifyNodeType[node] = self.nodeTypeDict[node]
                 else:
                     # ignore node for possible next iterations by adding it to visited nodes
-                    visitedNodes.append(node)
+                    visitedNodes.add(nodeId)
                     continue
-                nodeLines = startLines + endLines
-                validLinesList = validLines.values()
-                if len(set(nodeLines) - set(validLinesList)) > 1:
-                    hasStartCondition, flippedLines = self.checkForStartConditions(node=node, validLines=validLinesList, networkLayer=networkLayer, nodeLayer=nodeLayer, geomType=geomType)
+                nodeLines = set(startLines + endLines)
+                if len(nodeLines - validLinesSet) > 1:
+                    hasStartCondition, flippedLines = self.checkForStartConditions(node=node, validLines=validLinesSet, networkLayer=networkLayer, nodeLayer=nodeLayer, geomType=geomType)
                     if hasStartCondition:
                         flippedLinesIds += flippedLines
                     else:
                         # if it is not connected to a start condition, check if node has a valid line connected to it
-                        if (set(nodeLines) & set(validLinesList)):
+                        if nodeLines & validLinesSet:
                             # if it does and, check if it is a valid node
-                            val, inval, reason = self.checkNodeValidity(node=node, connectedValidLines=validLinesList,\
+                            val, inval, reason = self.checkNodeValidity(node=node, connectedValidLines=validLinesSet,\
                                                                         networkLayer=networkLayer, deltaLinesCheckList=deltaLinesCheckList, geomType=geomType)
                             # if node has a valid line connected to it and it is valid, then non-validated lines are proven to be in conformity to
                             # start conditions, then they should be validated and node should be set as visited
@@ -573,16 +586,16 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
                             # node will neither be checked nor marked as visited
                                 continue
                 # check coherence to node type and waterway flow
-                val, inval, reason = self.checkNodeValidity(node=node, connectedValidLines=validLinesList,\
+                val, inval, reason = self.checkNodeValidity(node=node, connectedValidLines=validLinesSet,\
                                                             networkLayer=networkLayer, deltaLinesCheckList=deltaLinesCheckList, geomType=geomType)
                 # nodes to be removed from next nodes
-                removeNode = []
+                removeNode = set()
                 # if a reason is given, then node is invalid (even if there are no invalid lines connected to it).
                 if reason:
                     # try to fix node issues
                     # note that val, inval and reason MAY BE MODIFIED - and there is no problem...
                     flippedLinesIds_, mergedLinesString_ = self.fixNodeFlagsNew(node=node, valDict=val, invalidDict=inval, reason=reason, \
-                                                                            connectedValidLines=validLinesList, networkLayer=networkLayer, \
+                                                                            connectedValidLines=validLinesSet, networkLayer=networkLayer, \
                                                                             nodeLayer=nodeLayer, geomType=geomType, deltaLinesCheckList=deltaLinesCheckList)
                     # keep track of all modifications made
                     if flippedLinesIds_:
@@ -602,25 +615,22 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
                     # get next nodes connected to invalid lines
                     for line in inval.values():
                         if line in endLines:
-                            removeNode.append(self.getFirstNode(lyr=networkLayer, feat=line))
+                            removeNode.add(graph.getNodeId(self.getFirstNode(lyr=networkLayer, feat=line)))
                         else:
-                            removeNode.append(self.getLastNode(lyr=networkLayer, feat=line))
+                            removeNode.add(graph.getNodeId(self.getLastNode(lyr=networkLayer, feat=line)))
                 # set node as visited
-                if node not in visitedNodes:
-                    visitedNodes.append(node)
+                visitedNodes.add(nodeId)
                 # update general dictionaries with final values
                 validLines.update(val)
+                validLinesSet.update(val.values())
                 invalidLines.update(inval)
                 # get next iteration nodes
-                newNextNodes += self.getNextNodes(node=node, networkLayer=networkLayer, geomType=geomType)
+                newNextNodes.update(graph.getNeighbours(nodeId))
                 # remove next nodes connected to invalid lines
-                if removeNode:
-                    newNextNodes = list( set(newNextNodes) - set(removeNode) )
+                newNextNodes -= removeNode
             # remove nodes that were already visited
-            newNextNodes = list( set(newNextNodes) - set(visitedNodes) )
             # if new nodes are detected, repeat for those
-            nodeList = newNextNodes
-            newNextNodes = []
+            nodeList = sorted(newNextNodes - visitedNodes)
         # log all features that were merged and/or flipped
         self.logAlteredFeatures(flippedLines=flippedLinesIds, mergedLinesString=mergedLinesString)
         return nodeFlags, invalidLines, validLines
@@ -748,7 +758,10 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
         line_a = self.nodeDict[node]['end'][0]
         line_b = self.nodeDict[node]['start'][0]
         # lines have their order changed so that the deleted line is the intial one
-        self.DsgGeometryHandler.mergeLines(line_a=line_b, line_b=line_a, layer=networkLayer)
+        if self.DsgGeometryHandler.mergeLines(line_a=line_b, line_b=line_a, layer=networkLayer) and self.networkGraph:
+            # line_b takes the place of line_a on graph
+            self.networkGraph.mergeEdges(keptEdge=self.networkGraph.getEdgeId(line_b.id()), removedEdge=self.networkGraph.getEdgeId(line_a.id()), \
+                                         node=self.networkGraph.getNodeId(node))
         # the updated feature should be updated into node dict for the NEXT NODE!
         nn = self.getLastNode(lyr=networkLayer, feat=line_b, geomType=1)
         for line in self.nodeDict[nn]['end']:
@@ -1085,6 +1098,8 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
             self.nodeDict = self.createNetworkNodesProcess.identifyAllNodes(networkLayer=networkLayer)
             # update createNetworkNodesProcess object node dictionary
             self.createNetworkNodesProcess.nodeDict = self.nodeDict
+            # network graph shared with createNetworkNodesProcess object
+            self.networkGraph = self.createNetworkNodesProcess.networkGraph
             self.nodeTypeDict, self.nodeIdDict = self.getNodeTypeDictFromNodeLayer(networkNodeLayer=networkNodeLayer)
             # initiate nodes, invalid/valid lines dictionaries
             nodeFlags, inval, val = dict(), dict(), dict()
@@ -1160,8 +1175,8 @@ class VerifyNetworkDirectioningProcess(ValidationProcess):
                 # pop all nodes to be popped and reset list
                 for node in self.nodesToPop:
                     # those were nodes connected to lines that were merged and now are no longer to be used
-                    self.nodeDict.pop(key, None)
-                    self.createNetworkNodesProcess.nodeDict.pop(key, None)
+                    self.nodeDict.pop(node, None)
+                    self.createNetworkNodesProcess.nodeDict.pop(node, None)
                 self.nodesToPop = []
             # if there are no starting nodes into network, a warning is raised
             if not isinstance(val, dict):
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ DsgTools
+                                 A QGIS plugin
+ Brazilian Army Cartographic Production Tools
+                              -------------------
+        begin                : 2018-03-27
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Philipe Borba - Cartographic Engineer @ Brazilian Army
+        email                : borba.philipe@eb.mil.br
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from PyQt4.QtCore import QObject
+
+from qgis.core import QgsMapLayerRegistry, QgsMessageLog, QgsProject
+
+class StagingCache(QObject):
+    def __init__(self, abstractDb):
+        """
+        Session cache of the temp tables (with their spatial index) made by ValidationProcess.prepareExecution.
+        Read-only processes share the staged copy of a layer while the layer, its selection and its edit buffer
+        stay the same. A staged table is dropped when its layer changes, when its layer is removed, when the
+        project is cleared and when the session ends (clear). teardown must be called when the cache is discarded.
+        :param abstractDb: (PostgisDb) database where the temp tables are made.
+        """
+        super(StagingCache, self).__init__()
+        self.abstractDb = abstractDb
+        # { temp table name : { 'key' : (layer id, geometry column, selected ids), 'keyColumn' : key column, 'rowCount' : staged features } }
+        self.entryDict = dict()
+        # { layer id : (layer, slot connected to its layerModified and editingStopped signals) }
+        self.layerSlotDict = dict()
+        QgsMapLayerRegistry.instance().layersWillBeRemoved.connect(self.onLayersWillBeRemoved)
+        QgsProject.instance().cleared.connect(self.clear)
+
+    def getKey(self, lyr, geometryColumn, selectedFeatures):
+        """
+        Gets the key of a staged copy of lyr
+        """
+        selection = tuple(sorted(lyr.selectedFeaturesIds())) if selectedFeatures else None
+        return (lyr.id(), geometryColumn, selection)
+
+    def getEntry(self, processTableName, lyr, geometryColumn, selectedFeatures):
+        """
+        Gets the entry (keyColumn and rowCount) of processTableName if it holds an up to date copy of lyr, None otherwise
+        """
+        entry = self.entryDict.get(processTableName)
+        if entry is None or entry['key'] != self.getKey(lyr, geometryColumn, selectedFeatures):
+            return None
+        return entry
+
+    def register(self, processTableName, lyr, geometryColumn, selectedFeatures, keyColumn, rowCount):
+        """
+        Registers processTableName as the staged copy of lyr. Any edit on lyr invalidates it.
+        """
+        self.entryDict[processTableName] = {'key' : self.getKey(lyr, geometryColumn, selectedFeatures), 'keyColumn' : keyColumn, 'rowCount' : rowCount}
+        layerId = lyr.id()
+        if layerId in self.layerSlotDict:
+            return
+        slot = lambda : self.invalidateLayer(layerId)
+        # layerModified is emitted by every change of the edit buffer (including undo/redo),
+        # editingStopped covers commits and rollbacks
+        lyr.layerModified.connect(slot)
+        lyr.editingStopped.connect(slot)
+        self.layerSlotDict[layerId] = (lyr, slot)
+
+    def discard(self, processTableName):
+        """
+        Forgets processTableName without dropping it. Used when the table is going to be rewritten by a process.
+        """
+        self.entryDict.pop(processTableName, None)
+
+    def invalidateLayer(self, layerId):
+        """
+        Drops the staged copies of a layer
+        """
+        for processTableName in [k for k, v in self.entryDict.iteritems() if v['key'][0] == layerId]:
+            self.drop(processTableName)
+
+    def onLayersWillBeRemoved(self, layerIds):
+        for layerId in layerIds:
+            self.invalidateLayer(layerId)
+            self.disconnectLayer(layerId)
+
+    def disconnectLayer(self, layerId):
+        """
+        Disconnects the signals of a layer connected by register
+        """
+        if layerId not in self.layerSlotDict:
+            return
+        lyr, slot = self.layerSlotDict.pop(layerId)
+        try:
+            lyr.layerModified.disconnect(slot)
+            lyr.editingStopped.disconnect(slot)
+        except (TypeError, RuntimeError):
+            # the layer was already deleted
+            pass
+
+    def drop(self, processTableName):
+        """
+        Drops a staged table
+        """
+        self.entryDict.pop(processTableName, None)
+        try:
+            self.abstractDb.dropTempTable(processTableName)
+        except Exception as e:
+            QgsMessageLog.logMessage(':'.join(e.args), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
+
+    def clear(self):
+        """
+        Drops all staged tables. Must be called when the session ends. The cache may be used again afterwards.
+        """
+        for processTableName in self.entryDict.keys():
+            self.drop(processTableName)
+
+    def teardown(self):
+        """
+        Drops all staged tables and disconnects every signal. The cache must not be used afterwards.
+        """
+        self.clear()
+        for layerId in self.layerSlotDict.keys():
+            self.disconnectLayer(layerId)
+        for signal, slot in [(QgsMapLayerRegistry.instance().layersWillBeRemoved, self.onLayersWillBeRemoved),
+                             (QgsProject.instance().cleared, self.clear)]:
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
@@ -23,6 +23,7 @@
 import os
 from qgis.core import QgsMessageLog
 from DsgTools.ValidationTools.processParametersDialog import ProcessParametersDialog
+from DsgTools.ValidationTools.stagingCache import StagingCache
 
 from PyQt4.QtCore import Qt
 from PyQt4 import QtGui
@@ -41,6 +42,7 @@ class ValidationManager(QObject):
         self.processDict = dict()
         self.lastProcess = None
         self.lastParameters = None
+        self.stagingCache = StagingCache(self.postgisDb)
         try:
             #creating validation structure
             self.postgisDb.checkAndCreateValidationStructure()
@@ -171,6 +173,7 @@ class ValidationManager(QObject):
             process.setParameters(params)
             process.setDbUserName(self.postgisDb.getDatabaseParameters()[2])
             process.setProcessName(self.processDict[process.processAlias])
+            process.setStagingCache(self.stagingCache)
             ret = process.execute() # run bitch run!
             #status = currProc.getStatus() #must set status
             QgsMessageLog.logMessage(self.tr('Process {0} ran with status {1}\n').format(process.processAlias, process.getStatusMessage()), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
@@ -180,6 +183,18 @@ class ValidationManager(QObject):
                 return 0
         return 1
     
+    def clearStagingCache(self):
+        """
+        Drops the temp tables staged during this session
+        """
+        self.stagingCache.clear()
+
+    def teardown(self):
+        """
+        Drops the temp tables staged during this session and disconnects the staging cache. Used when the manager is discarded.
+        """
+        self.stagingCache.teardown()
+
     def getParametersWithUi(self, processChain, parameterDict):
         """
         Builds interface
@@ -227,6 +242,7 @@ class ValidationManager(QObject):
             params = dlg.values
             # adjusting the parameters in the process
             currProc.setParameters(params)
+        currProc.setStagingCache(self.stagingCache)
         #check status
         QgsMessageLog.logMessage('Process %s Log:\n' % currProc.getName(), "DSG Tools Plugin", QgsMessageLog.CRITICAL)
         ret = currProc.execute() #run bitch run!
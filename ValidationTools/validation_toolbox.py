@@ -75,6 +75,22 @@ class ValidationToolbox(QtGui.QDockWidget, FORM_CLASS):
         self.filterDict = {self.tr('Process Name'):DsgEnums.ProcessName, self.tr('Class Name'):DsgEnums.ClassName}
         self.processChanged = False # for processes filtering classes mechanics
 
+    def closeEvent(self, event):
+        """
+        Ends the validation session, dropping the staged temp tables
+        """
+        if self.validationManager:
+            self.validationManager.clearStagingCache()
+        super(ValidationToolbox, self).closeEvent(event)
+
+    def unload(self):
+        """
+        Ends the validation session for good (plugin unload), dropping the staged temp tables and disconnecting the staging cache
+        """
+        if self.validationManager:
+            self.validationManager.teardown()
+            self.validationManager = None
+
     def createContextMenu(self, position):
         """
         Creates the flag menu
@@ -205,6 +221,8 @@ class ValidationToolbox(QtGui.QDockWidget, FORM_CLASS):
             self.configWindow.widget.abstractDb.checkAndOpenDb()
             database = self.configWindow.widget.comboBoxPostgis.currentText()
             self.databaseLineEdit.setText(database)
+            if self.validationManager:
+                self.validationManager.teardown()
             self.validationManager = ValidationManager(self.configWindow.widget.abstractDb, self.iface)
             self.populateProcessList()
             self.databaseLineEdit.setText(database)
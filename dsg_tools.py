@@ -732,6 +732,10 @@ class DsgTools:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        if self.validationToolbox:
+            self.validationToolbox.unload()
+            self.iface.removeDockWidget(self.validationToolbox)
+
         if self.dsgTools is not None:
             self.menuBar.removeAction(self.dsgTools.menuAction())
         del self.dsgTools
@@ -74,7 +74,9 @@ class Options(QtGui.QDialog, FORM_CLASS):
         valueList = [self.blackListWidget.item(i).text() for i in range(self.blackListWidget.count())]
         undoPoints = self.undoQgsSpinBox.value()
         decimals = self.decimalQgsSpinBox.value()
-        return (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals)
+        flagPartitioning = self.flagPartitioningCheckBox.isChecked()
+        batchMaxWorkers = self.batchMaxWorkersQgsSpinBox.value()
+        return (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals, flagPartitioning, batchMaxWorkers)
 
     def loadParametersFromConfig(self):
         settings = QSettings()
@@ -86,13 +88,15 @@ class Options(QtGui.QDialog, FORM_CLASS):
         valueList = settings.value('valueList')
         undoPoints = settings.value('undoPoints')
         decimals = settings.value('decimals')
+        flagPartitioning = settings.value('flagPartitioning')
+        batchMaxWorkers = settings.value('batchMaxWorkers')
         if valueList:
             valueList = valueList.split(';')
         settings.endGroup()
-        return (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals)
+        return (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals, flagPartitioning, batchMaxWorkers)
     
     def setInterfaceWithParametersFromConfig(self):
-        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals) = self.loadParametersFromConfig()
+        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals, flagPartitioning, batchMaxWorkers) = self.loadParametersFromConfig()
         
         if freeHandTolerance:
             self.toleranceQgsDoubleSpinBox.setValue(float(freeHandTolerance))
@@ -110,9 +114,13 @@ class Options(QtGui.QDialog, FORM_CLASS):
             self.undoQgsSpinBox.setValue(int(undoPoints))
         if decimals:
             self.decimalQgsSpinBox.setValue(int(decimals))
+        if flagPartitioning:
+            self.flagPartitioningCheckBox.setChecked(flagPartitioning in (True, 'true', '1'))
+        if batchMaxWorkers:
+            self.batchMaxWorkersQgsSpinBox.setValue(int(batchMaxWorkers))
     
     def storeParametersInConfig(self):
-        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals) = self.getParameters()
+        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals, flagPartitioning, batchMaxWorkers) = self.getParameters()
         settings = QSettings()
         settings.beginGroup('PythonPlugins/DsgTools/Options')
         settings.setValue('freeHandTolerance', freeHandTolerance)
@@ -122,6 +130,8 @@ class Options(QtGui.QDialog, FORM_CLASS):
         settings.setValue('valueList', ';'.join(valueList))
         settings.setValue('undoPoints', undoPoints)
         settings.setValue('decimals', decimals)
+        settings.setValue('flagPartitioning', flagPartitioning)
+        settings.setValue('batchMaxWorkers', batchMaxWorkers)
         settings.endGroup()
     
     @pyqtSlot()
@@ -141,7 +151,7 @@ class Options(QtGui.QDialog, FORM_CLASS):
             self.blackListWidget.takeItem(i)
     
     def firstTimeConfig(self):
-        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals) = self.loadParametersFromConfig()
+        (freeHandTolerance, freeHandSmoothIterations, freeHandSmoothOffset, algIterations, valueList, undoPoints, decimals, flagPartitioning, batchMaxWorkers) = self.loadParametersFromConfig()
         if not (freeHandTolerance and freeHandSmoothIterations and freeHandSmoothOffset and algIterations and valueList and undoPoints and decimals):
             self.storeParametersInConfig()
         